@@ -14,17 +14,18 @@ supported by this package include:
 cosmic-ray cleaned, and combined image as a FITS file.
 
 """
+import importlib
 import os
 import re
 import sys
-from pkg_resources import get_distribution, DistributionNotFound
+from importlib.metadata import version, PackageNotFoundError
 
 __version_commit__ = ''
 _regex_git_hash = re.compile(r'.*\+g(\w+)')
 
 try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
+    __version__ = version(__name__)
+except PackageNotFoundError:
     __version__ = 'dev'
 
 if '+' in __version__:
@@ -36,61 +37,74 @@ if '+' in __version__:
 #if sys.version_info < (3, 8):
 #    raise ImportError("Drizzlepac requires Python 3.8 and above.")
 
-from . import ablot
-from . import adrizzle
-from . import astrodrizzle
-from . import buildmask
-from . import createMedian
-from . import drizCR
-from . import imageObject
-from . import mapreg
-from . import mdzhandler
-from . import outputimage
-from . import photeq
-from . import processInput
-from . import resetbits
-from . import sky
-from . import staticMask
-from . import util
-from . import wcs_functions
-
-
-# These modules provide the user-interfaces to coordinate transformation tasks
-from . import pixtosky
-from . import skytopix
-from . import pixtopix
-
-# The following modules are for 'tweakreg' and are included here to make
-# it easier to get to this code interactively
-try:
-    from . import tweakreg, catalogs, imgclasses, tweakutils, mapreg, photeq, \
-                  imagefindpars, refimagefindpars
-except ImportError as e :
-    print('The libraries needed for "tweakreg" were not available!')
-    print('None of the code related to that task can be used at this time.')
-    print('   (If you want to report this error, the details are "%s")'%(str(e)))
-
-# Add updatenpol to the list of tasks imported automatically here
-from . import updatenpol
-from . import buildwcs
-
-# This module supports applying WCS from _drz to _flt files
-from . import tweakback
+# Task modules are imported when first accessed as attributes of the package
+# (PEP 562), so that importing one of them (for instance in worker processes)
+# does not import all the others along with their dependencies.
+_submodules = [
+    'ablot',
+    'adrizzle',
+    'astrodrizzle',
+    'buildmask',
+    'createMedian',
+    'drizCR',
+    'imageObject',
+    'mapreg',
+    'mdzhandler',
+    'outputimage',
+    'photeq',
+    'processInput',
+    'resetbits',
+    'sky',
+    'staticMask',
+    'util',
+    'wcs_functions',
+    # These modules provide the user-interfaces to coordinate transformation
+    # tasks
+    'pixtosky',
+    'skytopix',
+    'pixtopix',
+    # The following modules are for 'tweakreg' and are included here to make
+    # it easier to get to this code interactively
+    'tweakreg',
+    'catalogs',
+    'imgclasses',
+    'tweakutils',
+    'imagefindpars',
+    'refimagefindpars',
+    'updatenpol',
+    'buildwcs',
+    # This module supports applying WCS from _drz to _flt files
+    'tweakback',
+    # This module enables users to replace NaNs in images with another value
+    # easily
+    'pixreplace',
+    'haputils',
+    'align',
+    'runastrodriz',
+]
+
+__all__ = _submodules + ['help']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
 
-# This module enables users to replace NaNs in images with another value easily
-from . import pixreplace
-
-from . import haputils
-from . import align
-from . import runastrodriz
 
 # These lines allow TEAL to print out the names of TEAL-enabled tasks
-# upon importing this package.
-from stsci.tools import teal
-
+# upon importing this package in an interactive session (sys.ps1 is only
+# defined in interactive mode).
+if hasattr(sys, 'ps1'):
+    from stsci.tools import teal
 
-teal.print_tasknames(__name__, os.path.dirname(__file__),
-                     hidden=['adrizzle','ablot','buildwcs'])
+    teal.print_tasknames(__name__, os.path.dirname(__file__),
+                         hidden=['adrizzle','ablot','buildwcs'])
 
 
 def help():
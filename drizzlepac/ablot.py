@@ -10,15 +10,23 @@ cosmic-rays.
 """
 import os
 import sys
+import copy
+import functools
 import numpy as np
-from stsci.tools import fileutil, teal, logutil
+from astropy.io import fits
+from stsci.tools import fileutil, teal, logutil, mputil
+from . import adrizzle
 from . import outputimage
+from . import pixmap_cache
 from . import wcs_functions
 from . import processInput
 from . import util
 import stwcs
 from stwcs import distortion
 
+if util.can_parallel:
+    import multiprocessing
+
 try:
     from . import cdriz
 except ImportError:
@@ -34,6 +42,10 @@ __all__ = ['blot', 'runBlot', 'help', 'getHelpAsString']
 __taskname__ = 'ablot'
 _blot_step_num_ = 5
 
+# Number of pixels of the median image kept around the area covered by a
+# cropped single drizzle product, as needed by the interpolation kernels
+_blot_margin_ = 16
+
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
 
@@ -182,8 +194,11 @@ def runBlot(imageObjectList, output_wcs, configObj={},
         log.info('USER INPUT PARAMETERS for Blot Step:')
         util.printParams(paramDict, log=log)
 
+        worker_times = util.WorkerTimes()
         run_blot(imageObjectList, output_wcs.single_wcs, paramDict,
-                 wcsmap=wcsmap)
+                 wcsmap=wcsmap, worker_times=worker_times)
+        if procSteps is not None:
+            procSteps.addWorkerTimes('Blot', worker_times)
     else:
         log.info('Blot step not performed.')
 
@@ -200,7 +215,9 @@ def buildBlotParamDict(configObj):
                 'blot_sinscl':configObj[blot_name]['blot_sinscl'],
                 'blot_addsky':configObj[blot_name]['blot_addsky'],
                 'blot_skyval':configObj[blot_name]['blot_skyval'],
-                'coeffs':configObj['coeffs']}
+                'coeffs':configObj['coeffs'],
+                'num_cores':configObj.get('num_cores'),
+                'parallel_backend':configObj.get('parallel_backend', 'process')}
     return paramDict
 
 def _setDefaults(configObj={}):
@@ -234,12 +251,26 @@ def _setDefaults(configObj={}):
 
     return paramDict
 
-def run_blot(imageObjectList,output_wcs,paramDict,wcsmap=wcs_functions.WCSMap):
+def run_blot(imageObjectList, output_wcs, paramDict,
+             wcsmap=wcs_functions.WCSMap, worker_times=None):
     """
-    run_blot(imageObjectList, output_wcs, paramDict, wcsmap=wcs_functions.WCSMap)
+    run_blot(imageObjectList, output_wcs, paramDict,
+             wcsmap=wcs_functions.WCSMap, worker_times=None)
 
     Perform the blot operation on the list of images.
+
+    The median image is read only once (memory-mapped when it is a file) and
+    shared by all chips. Chips get blotted by parallel workers when
+    ``num_cores`` in ``paramDict`` allows it: in a pool of threads when its
+    ``parallel_backend`` is ``'thread'`` or the products are kept in memory,
+    and in forked processes otherwise. Each worker writes out the blotted
+    image of a chip as soon as it is done. When given a
+    `~drizzlepac.util.WorkerTimes` object, ``worker_times`` receives the
+    number of workers that were used and the times spent on each chip.
     """
+    if worker_times is None:
+        worker_times = util.WorkerTimes()
+
     # Insure that input imageObject is a list
     if not isinstance(imageObjectList, list):
         imageObjectList = [imageObjectList]
@@ -251,79 +282,180 @@ def run_blot(imageObjectList,output_wcs,paramDict,wcsmap=wcs_functions.WCSMap):
                  'PyFITS':util.__fits_version__,
                  'Numpy':util.__numpy_version__}
 
-    _hdrlist = []
+    chips = [(img, chip) for img in imageObjectList
+             for chip in img.returnAllChips(extname=img.scienceExt)]
+    for img, chip in chips:
+        chip.outputNames['driz_version'] = _versions['AstroDrizzle']
 
+    # all images normally share the same median image: load each one once
+    medians = {}
+    opened = []
     for img in imageObjectList:
+        name = img.outputNames['outMedian']
+        if name not in medians:
+            medians[name], hdulist = _load_median(img)
+            if hdulist is not None:
+                opened.append(hdulist)
+
+    pool_size = util.get_pool_size(paramDict.get('num_cores'), len(chips))
+    use_threads = (paramDict.get('parallel_backend', 'process') == 'thread' or
+                   imageObjectList[0].inmemory)
+
+    if pool_size > 1:
+        worker_times.workers = pool_size
+        worker_times.backend = 'thread' if use_threads else 'process'
+
+    try:
+        if pool_size > 1 and use_threads:
+            log.info(f'Executing {pool_size:d} parallel threads')
+            # 'cdriz.tblot' releases the GIL; each thread gets its own copy
+            # of the WCS shared by all chips as it may be modified by the
+            # mapping.
+            tasks = [functools.partial(worker_times.wrap(chip.sciname,
+                                                         _run_blot_chip),
+                                       img, chip,
+                                       medians[img.outputNames['outMedian']],
+                                       copy.deepcopy(output_wcs), paramDict,
+                                       _versions, wcsmap)
+                     for img, chip in chips]
+            util.launch_threads_and_wait(tasks, pool_size)
+
+        elif pool_size > 1:
+            log.info(f'Executing {pool_size:d} parallel workers')
+            # forked workers share the (memory-mapped) median image
+            mp_ctx = multiprocessing.get_context('fork')
+            subprocs = [
+                mp_ctx.Process(
+                    target=worker_times.wrap(chip.sciname, _run_blot_chip,
+                                             process=True),
+                    name='ablot._run_blot_chip()',  # for err msgs
+                    args=(img, chip, medians[img.outputNames['outMedian']],
+                          output_wcs, paramDict, _versions, wcsmap)
+                )
+                for img, chip in chips
+            ]
+            mputil.launch_and_wait(subprocs, pool_size)  # blocks till all done
+
+        else:
+            for img, chip in chips:
+                timed_blot_chip = worker_times.wrap(chip.sciname,
+                                                    _run_blot_chip)
+                timed_blot_chip(img, chip,
+                                medians[img.outputNames['outMedian']],
+                                output_wcs, paramDict, _versions, wcsmap)
+
+    finally:
+        medians.clear()
+        for hdulist in opened:
+            hdulist.close()
+
+
+def _load_median(img):
+    """ Return the median image data of ``img``, as an array, together with
+    the `~astropy.io.fits.HDUList` to be closed once done with it (`None`
+    for a median image kept in memory). Median image files are
+    memory-mapped, so that their data get shared by all blotting workers.
+    """
+    medianPar = 'outMedian'
+    outMedianObj = img.getOutputName(medianPar)
+    if img.inmemory:
+        outMedian = img.outputNames[medianPar]
+        _fname,_sciextn = fileutil.parseFilename(outMedian)
+        return fileutil.getExtn(outMedianObj, _sciextn).data, None
+
+    _fname,_sciextn = fileutil.parseFilename(outMedianObj)
+    _inimg = fits.open(_fname, memmap=True, mode='readonly')
+    return fileutil.getExtn(_inimg, _sciextn).data, _inimg
+
+
+def _run_blot_chip(img, chip, median, output_wcs, paramDict, _versions,
+                   wcsmap):
+    """ Blot the ``median`` image data back to a single chip and write out
+    (or save in memory) the blotted image. """
+    print('    Blot: creating blotted image: ',chip.outputNames['data'])
+
+    #### Check to see what names need to be included here for use in _hdrlist
+    outputvals = chip.outputNames.copy()
+    outputvals.update(img.outputValues)
+    outputvals['blotnx'] = chip.wcs.naxis1
+    outputvals['blotny'] = chip.wcs.naxis2
+    _hdrlist = [outputvals]
+
+    plist = outputvals.copy()
+    plist.update(paramDict)
+
+    # When the single drizzle product for this image was cropped, only the
+    # matching part of the median image is needed for blotting. The median
+    # image is only read (and converted, as needed, by 'cdriz.tblot'), so
+    # no copy of it is made here.
+    source_wcs = output_wcs
+    box = _single_box(img)
+    if box is None:
+        _insci = median
+    else:
+        # keep enough margin around the box for the interpolation kernels
+        ny, nx = median.shape
+        box = (max(box[0] - _blot_margin_, 0), max(box[1] - _blot_margin_, 0),
+               min(box[2] + _blot_margin_, nx - 1),
+               min(box[3] + _blot_margin_, ny - 1))
+        _insci = median[box[1]:box[3] + 1, box[0]:box[2] + 1]
+        source_wcs = adrizzle._crop_wcs(output_wcs, box)
+
+    _outsci = do_blot(_insci, source_wcs,
+           chip.wcs, chip._exptime, coeffs=paramDict['coeffs'],
+           interp=paramDict['blot_interp'], sinscl=paramDict['blot_sinscl'],
+           wcsmap=wcsmap)
+    # Apply sky subtraction and unit conversion to blotted array to
+    # match un-modified input array
+    if paramDict['blot_addsky']:
+        skyval = chip.computedSky
+    else:
+        skyval = paramDict['blot_skyval']
+    _outsci /= chip._conversionFactor
+    if skyval is not None:
+        _outsci += skyval
+        log.info('Applying sky value of %0.6f to blotted image %s'%
+                    (skyval,chip.outputNames['data']))
+
+    # Write output Numpy objects to a PyFITS file
+    # Blotting only occurs from a drizzled SCI extension
+    # to a blotted SCI extension...
+
+    _outimg = outputimage.OutputImage(_hdrlist, paramDict, build=False, wcs=chip.wcs, blot=True)
+    _outimg.outweight = None
+    _outimg.outcontext = None
+    outimgs = _outimg.writeFITS(plist['data'],_outsci,None,
+                        versions=_versions,blend=False,
+                        virtual=img.inmemory)
+
+    img.saveVirtualOutputs(outimgs)
+    #_buildOutputFits(_outsci,None,plist['outblot'])
+
+    del _outsci, _outimg
+
+
+def _single_box(img):
+    """ Return the box ``(xmin, ymin, xmax, ymax)`` covered on the output
+    frame by the single drizzle product of ``img`` when it was cropped (see
+    `outputimage.getFrameOffset`), or `None` if it covers the full frame.
+    """
+    single = img.getOutputName('outSingle')
+    if isinstance(single, str):
+        if not os.path.exists(single):
+            return None
+        with fits.open(single, memmap=False) as hdulist:
+            headers = [hdu.header for hdu in hdulist]
+    elif single is not None:
+        headers = [hdu.header for hdu in single]
+    else:
+        return None
 
-        for chip in img.returnAllChips(extname=img.scienceExt):
-
-            print('    Blot: creating blotted image: ',chip.outputNames['data'])
-
-            #### Check to see what names need to be included here for use in _hdrlist
-            chip.outputNames['driz_version'] = _versions['AstroDrizzle']
-            outputvals = chip.outputNames.copy()
-            outputvals.update(img.outputValues)
-            outputvals['blotnx'] = chip.wcs.naxis1
-            outputvals['blotny'] = chip.wcs.naxis2
-            _hdrlist.append(outputvals)
-
-            plist = outputvals.copy()
-            plist.update(paramDict)
-
-            # PyFITS can be used here as it will always operate on
-            # output from PyDrizzle (which will always be a FITS file)
-            # Open the input science file
-            medianPar = 'outMedian'
-            outMedianObj = img.getOutputName(medianPar)
-            if img.inmemory:
-                outMedian = img.outputNames[medianPar]
-                _fname,_sciextn = fileutil.parseFilename(outMedian)
-                _inimg = outMedianObj
-            else:
-                outMedian = outMedianObj
-                _fname,_sciextn = fileutil.parseFilename(outMedian)
-                _inimg = fileutil.openImage(_fname, memmap=False)
-
-            # Return the PyFITS HDU corresponding to the named extension
-            _scihdu = fileutil.getExtn(_inimg,_sciextn)
-            _insci = _scihdu.data.copy()
-            _inimg.close()
-            del _inimg, _scihdu
-
-            _outsci = do_blot(_insci, output_wcs,
-                   chip.wcs, chip._exptime, coeffs=paramDict['coeffs'],
-                   interp=paramDict['blot_interp'], sinscl=paramDict['blot_sinscl'],
-                   wcsmap=wcsmap)
-            # Apply sky subtraction and unit conversion to blotted array to
-            # match un-modified input array
-            if paramDict['blot_addsky']:
-                skyval = chip.computedSky
-            else:
-                skyval = paramDict['blot_skyval']
-            _outsci /= chip._conversionFactor
-            if skyval is not None:
-                _outsci += skyval
-                log.info('Applying sky value of %0.6f to blotted image %s'%
-                            (skyval,chip.outputNames['data']))
-
-            # Write output Numpy objects to a PyFITS file
-            # Blotting only occurs from a drizzled SCI extension
-            # to a blotted SCI extension...
-
-            _outimg = outputimage.OutputImage(_hdrlist, paramDict, build=False, wcs=chip.wcs, blot=True)
-            _outimg.outweight = None
-            _outimg.outcontext = None
-            outimgs = _outimg.writeFITS(plist['data'],_outsci,None,
-                                versions=_versions,blend=False,
-                                virtual=img.inmemory)
-
-            img.saveVirtualOutputs(outimgs)
-            #_buildOutputFits(_outsci,None,plist['outblot'])
-            _hdrlist = []
-
-            del _outsci
-
-        del _outimg
+    for hdr in headers:
+        frame_offset = outputimage.getFrameOffset(hdr)
+        if frame_offset is not None:
+            x0, y0 = frame_offset[:2]
+            return (x0, y0, x0 + hdr['NAXIS1'] - 1, y0 + hdr['NAXIS2'] - 1)
+    return None
 
 
 def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
@@ -391,7 +523,7 @@ def do_blot(source, source_wcs, blot_wcs, exptime, coeffs = True,
         Use default C mapping function.
         """
         print('Using default C-based coordinate transformation...')
-        mapping = cdriz.DefaultWCSMapping(
+        mapping = pixmap_cache.get_mapping(
             blot_wcs, source_wcs,
             blot_wcs.pixel_shape[0], blot_wcs.pixel_shape[1],
             stepsize
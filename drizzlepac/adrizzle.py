@@ -8,13 +8,15 @@ Interfaces to main drizzle functions.
 """
 import os
 import copy
+import functools
+import mmap
 import time
 import platform
 from . import util
 import numpy as np
 from astropy.io import fits
 from stsci.tools import fileutil, logutil, mputil, teal
-from . import outputimage, wcs_functions
+from . import outputimage, pixmap_cache, shared_outputs, wcs_functions
 import stwcs
 from stwcs import distortion
 
@@ -41,6 +43,14 @@ __taskname__ = "adrizzle"
 _single_step_num_ = 3
 _final_step_num_ = 7
 
+# Smallest number of output rows worth handing to a separate worker when
+# the final drizzle is split into bands of output rows
+_final_band_min_rows_ = 256
+
+# Number of extra output pixels kept around the footprint of each input
+# (beyond the size of the drizzle kernel) in cropped single drizzle products
+_crop_margin_ = 2
+
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
 time_pre_all = []
@@ -346,6 +356,7 @@ def drizSeparate(imageObjectList, output_wcs, configObj,
         # Record whether or not intermediate files should be deleted when finished
         paramDict['clean'] = configObj['STATE OF INPUT FILES']['clean']
         paramDict['num_cores'] = configObj.get('num_cores')
+        paramDict['parallel_backend'] = configObj.get('parallel_backend', 'process')
         paramDict['rules_file'] = configObj['rules_file'] if configObj['rules_file'] != "" else None
 
         log.info('USER INPUT PARAMETERS for Separate Drizzle Step:')
@@ -356,8 +367,12 @@ def drizSeparate(imageObjectList, output_wcs, configObj,
         # override configObj[build] value with the value of the build parameter
         # this is necessary in order for AstroDrizzle to always have build=False
         # for single-drizzle step when called from the top-level.
+        worker_times = util.WorkerTimes()
         run_driz(imageObjectList, output_wcs.single_wcs, paramDict, single=True,
-                 build=False, wcsmap=wcsmap)
+                 build=False, wcsmap=wcsmap,
+                 worker_times=worker_times)
+        if procSteps is not None:
+            procSteps.addWorkerTimes('Separate Drizzle', worker_times)
     else:
         log.info('Single drizzle step not performed.')
 
@@ -389,14 +404,20 @@ def drizFinal(imageObjectList, output_wcs, configObj,
             build = paramDict['build']
         # Record whether or not intermediate files should be deleted when finished
         paramDict['clean'] = configObj['STATE OF INPUT FILES']['clean']
+        paramDict['num_cores'] = configObj.get('num_cores')
+        paramDict['parallel_backend'] = configObj.get('parallel_backend', 'process')
 
         paramDict['logfile'] = logfile
 
         log.info('USER INPUT PARAMETERS for Final Drizzle Step:')
         util.printParams(paramDict, log=log)
 
+        worker_times = util.WorkerTimes()
         run_driz(imageObjectList, output_wcs.final_wcs, paramDict, single=False,
-                 build=build, wcsmap=wcsmap)
+                 build=build, wcsmap=wcsmap,
+                 worker_times=worker_times)
+        if procSteps is not None:
+            procSteps.addWorkerTimes('Final Drizzle', worker_times)
     else:
         log.info('Final drizzle step not performed.')
 
@@ -533,7 +554,8 @@ def interpret_maskval(paramDict):
         maskval = float(maskval)  # just to be clear and absolutely sure...
     return maskval
 
-def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None):
+def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None,
+             worker_times=None):
     """ Perform drizzle operation on input to create output.
     The input parameters originally was a list
     of dictionaries, one for each input, that matches the
@@ -545,7 +567,14 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
     Parameters required for input in paramDict:
         build,single,units,wt_scl,pixfrac,kernel,fillval,
         rot,scale,xsh,ysh,blotnx,blotny,outnx,outny,data
+
+    When given a `~drizzlepac.util.WorkerTimes` object, ``worker_times``
+    receives the number of parallel workers that were used and the times
+    spent on each input.
     """
+    if worker_times is None:
+        worker_times = util.WorkerTimes()
+
     # Insure that input imageObject is a list
     if not isinstance(imageObjectList, list):
         imageObjectList = [imageObjectList]
@@ -578,12 +607,47 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
     output_wcs.printwcs()
 
     # Will we be running in parallel?
+    backend = paramDict.get('parallel_backend', 'process')
     pool_size = util.get_pool_size(paramDict.get('num_cores'), len(imageObjectList))
-    run_parallel = single and pool_size > 1
-    if run_parallel:
+    run_parallel = single and pool_size > 1 and backend != 'openmp'
+    # Threads share all inputs and outputs with this process without any
+    # copying, which works because 'cdriz.tdriz' releases the GIL.
+    use_threads = backend == 'thread'
+    ybands = None
+    paramDict['num_threads'] = 1
+    if backend == 'openmp':
+        # Inputs get drizzled one at a time, each of them by several
+        # threads inside 'cdriz.tdriz' which split the output rows.
+        nbands = max(1, output_wcs.array_shape[0] // _final_band_min_rows_)
+        num_threads = util.get_pool_size(paramDict.get('num_cores'), nbands)
+        if num_threads > 1 and not getattr(cdriz, 'has_openmp', False):
+            log.warning('The drizzle C extension was built without OpenMP '
+                        'support: executing serially')
+        elif num_threads > 1:
+            paramDict['num_threads'] = num_threads
+            worker_times.workers = num_threads
+            worker_times.backend = 'openmp'
+            log.info(f'Executing with {num_threads:d} parallel threads per input')
+        else:
+            log.info('Executing serially')
+    elif run_parallel:
+        worker_times.workers = pool_size
+        worker_times.backend = 'thread' if use_threads else 'process'
         log.info(f'Executing {pool_size:d} parallel workers')
+    elif single:
+        log.info('Executing serially')
     else:
-        if single:  # not yet an option for final drizzle, msg would confuse
+        # The final drizzle combines all inputs into a single output, so it
+        # gets split into bands of output rows instead, with each worker
+        # updating only its own band for every input chip in turn.
+        nbands = output_wcs.array_shape[0] // _final_band_min_rows_
+        pool_size = util.get_pool_size(paramDict.get('num_cores'), nbands)
+        if pool_size > 1:
+            ybands = _split_output_rows(output_wcs.array_shape[0], pool_size)
+            worker_times.workers = pool_size
+            worker_times.backend = 'thread' if use_threads else 'process'
+            log.info(f'Executing {pool_size:d} parallel workers over bands of output rows')
+        else:
             log.info('Executing serially')
 
     # Set parameters for each input and run drizzle on it here.
@@ -616,16 +680,26 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
     # with respect to byteorder and byteswapping.
     # This buffer should be reused for each input if possible.
     #
+    # Cropped single drizzle products get sized for each input separately
+    crop = single and paramDict.get('crop', False)
+
     _outsci = _outwht = _outctx = _hdrlist = None
     if (not single) or \
-       (single and (not run_parallel) and (not imageObjectList[0].inmemory)):
+       (single and (not run_parallel) and (not imageObjectList[0].inmemory)
+        and not crop):
         # Note there are four cases/combinations for single drizzle alone here:
         # (not-inmem, serial), (not-inmem, parallel), (inmem, serial), (inmem, parallel)
-        _outsci = np.empty(output_wcs.array_shape, dtype=np.float32)
+        if ybands is None or use_threads:
+            _outsci = np.empty(output_wcs.array_shape, dtype=np.float32)
+            _outwht = np.zeros(output_wcs.array_shape, dtype=np.float32)
+            # initialize context to 3-D array but only pass appropriate plane to drizzle as needed
+            _outctx = np.zeros((_nplanes,) + output_wcs.array_shape, dtype=np.int32)
+        else:
+            # output bands get updated in place by forked workers
+            _outsci = _shared_zeros(output_wcs.array_shape, np.float32)
+            _outwht = _shared_zeros(output_wcs.array_shape, np.float32)
+            _outctx = _shared_zeros((_nplanes,) + output_wcs.array_shape, np.int32)
         _outsci.fill(maskval)
-        _outwht = np.zeros(output_wcs.array_shape, dtype=np.float32)
-        # initialize context to 3-D array but only pass appropriate plane to drizzle as needed
-        _outctx = np.zeros((_nplanes,) + output_wcs.array_shape, dtype=np.int32)
         _hdrlist = []
 
     # Keep track of how many chips have been processed
@@ -638,6 +712,14 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
     # exposure time used to make this; in particular, TIME-OBS and DATE-OBS.
     template = None
 
+    # In-memory products of parallel processes are written directly into
+    # named shared memory and only their headers get sent back through the
+    # manager, from which they are rebuilt here without copying the arrays.
+    manager = None
+    shared_products = []
+    if run_parallel and not use_threads and imageObjectList[0].inmemory:
+        manager = multiprocessing.get_context('fork').Manager()
+
     #
     # Work on each image
     #
@@ -661,30 +743,60 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
         else:
             template.extend(fnames)
 
+        if crop:
+            box = _footprint_box(chiplist, output_wcs, paramDict['pixfrac'])
+            img_output_wcs = _crop_wcs(output_wcs, box)
+            img_outwcs = _crop_wcs(outwcs, box)
+            log.info('Cropping single drizzle product to [%d:%d, %d:%d]' %
+                     (box[0], box[2] + 1, box[1], box[3] + 1))
+        else:
+            img_output_wcs = output_wcs
+            img_outwcs = outwcs
+
         # Work each image, possibly in parallel
-        if run_parallel:
-            # use multiprocessing.Manager only if in parallel and in memory
+        if run_parallel and use_threads:
+            # threads update img.virtualOutputs directly, but each one needs
+            # its own WCS objects and parameters to modify
+            task = functools.partial(
+                worker_times.wrap(img._filename, run_driz_img), img, chiplist,
+                copy.deepcopy(img_output_wcs), copy.deepcopy(img_outwcs),
+                template, paramDict.copy(), single, num_in_prod, build,
+                _versions, _numctx, _nplanes, _chipIdx, None, None, None, None,
+                wcsmap
+            )
+            subprocs.append(task)
+        elif run_parallel:
             mp_ctx = multiprocessing.get_context('fork')
-
-            if img.inmemory:
-                manager = mp_ctx.Manager()
-                dproxy = manager.dict(img.virtualOutputs)  # copy & wrap it in proxy
-                img.virtualOutputs = dproxy
+            target = run_driz_img
+            args = (img, chiplist, img_output_wcs, img_outwcs, template,
+                    paramDict, single, num_in_prod, build, _versions, _numctx,
+                    _nplanes, _chipIdx, None, None, None, None, wcsmap)
+
+            if manager is not None:
+                shape = img_output_wcs.array_shape
+                outarrs = (shared_outputs.shared_zeros(shape, np.float32),
+                           shared_outputs.shared_zeros(shape, np.float32),
+                           shared_outputs.shared_zeros((_nplanes,) + shape,
+                                                       np.int32))
+                products = manager.dict()
+                shared_products.append((img, products, outarrs))
+                target = _run_driz_img_shared
+                args = (products,) + args[:13] + outarrs + ([], wcsmap)
 
             # parallelize run_driz_img (currently for separate drizzle only)
             p = mp_ctx.Process(
-                target=run_driz_img,
+                target=worker_times.wrap(img._filename, target, process=True),
                 name='adrizzle.run_driz_img()',  # for err msgs
-                args=(img, chiplist, output_wcs, outwcs, template, paramDict,
-                      single, num_in_prod, build, _versions, _numctx, _nplanes,
-                      _chipIdx, None, None, None, None, wcsmap)
+                args=args
             )
             subprocs.append(p)
         else:
             # serial run_driz_img run (either separate drizzle or final drizzle)
-            run_driz_img(img, chiplist, output_wcs, outwcs, template, paramDict,
-                         single, num_in_prod, build, _versions, _numctx, _nplanes,
-                         _chipIdx, _outsci, _outwht, _outctx, _hdrlist, wcsmap)
+            timed_run_driz_img = worker_times.wrap(img._filename, run_driz_img)
+            timed_run_driz_img(img, chiplist, img_output_wcs, img_outwcs,
+                               template, paramDict, single, num_in_prod, build,
+                               _versions, _numctx, _nplanes, _chipIdx, _outsci,
+                               _outwht, _outctx, _hdrlist, wcsmap, ybands=ybands)
 
         # Increment/reset master chip counter
         _chipIdx += len(chiplist)
@@ -692,8 +804,20 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
             _chipIdx = 0
 
     # do the join if we spawned tasks
-    if run_parallel:
-        mputil.launch_and_wait(subprocs, pool_size)  # blocks till all done
+    if run_parallel and use_threads:
+        util.launch_threads_and_wait(subprocs, pool_size)
+    elif run_parallel:
+        try:
+            mputil.launch_and_wait(subprocs, pool_size)  # blocks till all done
+            for img, products, _ in shared_products:
+                for name, product in products.items():
+                    img.virtualOutputs[name] = product.to_hdulist(unlink=True)
+        finally:
+            for _, _, outarrs in shared_products:
+                for arr in outarrs:
+                    shared_outputs.unlink(arr)
+            if manager is not None:
+                manager.shutdown()
 
     del _outsci, _outwht, _outctx, _hdrlist
     # have looped over each img/chip
@@ -705,11 +829,16 @@ def run_driz(imageObjectList, output_wcs, paramDict, single, build, wcsmap=None)
 
 def run_driz_img(img, chiplist, output_wcs, outwcs, template, paramDict, single,
                  num_in_prod, build, _versions, _numctx, _nplanes, chipIdxCopy,
-                 _outsci, _outwht, _outctx, _hdrlist, wcsmap):
+                 _outsci, _outwht, _outctx, _hdrlist, wcsmap, ybands=None):
     """ Perform the drizzle operation on a single image.
     This is separated out from :py:func:`run_driz` so as to keep together
     the entirety of the code which is inside the loop over
     images.  See the :py:func:`run_driz` code for more documentation.
+
+    If ``ybands`` is a list of ``(ymin, ymax)`` bands of output rows, each
+    chip gets drizzled by parallel workers, one per band. Unless
+    ``paramDict['parallel_backend']`` is ``'thread'``, this requires the
+    output arrays to be in shared memory.
     """
     maskval = interpret_maskval(paramDict)
 
@@ -741,7 +870,8 @@ def run_driz_img(img, chiplist, output_wcs, outwcs, template, paramDict, single,
         # run_driz_chip
         run_driz_chip(img, chip, output_wcs, outwcs, template, paramDict,
                       single, doWrite, build, _versions, _numctx, _nplanes,
-                      chipIdxCopy, _outsci, _outwht, _outctx, _hdrlist, wcsmap)
+                      chipIdxCopy, _outsci, _outwht, _outctx, _hdrlist, wcsmap,
+                      ybands=ybands)
 
         # Increment chip counter (also done outside of this function)
         chipIdxCopy += 1
@@ -751,7 +881,7 @@ def run_driz_img(img, chiplist, output_wcs, outwcs, template, paramDict, single,
     #
     if here:
         del _outsci, _outwht, _outctx, _hdrlist
-    elif single:
+    elif single and not img.inmemory:
         np.multiply(_outsci, 0., _outsci)
         np.multiply(_outwht, 0., _outwht)
         np.multiply(_outctx, 0, _outctx)
@@ -763,9 +893,23 @@ def run_driz_img(img, chiplist, output_wcs, outwcs, template, paramDict, single,
     # only if single and doWrite)
 
 
+def _run_driz_img_shared(products, img, *args):
+    """ Run :py:func:`run_driz_img` in a worker process and describe the
+    in-memory products it created in ``products``, a managed dictionary,
+    as `~drizzlepac.shared_outputs.SharedHDUList` objects. The output arrays
+    passed in ``args`` must be in named shared memory (see
+    :py:func:`~drizzlepac.shared_outputs.shared_zeros`).
+    """
+    before = dict(img.virtualOutputs)
+    run_driz_img(img, *args)
+    for name, product in img.virtualOutputs.items():
+        if product is not None and product is not before.get(name):
+            products[name] = shared_outputs.SharedHDUList(product)
+
+
 def run_driz_chip(img, chip, output_wcs, outwcs, template, paramDict, single,
                   doWrite, build, _versions, _numctx, _nplanes, _numchips,
-                  _outsci, _outwht, _outctx, _hdrlist, wcsmap):
+                  _outsci, _outwht, _outctx, _hdrlist, wcsmap, ybands=None):
     """ Perform the drizzle operation on a single chip.
     This is separated out from ``run_driz_img`` so as to keep together
     the entirety of the code which is inside the loop over
@@ -886,6 +1030,7 @@ def run_driz_chip(img, chip, output_wcs, outwcs, template, paramDict, single,
                             'cosmic ray mask to %s' % _expname)
         updateInputDQArray(chip.dqfile, chip.dq_extn, chip._chip,
                            crMaskName, paramDict['crbit'])
+        img.invalidateMasks(chip._chip)
 
     img.set_wtscl(chip._chip, paramDict['wt_scl'])
 
@@ -924,12 +1069,18 @@ def run_driz_chip(img, chip, output_wcs, outwcs, template, paramDict, single,
     time_pre = time.time() - epoch
     epoch = time.time()
     # New interface to performing the drizzle operation on a single chip/image
-    _vers = do_driz(_insci, chip.wcs, _inwht, outwcs, _outsci, _outwht, _outctx,
-                _expin, _in_units, chip._wtscl,
-                wcslin_pscale=chip.wcslin_pscale, uniqid=_uniqid,
-                pixfrac=paramDict['pixfrac'], kernel=paramDict['kernel'],
-                fillval=paramDict['fillval'], stepsize=paramDict['stepsize'],
-                wcsmap=wcsmap)
+    driz_args = (_insci, chip.wcs, _inwht, outwcs, _outsci, _outwht, _outctx,
+                 _expin, _in_units, chip._wtscl)
+    driz_kwargs = dict(wcslin_pscale=chip.wcslin_pscale, uniqid=_uniqid,
+                       pixfrac=paramDict['pixfrac'], kernel=paramDict['kernel'],
+                       fillval=paramDict['fillval'], stepsize=paramDict['stepsize'],
+                       wcsmap=wcsmap, num_threads=paramDict.get('num_threads', 1))
+    if ybands is None:
+        _vers = do_driz(*driz_args, **driz_kwargs)
+    else:
+        use_threads = paramDict.get('parallel_backend', 'process') == 'thread'
+        _vers = _do_driz_bands(ybands, driz_args, driz_kwargs,
+                               use_threads=use_threads)
     time_driz = time.time() - epoch
     epoch = time.time()
 
@@ -1030,17 +1181,156 @@ def run_driz_chip(img, chip, output_wcs, outwcs, template, paramDict, single,
             log.info('chip total writing output: %6.3f (%4.1f%%)' % (tot_write, (100. * tot_write / tot)))
 
 
+def _footprint_box(chiplist, output_wcs, pixfrac=1.0):
+    """ Bounding box of the footprints of all the chips in ``chiplist`` on
+    ``output_wcs``, as a ``(xmin, ymin, xmax, ymax)`` tuple of 0-based,
+    inclusive pixel indices.
+
+    The box gets grown by the largest size of a drizzle kernel (plus
+    ``_crop_margin_``) and clipped to the output frame. When none of the
+    chips overlaps the output frame, the box only contains the first pixel.
+    """
+    onx, ony = output_wcs.pixel_shape
+    xmin = ymin = np.inf
+    xmax = ymax = -np.inf
+
+    for chip in chiplist:
+        nx, ny = chip.wcs.pixel_shape
+        # sample the edges of the chip finely enough to follow distortion
+        xe = np.linspace(-0.5, nx - 0.5, max(nx // 32, 1) + 1)
+        ye = np.linspace(-0.5, ny - 0.5, max(ny // 32, 1) + 1)
+        x = np.concatenate([xe, xe, np.full_like(ye, -0.5),
+                            np.full_like(ye, nx - 0.5)])
+        y = np.concatenate([np.full_like(xe, -0.5), np.full_like(xe, ny - 0.5),
+                            ye, ye])
+        ra, dec = chip.wcs.all_pix2world(x, y, 0)
+        xo, yo = output_wcs.wcs_world2pix(ra, dec, 0)
+
+        # half-width of the largest (lanczos3) kernel, in output pixels
+        pix_ratio = output_wcs.pscale / chip.wcslin_pscale
+        kmargin = int(np.ceil(max(3.0 * pixfrac, 1.2) / pix_ratio)) + _crop_margin_
+
+        xmin = min(xmin, np.floor(xo.min()) - kmargin)
+        ymin = min(ymin, np.floor(yo.min()) - kmargin)
+        xmax = max(xmax, np.ceil(xo.max()) + kmargin)
+        ymax = max(ymax, np.ceil(yo.max()) + kmargin)
+
+    if not (xmax >= 0 and ymax >= 0 and xmin <= onx - 1 and ymin <= ony - 1):
+        return (0, 0, 0, 0)
+
+    return (int(max(xmin, 0)), int(max(ymin, 0)),
+            int(min(xmax, onx - 1)), int(min(ymax, ony - 1)))
+
+
+def _crop_wcs(wcs, box):
+    """ Return a copy of ``wcs`` for the ``(xmin, ymin, xmax, ymax)``
+    sub-image ``box`` of its frame (see :py:func:`_footprint_box`).
+
+    The position of the box on the full frame is recorded in the
+    ``frame_offset`` attribute of the new WCS as a
+    ``(xoffset, yoffset, framenx, frameny)`` tuple, for use by
+    `~drizzlepac.outputimage.OutputImage`.
+    """
+    x1, y1, x2, y2 = box
+    cropped = copy.deepcopy(wcs)
+    cropped.wcs.crpix = cropped.wcs.crpix - [x1, y1]
+    cropped.pixel_shape = (x2 - x1 + 1, y2 - y1 + 1)
+    cropped.wcs.set()
+    cropped.frame_offset = (x1, y1) + tuple(wcs.pixel_shape)
+    return cropped
+
+
+def _split_output_rows(ny, nbands):
+    """ Split ``ny`` output rows into ``nbands`` contiguous bands of
+    (nearly) equal size, returned as a list of ``(ymin, ymax)`` tuples of
+    0-based, inclusive row indices.
+    """
+    edges = np.linspace(0, ny, nbands + 1).astype(int)
+    return [(int(y1), int(y2) - 1) for y1, y2 in zip(edges[:-1], edges[1:])
+            if y2 > y1]
+
+
+def _shared_zeros(shape, dtype):
+    """ Return a zero-initialized array backed by anonymous shared memory
+    so that updates made by forked worker processes are seen by the parent.
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    buf = mmap.mmap(-1, max(count * dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=count).reshape(shape)
+
+
+def _do_driz_bands(ybands, driz_args, driz_kwargs, use_threads=False):
+    """ Run :py:func:`do_driz` for a single input with one worker per band
+    of output rows.
+
+    Each worker drizzles the whole input but only updates the output pixels
+    in its own band, so that the workers never write to the same pixels and
+    every output pixel receives its contributions in the same order as in
+    the serial case. Unless ``use_threads`` is `True`, the output arrays in
+    ``driz_args`` must be in shared memory (see :py:func:`_shared_zeros`)
+    and the first band is processed by the calling process itself.
+    """
+    if use_threads:
+        insci, input_wcs, inwht, output_wcs = driz_args[:4]
+        expin, in_units = driz_args[7:9]
+        if in_units != 'cps':
+            # 'tdriz' converts its input to count rates in place, which
+            # threads sharing the same input array must not do.
+            scale = np.float32(1.0) / np.float32(expin)
+            insci = insci.astype(np.float32) * scale
+            in_units = 'cps'
+        tasks = []
+        for yband in ybands:
+            # WCS objects get modified while computing the mapping
+            args = ((insci, copy.deepcopy(input_wcs), inwht,
+                     copy.deepcopy(output_wcs)) + tuple(driz_args[4:7]) +
+                    (expin, in_units) + tuple(driz_args[9:]))
+            tasks.append(functools.partial(do_driz, *args, yband=yband,
+                                           **driz_kwargs))
+        return util.launch_threads_and_wait(tasks, len(tasks))[0]
+
+    mp_ctx = multiprocessing.get_context('fork')
+    subprocs = []
+    for yband in ybands[1:]:
+        kwargs = dict(driz_kwargs, yband=yband)
+        p = mp_ctx.Process(target=do_driz, name='adrizzle.do_driz()',
+                           args=driz_args, kwargs=kwargs)
+        subprocs.append(p)
+        p.start()
+
+    try:
+        _vers = do_driz(*driz_args, yband=ybands[0], **driz_kwargs)
+    finally:
+        for p in subprocs:
+            p.join()
+
+    for p in subprocs:
+        if p.exitcode != 0:
+            raise RuntimeError("Problem during: " + str(p.name) +
+                               ', exitcode: ' + str(p.exitcode) + '. Check log.')
+    return _vers
+
+
 def do_driz(insci, input_wcs, inwht,
             output_wcs, outsci, outwht, outcon,
             expin, in_units, wt_scl,
             wcslin_pscale=1.0, uniqid=1, pixfrac=1.0, kernel='square',
-            fillval="INDEF", stepsize=10, wcsmap=None):
+            fillval="INDEF", stepsize=10, wcsmap=None, yband=None,
+            num_threads=1):
     """
     Core routine for performing 'drizzle' operation on a single input image
     All input values will be Python objects such as ndarrays, instead
     of filenames.
     File handling (input and output) will be performed by calling routine.
 
+    When ``yband`` is set to a ``(ymin, ymax)`` tuple of 0-based, inclusive
+    output row indices, only output pixels in those rows will be updated.
+
+    With ``num_threads`` > 1, the output rows get split among that many
+    threads within ``cdriz.tdriz`` (when built with OpenMP support).
+    This only applies to the default WCS-based mapping with ``stepsize`` > 0.
+
     """
     # Insure that the fillval parameter gets properly interpreted for use with tdriz
     if util.is_blank(fillval):
@@ -1079,7 +1369,7 @@ def do_driz(insci, input_wcs, inwht,
     if wcsmap is None and cdriz is not None:
         log.info('Using WCSLIB-based coordinate transformation...')
         log.info('stepsize = %s' % stepsize)
-        mapping = cdriz.DefaultWCSMapping(
+        mapping = pixmap_cache.get_mapping(
             input_wcs, output_wcs,
             input_wcs.pixel_shape[0], input_wcs.pixel_shape[1],
             stepsize
@@ -1109,13 +1399,25 @@ def do_driz(insci, input_wcs, inwht,
         # WARNING: Input array recast as a float32 array
         insci = insci.astype(np.float32)
 
-    _vers, nmiss, nskip = cdriz.tdriz(insci, inwht, outsci, outwht,
+    driz_args = [insci, inwht, outsci, outwht,
         outctx, uniqid, ystart, 1, 1, _dny,
         pix_ratio, 1.0, 1.0, 'center', pixfrac,
         kernel, in_units, expscale, wt_scl,
-        fillval, nmiss, nskip, 1, mapping)
-
-    if nmiss > 0:
+        fillval, nmiss, nskip, 1, mapping]
+    if yband is not None or num_threads > 1:
+        driz_args.extend(yband or (0, -1))
+        driz_args.append(num_threads)
+
+    _vers, nmiss, nskip = cdriz.tdriz(*driz_args)
+
+    if yband is not None:
+        # points outside of the band are not meaningful misses
+        log.debug('! %s points were outside of output rows %s-%s.' %
+                  (nmiss, yband[0], yband[1]))
+    elif num_threads > 1:
+        # with several threads, this only is an upper limit
+        log.debug('! Up to %s points were outside the output image.' % nmiss)
+    elif nmiss > 0:
         log.warning('! %s points were outside the output image.' % nmiss)
     if nskip > 0:
         log.debug('! Note, %s input lines were skipped completely.' % nskip)
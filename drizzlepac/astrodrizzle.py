@@ -34,10 +34,13 @@ import os
 import sys
 import logging
 
+import numpy as np
+
 from stsci.tools import teal, logutil, textutil
 
 from . import adrizzle
 from . import ablot
+from . import checkpoint
 from . import createMedian
 from . import drizCR
 from . import processInput
@@ -184,6 +187,8 @@ def run(configobj, wcsmap=None):
         # Define list of imageObject instances and output WCSObject instance
         # based on input paramters
         imgObjList = None
+        outwcs = None
+        ckpt = None
         procSteps.addStep('Initialization')
         imgObjList, outwcs = processInput.setCommonInput(configobj)
         procSteps.endStep('Initialization')
@@ -202,37 +207,52 @@ def run(configobj, wcsmap=None):
         log.info("USER INPUT PARAMETERS common to all Processing Steps:")
         util.printParams(configobj, log=log)
 
+        # When resuming, record completed steps in a manifest, from which
+        # they can be reused by the next run. A custom wcsmap cannot be
+        # hashed, so steps are always run with one.
+        resume = configobj.get('resume', False)
+        ckpt_name = None
+        if resume and not imgObjList[0].inmemory and wcsmap is None:
+            ckpt_name = '{:s}_checkpoint.json'.format(os.path.splitext(
+                imgObjList[0].outputNames['outFinal'])[0])
+        ckpt = checkpoint.Checkpoint(ckpt_name, imgObjList, configobj,
+                                     outwcs=outwcs, resume=resume,
+                                     procSteps=procSteps)
+
         # Call rest of MD steps...
         # create static masks for each image
-        staticMask.createStaticMask(imgObjList, configobj,
-                                    procSteps=procSteps)
+        ckpt.run('Static Mask', staticMask.createStaticMask, imgObjList,
+                 configobj, procSteps=procSteps)
 
         # subtract the sky
-        sky.subtractSky(imgObjList, configobj, procSteps=procSteps)
+        ckpt.run('Subtract Sky', sky.subtractSky, imgObjList, configobj,
+                 procSteps=procSteps)
 
 #       _dbg_dump_virtual_outputs(imgObjList)
 
         # drizzle to separate images
-        adrizzle.drizSeparate(imgObjList, outwcs, configobj, wcsmap=wcsmap,
-                              logfile=logfile,
-                              procSteps=procSteps)
+        ckpt.run('Separate Drizzle', adrizzle.drizSeparate, imgObjList,
+                 outwcs, configobj, wcsmap=wcsmap, logfile=logfile,
+                 procSteps=procSteps)
 
 #       _dbg_dump_virtual_outputs(imgObjList)
 
         # create the median images from the driz sep images
-        createMedian.createMedian(imgObjList, configobj, procSteps=procSteps)
+        ckpt.run('Create Median', createMedian.createMedian, imgObjList,
+                 configobj, procSteps=procSteps)
 
         # blot the images back to the original reference frame
-        ablot.runBlot(imgObjList, outwcs, configobj, wcsmap=wcsmap,
-                      procSteps=procSteps)
+        ckpt.run('Blot', ablot.runBlot, imgObjList, outwcs, configobj,
+                 wcsmap=wcsmap, procSteps=procSteps)
 
         # look for cosmic rays
-        drizCR.rundrizCR(imgObjList, configobj, procSteps=procSteps)
+        ckpt.run('Driz_CR', drizCR.rundrizCR, imgObjList, configobj,
+                 procSteps=procSteps)
 
         # Make your final drizzled image
-        adrizzle.drizFinal(imgObjList, outwcs, configobj, wcsmap=wcsmap,
-                           logfile=logfile,
-                           procSteps=procSteps)
+        ckpt.run('Final Drizzle', adrizzle.drizFinal, imgObjList, outwcs,
+                 configobj, wcsmap=wcsmap, logfile=logfile,
+                 procSteps=procSteps)
 
         print()
         print("AstroDrizzle Version {:s} is finished processing at {:s}.\n"
@@ -250,11 +270,17 @@ def run(configobj, wcsmap=None):
 
     finally:
         procSteps.reportTimes()
+        telemetry = configobj.get('telemetry', 'none')
+        if telemetry != 'none':
+            _write_telemetry(procSteps, logfile, telemetry, imgObjList,
+                             outwcs)
         if imgObjList:
             for image in imgObjList:
                 if clean:
                     image.clean()
                 image.close()
+            if clean and ckpt is not None:
+                ckpt.remove()
             del imgObjList
             del outwcs
 
@@ -263,6 +289,48 @@ AstroDrizzle.__doc__ = util._def_help_functions(
     locals(), module_file=__file__, task_name=__taskname__, module_doc=__doc__
 )
 
+
+def _write_telemetry(procSteps, logfile, telemetry, imgObjList, outwcs):
+    """ Attach the number of chips and output pixels to the records of the
+    processing steps and write these records next to the trailer file.
+    Steps that did not report the number of workers they used ran serially.
+    """
+    filename = util.telemetry_filename(logfile, telemetry)
+
+    if imgObjList:
+        chips = [chip for image in imgObjList
+                 for chip in image.returnAllChips(extname=image.scienceExt)]
+        chip_npix = int(sum(np.prod(chip.image_shape) for chip in chips))
+        single_npix = final_npix = 0
+        if outwcs is not None:
+            single_npix = int(np.prod(outwcs.single_wcs.pixel_shape))
+            final_npix = int(np.prod(outwcs.final_wcs.pixel_shape))
+
+        npix = {
+            'Static Mask': chip_npix,
+            'Subtract Sky': chip_npix,
+            'Separate Drizzle': single_npix * len(imgObjList),
+            'Create Median': single_npix,
+            'Blot': chip_npix,
+            'Driz_CR': chip_npix,
+            'Final Drizzle': final_npix,
+        }
+        for step in procSteps.order:
+            procSteps.setStepInfo(step, nchips=len(chips),
+                                  npix=npix.get(step))
+
+    for step in procSteps.order:
+        if 'workers' not in procSteps.steps[step].get('info', {}):
+            procSteps.setStepInfo(step, workers=1)
+
+    try:
+        procSteps.writeTelemetry(filename, format=telemetry)
+        log.info("Performance telemetry written to '{:s}'.".format(filename))
+    except OSError as e:
+        log.warning("Unable to write performance telemetry to '{:s}': {}"
+                    .format(filename, e))
+
+
 _fidx = 0
 
 def _dbg_dump_virtual_outputs(imgObjList):
@@ -0,0 +1,289 @@
+"""
+Checkpoints of the processing steps of AstroDrizzle.
+
+A manifest, saved as a JSON file next to the output products, records for
+each completed processing step a hash of everything the step depends on:
+the content of the input images (their data arrays and the WCS of each
+chip), the parameters of the step and of the steps before it, any file named
+by these parameters and the output WCS. It also records the files written
+by the step, with their size and modification time, and the values that the
+step sets on the input image objects for the following steps (the names of
+the static masks and the sky values).
+
+The manifest is only kept when AstroDrizzle is run with ``resume=True``:
+any step whose hash is unchanged and whose output files are still on disk and
+unmodified is then not run again; its values are restored from the manifest
+and it is reported as reused in the summary of processing times. Otherwise,
+nothing gets hashed or recorded and all the steps are simply run.
+
+:License: :doc:`LICENSE`
+
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from astropy.io import fits
+from stsci.tools import logutil
+
+from . import util
+from .pixmap_cache import wcs_hash
+
+__all__ = ['Checkpoint', 'STEPS']
+
+log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
+
+# Processing steps (as named in the ProcSteps report), in order, with the
+# numbers of their configobj sections.
+STEPS = (
+    ('Static Mask', ('1',)),
+    ('Subtract Sky', ('2',)),
+    ('Separate Drizzle', ('3', '3a')),
+    ('Create Median', ('4',)),
+    ('Blot', ('5',)),
+    ('Driz_CR', ('6',)),
+    ('Final Drizzle', ('7', '7a')),
+)
+
+_STEP_NAMES = [step for step, _ in STEPS]
+
+# Output WCS (attribute of the WCSObject) onto which a step resamples images
+_STEP_WCS = {'Separate Drizzle': 'single_wcs', 'Final Drizzle': 'final_wcs'}
+
+# Top-level parameters which do not change the results of any step
+_EXECUTION_PARS = ('runfile', 'num_cores', 'parallel_backend', 'in_memory',
+                   'resume', 'telemetry', 'mdriztab', 'STATE OF INPUT FILES')
+
+# Names (in outputNames) of the files written by each step
+_STEP_OUTPUTS = {
+    'Static Mask': ('staticMask',),
+    'Separate Drizzle': ('outSingle', 'outSWeight', 'outSContext'),
+    'Create Median': ('outMedian',),
+    'Blot': ('blotImage',),
+    'Driz_CR': ('crmaskImage', 'crcorImage'),
+    'Final Drizzle': ('outFinal', 'outSci', 'outWeight', 'outContext'),
+}
+
+# Chip attributes (or outputNames entries) set by a step for the next ones
+_STEP_STATE = {
+    'Static Mask': ('outputNames:staticMask',),
+    'Subtract Sky': ('subtractedSky', 'computedSky'),
+}
+
+
+def _file_id(filename):
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _hash_config(h, config, exclude=()):
+    for key in sorted(config.keys(), key=str):
+        if key in exclude:
+            continue
+        value = config[key]
+        if hasattr(value, 'keys'):
+            h.update('[{}]'.format(key).encode())
+            _hash_config(h, value)
+            continue
+
+        h.update('{}={!r};'.format(key, value).encode())
+        # parameters naming a file (reference image, sky file, ...):
+        if isinstance(value, str) and value.strip():
+            fname = value.strip().lstrip('@')
+            if os.path.isfile(fname):
+                h.update(repr(_file_id(fname)).encode())
+
+
+def _hash_image(h, image):
+    """ Hash the data arrays of an input file and the WCS of its chips.
+    Headers are not hashed as a whole since the processing itself updates
+    some of their keywords (``MDRIZSKY``, for instance). """
+    with fits.open(image._filename, memmap=True,
+                   do_not_scale_image_data=True) as hdulist:
+        for hdu in hdulist:
+            if not isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)) or \
+               hdu.data is None:
+                continue
+            h.update('{}{}'.format(hdu.name, hdu.ver).encode())
+            h.update(np.ascontiguousarray(hdu.data).data)
+
+    for chip in image.returnAllChips(extname=image.scienceExt):
+        h.update(chip.sciname.encode())
+        if getattr(chip, 'wcs', None) is not None:
+            h.update(wcs_hash(chip.wcs).encode())
+
+
+def _chip_key(chip):
+    return chip.sciname
+
+
+def _get_value(chip, name):
+    if name.startswith('outputNames:'):
+        return chip.outputNames.get(name.split(':', 1)[1])
+    value = getattr(chip, name, None)
+    if value is not None:
+        value = float(value)
+    return value
+
+
+def _set_value(chip, name, value):
+    if name.startswith('outputNames:'):
+        chip.outputNames[name.split(':', 1)[1]] = value
+    else:
+        setattr(chip, name, value)
+
+
+class Checkpoint:
+    """ Manifest of the completed processing steps of an AstroDrizzle run.
+
+    Parameters
+    ----------
+    filename : str, None
+        Name of the JSON file holding the manifest. When `None` (for instance
+        when intermediate products are kept in memory) or when ``resume`` is
+        `False`, steps are always run and nothing gets hashed or recorded.
+
+    imgObjList : list of imageObject
+        Input images.
+
+    configobj : dict-like
+        AstroDrizzle parameters.
+
+    outwcs : WCSObject, None
+        Output WCS, with ``single_wcs`` and ``final_wcs`` attributes.
+
+    resume : bool
+        Record the completed steps in the manifest and reuse the steps
+        already recorded there whenever possible.
+
+    procSteps : util.ProcSteps, None
+        Processing steps report in which reused steps get recorded.
+
+    """
+    def __init__(self, filename, imgObjList, configobj, outwcs=None,
+                 resume=False, procSteps=None):
+        self.filename = filename
+        self.imgObjList = imgObjList
+        self.procSteps = procSteps
+        self.steps = {}
+        self.hashes = {}
+
+        if filename is None or not resume:
+            # hashing reads all the input data: only do it when resuming
+            self.filename = None
+            return
+
+        if os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self.steps = json.load(f)['steps']
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("Ignoring checkpoint manifest '{:s}': {}"
+                            .format(filename, e))
+
+        self.hashes = self._step_hashes(configobj, outwcs)
+
+    def _step_hashes(self, configobj, outwcs):
+        # Hashes are computed before running any step as some steps add
+        # entries to their section of the configobj.
+        h = hashlib.sha1()
+        for image in self.imgObjList:
+            _hash_image(h, image)
+        _hash_config(h, configobj, exclude=_EXECUTION_PARS + tuple(
+            k for k in configobj.keys() if str(k).startswith('STEP ')))
+
+        hashes = {}
+        for step, sections in STEPS:
+            for num in sections:
+                name = util.getSectionName(configobj, num)
+                if name is not None:
+                    h.update(name.encode())
+                    _hash_config(h, configobj[name])
+            w = getattr(outwcs, _STEP_WCS.get(step, ''), None)
+            if w is not None:
+                h.update(wcs_hash(w).encode())
+            hashes[step] = h.copy().hexdigest()
+        return hashes
+
+    def _chips(self):
+        for image in self.imgObjList:
+            for chip in image.returnAllChips(extname=image.scienceExt):
+                yield chip
+
+    def _outputs(self, step):
+        outputs = {}
+        for chip in self._chips():
+            for name in _STEP_OUTPUTS.get(step, ()):
+                fname = chip.outputNames.get(name)
+                if fname and fname not in outputs and os.path.isfile(fname):
+                    outputs[fname] = _file_id(fname)
+        return outputs
+
+    def reusable(self, step):
+        """ Return `True` when ``step`` was completed with the same inputs
+        and its output files are unchanged. """
+        entry = self.steps.get(step)
+        if self.filename is None or entry is None or \
+           entry.get('hash') != self.hashes[step]:
+            return False
+
+        for fname, file_id in entry.get('outputs', {}).items():
+            if not os.path.isfile(fname) or _file_id(fname) != file_id:
+                log.info("Output '{:s}' of step '{:s}' is missing or was "
+                         "modified.".format(fname, step))
+                return False
+
+        return True
+
+    def restore(self, step):
+        """ Set the values recorded for ``step`` on the input chips. """
+        state = self.steps[step].get('state', {})
+        for chip in self._chips():
+            for name, value in state.get(_chip_key(chip), {}).items():
+                _set_value(chip, name, value)
+
+    def save(self, step):
+        """ Record ``step`` as completed and write the manifest. """
+        if self.filename is None:
+            return
+
+        state = {}
+        for name in _STEP_STATE.get(step, ()):
+            for chip in self._chips():
+                state.setdefault(_chip_key(chip), {})[name] = \
+                    _get_value(chip, name)
+
+        self.steps[step] = {
+            'hash': self.hashes[step],
+            'outputs': self._outputs(step),
+            'state': state,
+        }
+
+        tmpname = '{:s}.{:d}.tmp'.format(self.filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump({'steps': self.steps}, f, indent=2)
+        os.replace(tmpname, self.filename)
+
+    def run(self, step, func, *args, **kwargs):
+        """ Run the processing step ``step`` by calling ``func`` with the
+        given arguments, unless it can be reused from the manifest. """
+        if self.reusable(step):
+            log.info("Reusing results of step '{:s}' from '{:s}'."
+                     .format(step, self.filename))
+            self.restore(step)
+            if self.procSteps is not None:
+                self.procSteps.reuseStep(step)
+            return
+
+        # any following step depends on this one being run again
+        for name in _STEP_NAMES[_STEP_NAMES.index(step):]:
+            self.steps.pop(name, None)
+
+        func(*args, **kwargs)
+        self.save(step)
+
+    def remove(self):
+        """ Delete the manifest file. """
+        if self.filename is not None:
+            util.removeFileSafely(self.filename)
@@ -0,0 +1,153 @@
+"""
+Clipped statistics of the science arrays of input chips, as used by the
+static mask and sky subtraction steps.
+
+`sampled_stats` computes the statistics with `stsci.imagestats.ImageStats`,
+either over all the pixels of an array or, when given an error tolerance,
+over a subsample of the pixels that is just large enough to reach it. The
+subsample is taken with a fixed stride (or at random positions drawn from a
+seeded generator), so that results are reproducible, and is split into
+interleaved subsets whose scatter gives the accuracy of the estimate.
+
+:License: :doc:`LICENSE`
+
+"""
+import math
+
+import numpy as np
+from stsci.imagestats import ImageStats
+
+__all__ = ['SampledStats', 'sampled_stats']
+
+# number of interleaved subsets used to estimate the accuracy of the
+# statistics computed from a subsample
+NSUBSETS = 4
+# smallest number of pixels in each subset
+MIN_SUBSET = 4096
+
+
+class SampledStats:
+    """
+    Statistics of an array computed from all or a subsample of its pixels.
+
+    Attributes ``mode``, ``median`` and ``mean`` (as requested with
+    ``fields``), ``stddev`` and ``npix`` have the same meaning as those of
+    `~stsci.imagestats.ImageStats`, and ``histogram`` holds the histogram of
+    the last subset (or of all pixels) when the mode is computed. ``field``
+    is the statistic whose standard error is given in ``error``, ``nsample``
+    is the number of pixels sampled out of ``size``. ``error`` is 0 when
+    all the pixels were used.
+    """
+    def __init__(self, stats, field, size):
+        self.field = field
+        self.size = size
+        self.mode = self.median = None
+        self.histogram = getattr(stats[-1], 'histogram', None)
+        values = [getattr(s, field) for s in stats]
+
+        if len(stats) == 1:
+            # keep the values (and types) computed by ImageStats
+            self.stddev = stats[0].stddev
+            self.npix = stats[0].npix
+            self.mean = stats[0].mean
+            setattr(self, field, values[0])
+            self.nsample = size
+            self.error = 0.0
+            return
+
+        self.stddev = float(np.mean([s.stddev for s in stats]))
+        self.npix = int(sum(s.npix for s in stats))
+        self.mean = float(np.mean([s.mean for s in stats]))
+        setattr(self, field, float(np.mean(values)))
+        self.nsample = int(sum(s.image.size for s in stats))
+        # no estimate of the location can be more accurate than the mean of
+        # the clipped pixels
+        self.error = max(np.std(values, ddof=1) / math.sqrt(len(stats)),
+                         self.stddev / math.sqrt(self.npix))
+
+    def __str__(self):
+        if self.nsample == self.size:
+            return 'from all {:d} pixels'.format(self.size)
+        return ('from {:d} of {:d} pixels, {:s} uncertainty = {:g}'
+                .format(self.nsample, self.size, self.field, self.error))
+
+
+def _sample(data, nsample, sampling, rng):
+    """ Return ``NSUBSETS`` interleaved subsets of ``nsample`` pixels of
+    ``data`` in total. """
+    flat = np.ravel(data)
+    if sampling == 'random':
+        sample = flat[np.sort(rng.choice(flat.size, nsample, replace=False))]
+    elif sampling == 'strided':
+        stride = flat.size // nsample
+        # a stride sharing a factor with the row length would only sample a
+        # few columns of the image
+        while math.gcd(stride, data.shape[-1]) > 1:
+            stride -= 1
+        sample = flat[::stride][:nsample]
+    else:
+        raise ValueError("Unknown sampling method '{}'".format(sampling))
+    return [np.ascontiguousarray(sample[k::NSUBSETS])
+            for k in range(NSUBSETS)]
+
+
+def sampled_stats(data, fields='mode', tolerance=None, sampling='strided',
+                  seed=0, **pars):
+    """
+    Compute the clipped statistics of an array from as few of its pixels as
+    needed to reach a given accuracy.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Array of pixel values.
+
+    fields : str
+        Statistics to compute, as for `~stsci.imagestats.ImageStats`. The
+        accuracy is checked for the first of 'mode', 'median' and 'mean'
+        found in ``fields``.
+
+    tolerance : float, None
+        Largest standard error of the statistic, in units of the clipped
+        standard deviation of the pixels. Subsamples of increasing size
+        (4 times larger each time) are used until this is reached. When
+        `None`, or when it cannot be reached with less than half of the
+        pixels, the statistics are computed from all the pixels, with the
+        same results as `~stsci.imagestats.ImageStats`.
+
+    sampling : {'strided', 'random'}
+        Take the subsample every few pixels or at random positions.
+
+    seed : int
+        Seed of the random generator used with ``sampling='random'``.
+
+    pars : dict
+        Other arguments (``lower``, ``upper``, ``nclip``, ``lsig``, ``usig``
+        and ``binwidth``) of `~stsci.imagestats.ImageStats`.
+
+    Returns
+    -------
+    SampledStats
+
+    """
+    field = 'mean'
+    for f in ['mode', 'median', 'mean']:
+        if f in fields:
+            field = f
+            break
+
+    if tolerance is not None:
+        rng = np.random.default_rng(seed)
+        nsample = NSUBSETS * MIN_SUBSET
+        while 2 * nsample <= data.size:
+            subsets = _sample(data, nsample, sampling, rng)
+            stats = SampledStats(
+                [ImageStats(s, fields=fields, **pars) for s in subsets],
+                field, data.size
+            )
+            if stats.error <= tolerance * stats.stddev:
+                return stats
+            nsample *= 4
+
+    return SampledStats([ImageStats(data, fields=fields, **pars)], field,
+                        data.size)
@@ -8,6 +8,8 @@ Create a median image from the singly drizzled images.
 """
 import os
 import sys
+import copy
+import functools
 import math
 import numpy as np
 from astropy.io import fits
@@ -17,10 +19,11 @@ from stsci.image import numcombine
 from stsci.tools import iterfile, teal, logutil
 
 from . import imageObject
+from . import outputimage
 from . import util
-from .minmed import min_med
+from .minmed import fused_min_med
 from . import processInput
-from .adrizzle import _single_step_num_
+from .adrizzle import _single_step_num_, _shared_zeros
 
 from . import __version__
 
@@ -32,6 +35,9 @@ BUFSIZE = 1024*1024   # 1MB cache size
 
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
+if util.can_parallel:
+    import multiprocessing
+
 
 # this is the user access function
 def median(input=None, configObj=None, editpars=False, **inputDict):
@@ -92,21 +98,33 @@ def createMedian(imgObjList, configObj, procSteps=None):
     driz_sep_name = util.getSectionName(configObj, _single_step_num_)
     driz_sep_paramDict = configObj[driz_sep_name]
     paramDict['compress'] = driz_sep_paramDict['driz_sep_compress']
+    paramDict['fillval'] = driz_sep_paramDict['driz_sep_fillval']
+    paramDict['num_cores'] = configObj.get('num_cores')
+    paramDict['parallel_backend'] = configObj.get('parallel_backend', 'process')
 
     log.info('USER INPUT PARAMETERS for Create Median Step:')
     util.printParams(paramDict, log=log)
 
-    _median(imgObjList, paramDict)
+    worker_times = util.WorkerTimes()
+    _median(imgObjList, paramDict, worker_times=worker_times)
 
     if procSteps is not None:
+        procSteps.addWorkerTimes('Create Median', worker_times)
         procSteps.endStep('Create Median')
 
 
 # this is the internal function, the user called function is below
-def _median(imageObjectList, paramDict):
+def _median(imageObjectList, paramDict, worker_times=None):
     """Create a median image from the list of image Objects
        that has been given.
+
+       When given a `~drizzlepac.util.WorkerTimes` object, ``worker_times``
+       receives the number of workers that were used and the times spent
+       on the rows combined by each of them.
     """
+    if worker_times is None:
+        worker_times = util.WorkerTimes()
+
     newmasks = paramDict['median_newmasks']
     comb_type = paramDict['combine_type'].lower()
     nlow = paramDict['combine_nlow']
@@ -116,6 +134,9 @@ def _median(imageObjectList, paramDict):
     proc_units = paramDict['proc_unit']
     compress = paramDict['compress']
     bufsizeMB = paramDict['combine_bufsize']
+    # value of the pixels outside of cropped single drizzle products
+    crop_fillval = paramDict.get('fillval')
+    crop_fillval = 0.0 if crop_fillval is None else float(crop_fillval)
 
     sigma = paramDict["combine_nsigma"]
     sigmaSplit = sigma.split()
@@ -149,6 +170,7 @@ def _median(imageObjectList, paramDict):
     backgroundValueList = []  # list of  MDRIZSKY *platescale values
     singleDrizList = []  # these are the input images
     singleWeightList = []  # pointers to the data arrays
+    singleOffsetList = []  # positions of cropped single images on the frame
     wht_mean = []  # Compute the mean value of each wht image
 
     single_hdr = None
@@ -185,55 +207,37 @@ def _median(imageObjectList, paramDict):
         singleDriz = image.getOutputName("outSingle")
         singleDriz_name = image.outputNames['outSingle']
         singleWeight = image.getOutputName("outSWeight")
-        singleWeight_name = image.outputNames['outSWeight']
 
         # If compression was used, reference ext=1 as CompImageHDU only writes
         # out MEF files, not simple FITS.
         if compress:
-            wcs_ext = '[1]'
             wcs_extnum = 1
         else:
-            wcs_ext = '[0]'
             wcs_extnum = 0
 
-        if not virtual:
-            if isinstance(singleDriz, str):
-                iter_singleDriz = singleDriz + wcs_ext
-                iter_singleWeight = singleWeight + wcs_ext
-            else:
-                iter_singleDriz = singleDriz[wcs_extnum]
-                iter_singleWeight = singleWeight[wcs_extnum]
-        else:
-            iter_singleDriz = singleDriz_name + wcs_ext
-            iter_singleWeight = singleWeight_name + wcs_ext
-
         # read in WCS from first single drizzle image to use as WCS for
         # median image
-        if single_hdr is None:
-            if virtual:
-                single_hdr = singleDriz[wcs_extnum].header
-            else:
-                single_hdr = fits.getheader(singleDriz_name, ext=wcs_extnum,
-                                            memmap=False)
-
-        single_image = iterfile.IterFitsFile(iter_singleDriz)
         if virtual:
-            single_image.handle = singleDriz
-            single_image.inmemory = True
+            hdr = singleDriz[wcs_extnum].header
+        else:
+            hdr = fits.getheader(singleDriz_name, ext=wcs_extnum,
+                                 memmap=False)
+        singleOffsetList.append(outputimage.getFrameOffset(hdr))
+        if single_hdr is None:
+            single_hdr = outputimage.getFullFrameHeader(hdr)
 
+        single_image = _section_source(singleDriz, wcs_extnum, virtual, compress)
         singleDrizList.append(single_image)  # add to an array for bookkeeping
 
         # If it exists, extract the corresponding weight images
         if (not virtual and os.access(singleWeight, os.F_OK)) or (
                 virtual and singleWeight):
-            weight_file = iterfile.IterFitsFile(iter_singleWeight)
-            if virtual:
-                weight_file.handle = singleWeight
-                weight_file.inmemory = True
+            weight_file = _section_source(singleWeight, wcs_extnum, virtual,
+                                          compress)
 
             singleWeightList.append(weight_file)
             try:
-                tmp_mean_value = ImageStats(weight_file.data, lower=1e-8,
+                tmp_mean_value = ImageStats(_full_data(weight_file), lower=1e-8,
                                             fields="mean", nclip=0).mean
             except ValueError:
                 tmp_mean_value = 0.0
@@ -292,12 +296,16 @@ def _median(imageObjectList, paramDict):
 
     # create an array for the median output image, use the size of the first
     # image in the list. Store other useful image characteristics:
-    single_driz_data = singleDrizList[0].data
+    single_driz_data = _full_data(singleDrizList[0])
     data_item_size = single_driz_data.itemsize
-    single_data_dtype = single_driz_data.dtype
+    # combine in native byte order, whatever the byte order of the files
+    single_data_dtype = single_driz_data.dtype.newbyteorder('=')
     imrows, imcols = single_driz_data.shape
+    if singleOffsetList[0] is not None:
+        # cropped single drizzle products get placed on the full frame
+        imcols, imrows = singleOffsetList[0][2:]
 
-    medianImageArray = np.zeros_like(single_driz_data)
+    medianImageArray = np.zeros((imrows, imcols), dtype=single_data_dtype)
 
     del single_driz_data
 
@@ -338,6 +346,7 @@ def _median(imageObjectList, paramDict):
     if (imrows - overlap) % nbr > 0:
         nsec += 1
 
+    sections = []
     for k in range(nsec):
         e1 = k * nbr
         e2 = e1 + section_nrows
@@ -352,73 +361,162 @@ def _median(imageObjectList, paramDict):
             e1 = min(e1, e2 - overlap - 1)
             u2 = e2 - e1
 
-        imdrizSectionsList = np.empty(
-            (len(singleDrizList), e2 - e1, imcols),
-            dtype=single_data_dtype
-        )
-        for i, w in enumerate(singleDrizList):
-            imdrizSectionsList[i, :, :] = w[e1:e2]
-
+        sections.append((e1, e2, u1, u2))
+
+    # Inputs whose weight is zero over all rows of a section are masked
+    # there and contribute nothing to the combined pixels, so each section
+    # is combined only from the inputs overlapping it. For large mosaics
+    # this makes memory and runtime scale with the local depth of the
+    # stack rather than with the total number of inputs.
+    ninputs = len(singleDrizList)
+    if newmasks and singleWeightList:
+        footprints = [
+            _footprint_rows(w, singleOffsetList[i], imrows)
+            if wht_mean[i] > 0 else None
+            for i, w in enumerate(singleWeightList)
+        ]
+        # Keep enough (leading) inputs for the combination to follow the
+        # same path as for the full stack: min_med() switches to a mean for
+        # 2 inputs, num_combine() needs 'nlow + nhigh + 1' of them and the
+        # 'imedian'/'imean' types fall back to the first one.
+        min_inputs = min(ninputs, max(3, nlow + nhigh + 1))
+        section_inputs = [
+            _section_inputs(footprints, e1, e2, min_inputs)
+            for e1, e2, u1, u2 in sections
+        ]
+        log.info('Combining on average {:.1f} of {:d} inputs per section'
+                 .format(np.mean([len(i) for i in section_inputs]), ninputs))
+    else:
+        section_inputs = [np.arange(ninputs)] * nsec
+    sections = [s + (i, ) for s, i in zip(sections, section_inputs)]
+
+    def combine_sections(sections, singleDrizList, singleWeightList):
+        # Combine each section in turn and write out the rows it is
+        # responsible for (without the 'grow' overlap) to the output array.
+        # The stacks of sections are allocated once, for the largest
+        # section and the deepest stack, and reused for every section.
+        maxrows = max(e2 - e1 for e1, e2, u1, u2, idx in sections)
+        depth = max(len(idx) for e1, e2, u1, u2, idx in sections)
+        sci_buf = np.empty((depth, maxrows, imcols), dtype=single_data_dtype)
         if singleWeightList:
-            weightSectionsList = np.empty(
-                (len(singleWeightList), e2 - e1, imcols),
-                dtype=single_data_dtype
-            )
-            for i, w in enumerate(singleWeightList):
-                weightSectionsList[i, :, :] = w[e1:e2]
+            wht_buf = np.empty((depth, maxrows, imcols),
+                               dtype=single_data_dtype)
+            mask_buf = np.empty(wht_buf.shape, dtype=np.bool_)
+
+        for e1, e2, u1, u2, idx in sections:
+            imdrizSectionsList = sci_buf[:len(idx), :e2 - e1]
+            for k, i in enumerate(idx):
+                _read_section(singleDrizList[i], singleOffsetList[i], e1, e2,
+                              imdrizSectionsList[k], crop_fillval)
+
+            if singleWeightList:
+                weightSectionsList = wht_buf[:len(idx), :e2 - e1]
+                for k, i in enumerate(idx):
+                    _read_section(singleWeightList[i], singleOffsetList[i],
+                                  e1, e2, weightSectionsList[k], 0)
+            else:
+                weightSectionsList = None
+
+            weight_mask_list = None
+
+            if newmasks and weightSectionsList is not None:
+                # Build new masks from single drizzled images.
+                # Generate new pixel mask file for median step.
+                # This mask will be created from the single-drizzled
+                # weight image for this image.
+
+                # The mean of the weight array will be computed and all
+                # pixels with values less than 0.7 of the mean will be flagged
+                # as bad in this mask. This mask will then be used when
+                # creating the median image.
+                # 0 means good, 1 means bad here...
+                weight_mask_list = np.less(
+                    weightSectionsList,
+                    np.asarray(wht_mean)[idx, None, None],
+                    out=mask_buf[:len(idx), :e2 - e1]
+                )
+
+            if 'minmed' in comb_type:  # Do MINMED
+                # set up use of 'imedian'/'imean' in minmed algorithm
+                fillval = comb_type.startswith('i')
+
+                # Create the combined array object using the minmed algorithm
+                result = fused_min_med(
+                    imdrizSectionsList,
+                    weightSectionsList,
+                    [readnoiseList[i] for i in idx],
+                    [exposureTimeList[i] for i in idx],
+                    [backgroundValueList[i] for i in idx],
+                    weight_masks=weight_mask_list,
+                    combine_grow=grow,
+                    combine_nsigma1=nsigma1,
+                    combine_nsigma2=nsigma2,
+                    fillval=fillval
+                )
+
+            else:  # DO NUMCOMBINE
+                # Create the combined array object using the numcombine task
+                result = numcombine.num_combine(
+                    imdrizSectionsList,
+                    masks=weight_mask_list,
+                    combination_type=comb_type,
+                    nlow=nlow,
+                    nhigh=nhigh,
+                    upper=hthresh,
+                    lower=lthresh
+                )
+
+            # Write out the processed image sections to the final output array:
+            medianImageArray[e1+u1:e1+u2, :] = result[u1:u2, :]
+
+    # Sections are independent of each other, so they can be handed out to
+    # parallel workers, each of them holding one section (that is, up to
+    # 'combine_bufsize' MB of input data) at a time.
+    pool_size = util.get_pool_size(paramDict.get('num_cores'), nsec)
+    if pool_size > 1:
+        groups = [list(g) for g in np.array_split(np.arange(nsec), pool_size)]
+        groups = [[sections[k] for k in g] for g in groups if len(g) > 0]
+        use_threads = paramDict.get('parallel_backend', 'process') == 'thread'
+        log.info(f'Combining {nsec:d} sections with {len(groups):d} '
+                 'parallel workers')
+        worker_times.workers = len(groups)
+        worker_times.backend = 'thread' if use_threads else 'process'
+        if use_threads:
+            tasks = [functools.partial(worker_times.wrap(_rows(g),
+                                                         combine_sections), g,
+                                       [_thread_copy(w) for w in singleDrizList],
+                                       [_thread_copy(w) for w in singleWeightList])
+                     for g in groups]
+            util.launch_threads_and_wait(tasks, len(tasks))
         else:
-            weightSectionsList = None
-
-        weight_mask_list = None
-
-        if newmasks and weightSectionsList is not None:
-            # Build new masks from single drizzled images.
-            # Generate new pixel mask file for median step.
-            # This mask will be created from the single-drizzled
-            # weight image for this image.
-
-            # The mean of the weight array will be computed and all
-            # pixels with values less than 0.7 of the mean will be flagged
-            # as bad in this mask. This mask will then be used when
-            # creating the median image.
-            # 0 means good, 1 means bad here...
-            weight_mask_list = np.less(
-                weightSectionsList,
-                np.asarray(wht_mean)[:, None, None]
-            ).astype(np.uint8)
-
-        if 'minmed' in comb_type:  # Do MINMED
-            # set up use of 'imedian'/'imean' in minmed algorithm
-            fillval = comb_type.startswith('i')
-
-            # Create the combined array object using the minmed algorithm
-            result = min_med(
-                imdrizSectionsList,
-                weightSectionsList,
-                readnoiseList,
-                exposureTimeList,
-                backgroundValueList,
-                weight_masks=weight_mask_list,
-                combine_grow=grow,
-                combine_nsigma1=nsigma1,
-                combine_nsigma2=nsigma2,
-                fillval=fillval
-            )
-
-        else:  # DO NUMCOMBINE
-            # Create the combined array object using the numcombine task
-            result = numcombine.num_combine(
-                imdrizSectionsList,
-                masks=weight_mask_list,
-                combination_type=comb_type,
-                nlow=nlow,
-                nhigh=nhigh,
-                upper=hthresh,
-                lower=lthresh
-            )
-
-        # Write out the processed image sections to the final output array:
-        medianImageArray[e1+u1:e1+u2, :] = result[u1:u2, :]
+            # forked workers write their rows directly into shared memory
+            medianImageArray = _shared_zeros((imrows, imcols), single_data_dtype)
+            mp_ctx = multiprocessing.get_context('fork')
+            subprocs = []
+            for g in groups[1:]:
+                p = mp_ctx.Process(target=worker_times.wrap(_rows(g),
+                                                            combine_sections,
+                                                            process=True),
+                                   name='createMedian._median()',
+                                   args=(g, singleDrizList, singleWeightList))
+                subprocs.append(p)
+                p.start()
+            try:
+                worker_times.wrap(_rows(groups[0]), combine_sections)(
+                    groups[0], singleDrizList, singleWeightList
+                )
+            finally:
+                for p in subprocs:
+                    p.join()
+            for p in subprocs:
+                if p.exitcode != 0:
+                    raise RuntimeError("Problem during: " + str(p.name) +
+                                       ', exitcode: ' + str(p.exitcode) +
+                                       '. Check log.')
+    else:
+        worker_times.wrap(_rows(sections), combine_sections)(
+            sections, singleDrizList, singleWeightList
+        )
 
     # Write out the combined image
     # use the header from the first single drizzled image in the list
@@ -442,15 +540,96 @@ def _median(imageObjectList, paramDict):
     # single drizzle images and singly-drizzled weight images
     #
     for img in singleDrizList:
-        if not virtual:
+        if isinstance(img, iterfile.IterFitsFile):
             img.close()
 
     # Close all singly drizzled weight images used to create median image.
     for img in singleWeightList:
-        if not virtual:
+        if isinstance(img, iterfile.IterFitsFile):
             img.close()
 
 
+def _rows(sections):
+    """ Name the output rows written by a group of median sections. """
+    return 'rows {:d}-{:d}'.format(sections[0][0] + sections[0][2],
+                                   sections[-1][0] + sections[-1][3])
+
+
+def _section_source(single, extnum, virtual, compress):
+    """ Return an object from which sections of rows of the single drizzle
+    (or weight) product ``single``, a file name or an in-memory
+    `~astropy.io.fits.HDUList`, can be read by slicing.
+
+    In-memory products and uncompressed files (which get memory-mapped) are
+    returned as arrays, so that sections are views into them, which are
+    copied only once into the stack of sections. Compressed files are read
+    through `~stsci.tools.iterfile.IterFitsFile`.
+    """
+    if virtual or not isinstance(single, str):
+        return single[extnum].data
+    if not compress:
+        return fits.getdata(single, ext=extnum, memmap=True)
+    return iterfile.IterFitsFile('{:s}[{:d}]'.format(single, extnum))
+
+
+def _full_data(image):
+    """ Return the whole data array from a `_section_source` object. """
+    if isinstance(image, iterfile.IterFitsFile):
+        return image.data
+    return image
+
+
+def _thread_copy(image):
+    """ 'IterFitsFile' objects keep state while reading, so each thread
+    needs its own copy of them. Arrays can be shared. """
+    if isinstance(image, iterfile.IterFitsFile):
+        return copy.copy(image)
+    return image
+
+
+def _read_section(image, offset, e1, e2, out, fillval):
+    """ Copy rows ``e1:e2`` of the full output frame from ``image`` into
+    ``out``. For an image cropped out of the frame, with ``offset`` as
+    returned by `~drizzlepac.outputimage.getFrameOffset`, the pixels outside
+    of it are set to ``fillval``.
+    """
+    if offset is None:
+        out[:, :] = image[e1:e2]
+        return
+
+    x0, y0 = offset[:2]
+    ny, nx = image.shape
+    out.fill(fillval)
+    r1 = max(e1, y0)
+    r2 = min(e2, y0 + ny)
+    if r2 > r1:
+        out[r1 - e1:r2 - e1, x0:x0 + nx] = image[r1 - y0:r2 - y0]
+
+
+def _footprint_rows(weight, offset, nrows):
+    """ Return a boolean array flagging the rows of the full output frame
+    (of ``nrows`` rows) in which the single drizzle weight image ``weight``
+    has any non-zero pixel. """
+    rows = np.zeros(nrows, dtype=np.bool_)
+    y0 = 0 if offset is None else offset[1]
+    data = _full_data(weight)
+    rows[y0:y0 + data.shape[0]] = np.any(data != 0, axis=1)
+    return rows
+
+
+def _section_inputs(footprints, e1, e2, min_inputs):
+    """ Return the indices of the inputs to be combined for rows ``e1:e2``:
+    those whose footprint (as returned by `_footprint_rows`, or `None` for
+    inputs that are always used) overlaps these rows, completed with the
+    leading inputs up to ``min_inputs`` of them. The first input is always
+    included. """
+    use = np.array([f is None or f[e1:e2].any() for f in footprints])
+    use[0] = True
+    for i in np.flatnonzero(~use)[:max(0, min_inputs - np.sum(use))]:
+        use[i] = True
+    return np.flatnonzero(use)
+
+
 def _writeImage(dataArray=None, inputHeader=None):
     """ Writes out the result of the combination step.
         The header of the first 'outsingle' file in the
@@ -11,7 +11,7 @@ import os
 import re
 
 import numpy as np
-from scipy import signal
+from scipy import ndimage
 from astropy.io import fits
 from stsci.tools import fileutil, logutil, mputil, teal
 
@@ -75,15 +75,19 @@ def rundrizCR(imgObjList, configObj, procSteps=None):
         pool_size = 1  # reason why is output in drizzle step
 
     subprocs = []
+    worker_times = util.WorkerTimes()
     if pool_size > 1:
         log.info('Executing {:d} parallel workers'.format(pool_size))
+        worker_times.workers = pool_size
+        worker_times.backend = 'process'
         mp_ctx = multiprocessing.get_context('fork')
         for image in imgObjList:
             manager = mp_ctx.Manager()
             mgr = manager.dict({})
 
             p = mp_ctx.Process(
-                target=_driz_cr,
+                target=worker_times.wrap(image._filename, _driz_cr,
+                                         process=True),
                 name='drizCR._driz_cr()',  # for err msgs
                 args=(image, mgr, paramDict.dict())
             )
@@ -94,9 +98,15 @@ def rundrizCR(imgObjList, configObj, procSteps=None):
     else:
         log.info('Executing serially')
         for image in imgObjList:
+            if procSteps is not None:
+                procSteps.addStep('Driz_CR', chip=image._filename)
             _driz_cr(image, image.virtualOutputs, paramDict)
+            if procSteps is not None:
+                procSteps.endStep('Driz_CR', chip=image._filename)
 
     if procSteps is not None:
+        if pool_size > 1:
+            procSteps.addWorkerTimes('Driz_CR', worker_times)
         procSteps.endStep('Driz_CR')
 
 
@@ -198,62 +208,9 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
         # already been accounted for in blotted image
         # expmult = 1.
 
-        # #################   COMPUTATION PART I    ###################
-        # Create a temporary array mask
-        t1 = np.absolute(input_image - blot_data)
-        # ta = np.sqrt(gain * np.abs((blot_data + backg) * expmult) + rn**2)
-        ta = np.sqrt(gain * np.abs(blot_data + backg) + rn**2)
-        t2 = (mult1 * blot_deriv + snr1 * ta / gain)  # / expmult
-        tmp1 = t1 <= t2
-
-        # Create a convolution kernel that is 3 x 3 of 1's
-        kernel = np.ones((3, 3), dtype=np.uint16)
-        # Convolve the mask with the kernel
-        tmp2 = signal.convolve2d(tmp1, kernel, boundary='symm', mode='same')
-
-        # #################   COMPUTATION PART II    ###################
-        # Create the CR Mask
-        t2 = (mult2 * blot_deriv + snr2 * ta / gain)  # / expmult
-        cr_mask = (t1 <= t2) | (tmp2 >= 9)
-
-        # #################   COMPUTATION PART III    ##################
-        # flag additional cte 'radial' and 'tail' pixels surrounding CR pixels
-        # as CRs
-
-        # In both the 'radial' and 'length' kernels below, 0->good and 1->bad,
-        # so that upon convolving the kernels with cr_mask, the convolution
-        # output will have low->bad and high->good from which 2 new arrays are
-        # created having 0->bad and 1->good. These 2 new arrays are then
-        # 'anded' to create a new cr_mask.
-
-        # make radial convolution kernel and convolve it with original cr_mask
-        cr_grow_kernel = np.ones((grow, grow), dtype=np.uint16)
-        cr_grow_kernel_conv = signal.convolve2d(
-            cr_mask, cr_grow_kernel, boundary='symm', mode='same'
-        )
-
-        # make tail convolution kernel and convolve it with original cr_mask
-        cr_ctegrow_kernel = np.zeros((2 * ctegrow + 1, 2 * ctegrow + 1))
-
-        # which pixels are masked by tail kernel depends on sign of
-        # sci_chip.cte_dir (i.e.,readout direction):
-        if sci_chip.cte_dir == 1:
-            # 'positive' direction:  HRC: amp C or D; WFC: chip = sci,1; WFPC2
-            cr_ctegrow_kernel[0:ctegrow, ctegrow] = 1
-        elif sci_chip.cte_dir == -1:
-            # 'negative' direction:  HRC: amp A or B; WFC: chip = sci,2
-            cr_ctegrow_kernel[ctegrow+1:2*ctegrow+1, ctegrow] = 1
-
-        # do the convolution
-        cr_ctegrow_kernel_conv = signal.convolve2d(
-            cr_mask, cr_ctegrow_kernel, boundary='symm', mode='same'
-        )
-
-        # select high pixels from both convolution outputs;
-        # then 'and' them to create new cr_mask
-        cr_grow_mask = cr_grow_kernel_conv >= grow**2  # radial
-        cr_ctegrow_mask = cr_ctegrow_kernel_conv >= ctegrow  # length
-        cr_mask = cr_grow_mask & cr_ctegrow_mask
+        cr_mask = _cr_mask(input_image, blot_data, blot_deriv, gain, rn,
+                           backg, (snr1, snr2), (mult1, mult2), grow,
+                           ctegrow, sci_chip.cte_dir)
 
         # Apply CR mask to the DQ array in place
         dq_mask &= cr_mask
@@ -299,6 +256,119 @@ def _driz_cr(sciImage, virtual_outputs, paramDict):
                        sciImage._filename)
 
 
+def _cr_mask(input_image, blot_data, blot_deriv, gain, rn, backg, snr,
+             scale, grow, ctegrow, cte_dir):
+    """ Return the cosmic ray mask (`True` for good pixels) of a chip from
+    its ``input_image``, the blotted median image ``blot_data`` and its
+    derivative ``blot_deriv``, all in electrons.
+
+    ``snr`` and ``scale`` are pairs of signal-to-noise ratios and derivative
+    scaling factors, ``grow`` the size of the box of pixels around cosmic
+    rays to be masked and ``ctegrow`` the length of their CTE tails, in the
+    readout direction ``cte_dir`` of the chip.
+
+    The masks are computed as the thresholded convolutions of boolean masks
+    with boxes of ones of the original algorithm (with symmetric boundary
+    conditions): a pixel passes such a threshold only when all pixels under
+    the box are set, that is the mask gets eroded by the box, which is done
+    with separable minimum filters.
+    """
+    snr1, snr2 = snr
+    mult1, mult2 = scale
+
+    # #################   COMPUTATION PART I    ###################
+    # Create a temporary array mask
+    t1 = np.subtract(input_image, blot_data)
+    np.absolute(t1, out=t1)
+    # ta = np.sqrt(gain * np.abs((blot_data + backg) * expmult) + rn**2)
+    ta = np.add(blot_data, backg)
+    np.absolute(ta, out=ta)
+    ta = _ufunc_out(np.multiply, ta, gain, ta)
+    ta = _ufunc_out(np.add, ta, rn**2, ta)
+    np.sqrt(ta, out=ta)
+
+    def passes(mult, snr, t2=None, deriv=None):
+        # t1 <= mult * blot_deriv + snr * ta / gain  # / expmult
+        t2 = _ufunc_out(np.multiply, ta, snr, t2)
+        t2 = _ufunc_out(np.true_divide, t2, gain, t2)
+        deriv = _ufunc_out(np.multiply, blot_deriv, mult, deriv)
+        t2 = _ufunc_out(np.add, deriv, t2, t2)
+        return np.less_equal(t1, t2), t2, deriv
+
+    tmp1, t2, deriv = passes(mult1, snr1)
+
+    # Keep pixels whose 3 x 3 neighborhood passes the first threshold:
+    tmp2 = _erode(tmp1, 3, axis=(0, 1))
+
+    # #################   COMPUTATION PART II    ###################
+    # Create the CR Mask
+    cr_mask, t2, deriv = passes(mult2, snr2, t2, deriv)
+    del t1, ta, t2, deriv
+    cr_mask |= tmp2
+    del tmp1, tmp2
+
+    # #################   COMPUTATION PART III    ##################
+    # flag additional cte 'radial' and 'tail' pixels surrounding CR pixels
+    # as CRs: keep only good pixels whose 'grow' x 'grow' box ('radial') and
+    # whose 'ctegrow' pixels along the column away from the readout
+    # amplifier ('tail') are all good.
+    if grow < 1:
+        raise ValueError("'driz_cr_grow' must be a positive integer.")
+    cr_grow_mask = _erode(cr_mask, grow, axis=(0, 1))
+
+    if ctegrow > 0:
+        # which pixels are masked by tail kernel depends on sign of
+        # cte_dir (i.e.,readout direction):
+        if cte_dir == 1:
+            # 'positive' direction:  HRC: amp C or D; WFC: chip = sci,1; WFPC2
+            # the tail is made of the 'ctegrow' following rows
+            cr_grow_mask &= _erode(cr_mask, ctegrow, axis=0, shift=1)
+        elif cte_dir == -1:
+            # 'negative' direction:  HRC: amp A or B; WFC: chip = sci,2
+            # the tail is made of the 'ctegrow' preceding rows
+            cr_grow_mask &= _erode(cr_mask, ctegrow, axis=0, shift=-ctegrow)
+        else:
+            # an empty tail kernel never reaches the 'ctegrow' threshold
+            cr_grow_mask[...] = False
+
+    return cr_grow_mask
+
+
+def _ufunc_out(ufunc, x, y, out=None):
+    """ Return ``ufunc(x, y)``, computed in place in ``out`` when it is
+    an array of the data type of the result. """
+    if out is not None and out.dtype == np.result_type(x, y):
+        return ufunc(x, y, out=out)
+    return ufunc(x, y)
+
+
+def _erode(mask, size, axis, shift=None):
+    """ Return the boolean ``mask`` eroded by a box of ``size`` pixels along
+    each of the axes ``axis`` (with symmetric boundary conditions), that is
+    set where all pixels in the box are set.
+
+    Without a ``shift``, the box is placed as a kernel of that size by
+    `scipy.signal.convolve2d` in 'same' mode: over pixels ``i - size // 2``
+    to ``i + (size - 1) // 2``. Otherwise, for a single ``axis``, the box
+    starts at pixel ``i + shift``.
+    """
+    out = mask.view(np.uint8)
+    if shift is None:
+        for ax in np.atleast_1d(axis):
+            out = ndimage.minimum_filter1d(out, size, axis=ax, mode='reflect')
+        return out.view(np.bool_)
+
+    # pad by 'size' pixels on both sides so that the shifted box never
+    # falls outside of the padded mask:
+    pad = [(0, 0)] * mask.ndim
+    pad[axis] = (size, size)
+    out = ndimage.minimum_filter1d(np.pad(out, pad, mode='symmetric'), size,
+                                   axis=axis, mode='reflect')
+    start = size + shift + size // 2
+    return np.take(out, range(start, start + mask.shape[axis]),
+                   axis=axis).view(np.bool_)
+
+
 def createCorrFile(outfile, arrlist, template):
     """
     Create a _cor file with the same format as the original input image.
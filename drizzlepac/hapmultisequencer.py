@@ -37,6 +37,13 @@
       variable, if found with an affirmative value, will turn on processing to generate a JSON
       file which contains the results of evaluating the quality of the generated products.
 
+    The performance of the processing steps can be recorded through the use of the
+    environment variable:
+
+    - **MVM_TELEMETRY** : Write the elapsed and CPU time, peak memory and bytes read and
+      written by each processing step next to the trailer file, either as JSON lines
+      ('jsonl') or as a Chrome trace ('chrome').
+
 """
 import datetime
 import fnmatch
@@ -53,6 +60,7 @@ from astropy.table import Table
 import numpy as np
 import drizzlepac
 
+from drizzlepac import util
 from drizzlepac.haputils import cell_utils
 from drizzlepac.haputils import config_utils
 from drizzlepac.haputils import poller_utils
@@ -76,6 +84,10 @@ log = logutil.create_logger(__name__, level=logutil.logging.NOTSET, stream=sys.s
 envvar_bool_dict = {'off': False, 'on': True, 'no': False, 'yes': True, 'false': False, 'true': True}
 envvar_qa_mvm = "MVM_QUALITY_TESTING"
 
+# Environment variable which turns on writing of the performance records of the
+# processing steps next to the trailer file: 'jsonl' (JSON lines) or 'chrome' (trace)
+envvar_telemetry_mvm = "MVM_TELEMETRY"
+
 # Default values for these environment variables set to include all available data
 envvar_cat_mvm = {"MVM_INCLUDE_SMALL": 'true',
                   "MVM_ONLY_CTE": 'false'}
@@ -345,6 +357,8 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
     # start processing
     starting_dt = datetime.datetime.now()
     log.info("Run start time: {}".format(str(starting_dt)))
+    proc_steps = util.ProcSteps()
+    telemetry = os.environ.get(envvar_telemetry_mvm, 'none').lower()
     total_obj_list = []
     product_list = []
     manifest_name = ""
@@ -356,10 +370,13 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
         # where its FilterProduct is distinguished by the filter in use, and the ExposureProduct
         # is the atomic exposure data.
         log.info("Parse the poller and determine what exposures need to be combined into separate products.\n")
+        proc_steps.addStep('Parse Poller')
         obs_info_dict, total_obj_list = poller_utils.interpret_mvm_input(input_filename, log_level,
                                                                          layer_method='all',
                                                                          include_small=cat_switches['MVM_INCLUDE_SMALL'],
                                                                          only_cte=cat_switches['MVM_ONLY_CTE'])
+        proc_steps.endStep('Parse Poller')
+        proc_steps.setStepInfo('Parse Poller', nexposures=sum(len(f.edp_list) for f in total_obj_list))
         # The product_list is a list of all the output products which will be put into the manifest file
         product_list = []
 
@@ -373,6 +390,7 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
         log.info("The manifest will contain the names of all the output products.")
 
         # Update the SkyCellProduct objects with their associated configuration information.
+        proc_steps.addStep('Configuration')
         for filter_item in total_obj_list:
             _ = filter_item.generate_metawcs(custom_limits=custom_limits)
             # Compute mask keywords early in processing for use in determining what
@@ -401,22 +419,28 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
                                                             input_custom_pars_file=input_custom_pars_file,
                                                             output_custom_pars_file=output_custom_pars_file)
         log.info("The configuration parameters have been read and applied to the drizzle objects.")
+        proc_steps.endStep('Configuration')
 
         # TODO: This is the place where updated WCS info is migrated from drizzlepac params to filter objects
         if skip_gaia_alignment:
             log.info("Gaia alignment step skipped. Existing input image alignment solution will be used instead.")
         else:
+            proc_steps.addStep('Align to Gaia')
             reference_catalog = run_align_to_gaia(total_obj_list,
                                                   custom_limits=custom_limits,
                                                   log_level=log_level,
                                                   diagnostic_mode=diagnostic_mode)
             if reference_catalog:
                 product_list += [reference_catalog]
+            proc_steps.endStep('Align to Gaia')
 
         # Run AstroDrizzle to produce drizzle-combined products
         log.info("\n{}: Create drizzled imagery products.".format(str(datetime.datetime.now())))
+        proc_steps.addStep('Drizzle Products')
         driz_list = create_drizzle_products(total_obj_list, custom_limits=custom_limits)
         product_list += driz_list
+        proc_steps.endStep('Drizzle Products')
+        proc_steps.setStepInfo('Drizzle Products', nexposures=sum(len(f.edp_list) for f in total_obj_list))
 
         # Store total_obj_list to a pickle file to speed up development
         if False:
@@ -437,7 +461,9 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
             log.info("MVM Quality Assurance statistics have been requested for this dataset, {}.".format(input_filename))
 
             # Get WCSNAMEs of all input exposures for each MVM product
+            proc_steps.addStep('Quality Analysis')
             mvm_qa.run_quality_analysis(total_obj_list, log_level=log_level)
+            proc_steps.endStep('Quality Analysis')
 
         # 9: Compare results to HLA classic counterparts (if possible)
         # if diagnostic_mode:
@@ -522,6 +548,13 @@ def run_mvm_processing(input_filename, skip_gaia_alignment=True, diagnostic_mode
         log.info('Total processing time: {} sec'.format((end_dt - starting_dt).total_seconds()))
         log.info("Return code for use by calling Condor/OWL workflow code: 0 (zero) for success, non-zero for error or exit. ")
         log.info("Return condition {}".format(return_value))
+        if telemetry in ['jsonl', 'chrome']:
+            telemetry_name = util.telemetry_filename(logname, telemetry)
+            try:
+                proc_steps.writeTelemetry(telemetry_name, format=telemetry)
+                log.info("Performance telemetry written to {}".format(telemetry_name))
+            except OSError as e:
+                log.warning("Unable to write performance telemetry to {}: {}".format(telemetry_name, e))
         logging.shutdown()
         # Append total trailer file (from astrodrizzle) to all total log files
         if total_obj_list:
@@ -35,6 +35,13 @@
       variable, if found with an affirmative value, will turn on processing to generate a JSON
       file which contains the results of evaluating the quality of the generated products.
 
+    The performance of the processing steps can be recorded through the use of the
+    environment variable:
+
+    - SVM_TELEMETRY : Write the elapsed and CPU time, peak memory and bytes read and
+      written by each processing step next to the trailer file, either as JSON lines
+      ('jsonl') or as a Chrome trace ('chrome').
+
     NOTE: Step 9 compares the output HAP products to the Hubble Legacy Archive (HLA)
     products. In order for step 9 (run_sourcelist_comparison()) to run, the following
     environment variables need to be set:
@@ -97,6 +104,10 @@ envvar_cat_svm = {"SVM_CATALOG_SBC": 'on',
                   "SVM_CATALOG_WFPC2": 'on'}
 envvar_cat_str = "SVM_CATALOG_{}"
 
+# Environment variable which turns on writing of the performance records of the
+# processing steps next to the trailer file: 'jsonl' (JSON lines) or 'chrome' (trace)
+envvar_telemetry_svm = "SVM_TELEMETRY"
+
 # --------------------------------------------------------------------------------------------------------------
 
 
@@ -507,6 +518,8 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
     # start processing
     starting_dt = datetime.datetime.now()
     log.info("Run start time: {}".format(str(starting_dt)))
+    proc_steps = util.ProcSteps()
+    telemetry = os.environ.get(envvar_telemetry_svm, 'none').lower()
 
     # Start by reading in any environment variable related to catalog generation that has been set
     cat_switches = {sw: _get_envvar_switch(sw, default=envvar_cat_svm[sw]) for sw in envvar_cat_svm}
@@ -530,7 +543,10 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
         # is the atomic exposure data. Note: the TotalProduct was enhanced to also be comprised
         # of an GrismExposureProduct list which is exclusive to the TotalProduct.
         log.info("Parse the poller and determine what exposures need to be combined into separate products.\n")
+        proc_steps.addStep('Parse Poller')
         obs_info_dict, total_obj_list = poller_utils.interpret_obset_input(input_filename, log_level)
+        proc_steps.endStep('Parse Poller')
+        proc_steps.setStepInfo('Parse Poller', nexposures=sum(len(t.edp_list) for t in total_obj_list))
 
         # Generate the name for the manifest file which is for the entire visit.  It is fine
         # to use only one of the Total Products to generate the manifest name as the name is not
@@ -560,7 +576,9 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
             sys.exit(0)
 
         # Update all of the product objects with their associated configuration information.
+        proc_steps.addStep('Configure and Align')
         for total_item in total_obj_list:
+            proc_steps.addStep('Configure and Align', chip=total_item.drizzle_filename)
             for edp_file in total_item.edp_list:
                 # Pull in any manifest files from previous processing and include in product_list
                 mfiles = glob.glob(f"{edp_file.exposure_name}*_manifest.txt")
@@ -621,20 +639,27 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
                 log.warning("This Total Data Product only has Grism/Prism data and no direct images: {}".format(total_item.drizzle_filename))
                 log.warning("No SVM processing is done for the Grism/Prism data - no SVM output products are generated.")
                 product_list += [total_item.trl_filename]
+            proc_steps.endStep('Configure and Align', chip=total_item.drizzle_filename)
+        proc_steps.endStep('Configure and Align')
 
         # Run AstroDrizzle to produce drizzle-combined products
         log.info("\n{}: Create drizzled imagery products.".format(str(datetime.datetime.now())))
+        proc_steps.addStep('Drizzle Products')
         driz_list = create_drizzle_products(total_obj_list)
         product_list += driz_list
+        proc_steps.endStep('Drizzle Products')
+        proc_steps.setStepInfo('Drizzle Products', nexposures=sum(len(t.edp_list) for t in total_obj_list))
 
         # Create source catalogs from newly defined products (HLA-204)
         log.info("{}: Create source catalog from newly defined product.\n".format(str(datetime.datetime.now())))
         if "total detection product 00" in obs_info_dict.keys():
+            proc_steps.addStep('Source Catalogs')
             catalog_list = create_catalog_products(total_obj_list, log_level,
                                                    diagnostic_mode=diagnostic_mode,
                                                    phot_mode=phot_mode,
                                                    catalog_switches=cat_switches)
             product_list += catalog_list
+            proc_steps.endStep('Source Catalogs')
         else:
             log.warning("No total detection product has been produced. The sourcelist generation step has been skipped")
 
@@ -655,7 +680,9 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
         # If requested, generate quality assessment statistics for the SVM products
         if qa_switch:
             log.info("SVM Quality Assurance statistics have been requested for this dataset, {}.".format(input_filename))
+            proc_steps.addStep('Quality Analysis')
             svm_qa.run_quality_analysis(total_obj_list, log_level=log_level)
+            proc_steps.endStep('Quality Analysis')
 
         # 10: Return exit code for use by calling Condor/OWL workflow code: 0 (zero) for success, 1 for error condition
         return_value = 0
@@ -719,6 +746,13 @@ def run_hap_processing(input_filename, diagnostic_mode=False, input_custom_pars_
         log.info('Total processing time: {} sec'.format((end_dt - starting_dt).total_seconds()))
         log.info("Return exit code for use by calling Condor/OWL workflow code: 0 (zero) for success, 1 for error ")
         log.info("Return condition {}".format(return_value))
+        if telemetry in ['jsonl', 'chrome']:
+            telemetry_name = util.telemetry_filename(logname, telemetry)
+            try:
+                proc_steps.writeTelemetry(telemetry_name, format=telemetry)
+                log.info("Performance telemetry written to {}".format(telemetry_name))
+            except OSError as e:
+                log.warning("Unable to write performance telemetry to {}: {}".format(telemetry_name, e))
         logging.shutdown()
 
         # The Grism/Prism SVM FLT/FLC images which have had their WCS reconciled with the
@@ -6,9 +6,10 @@ A class which makes image objects for each input filename.
 :License: :doc:`LICENSE`
 
 """
-import copy, os, re, sys
+import collections, copy, os, re, sys, threading
 
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
 from stwcs import distortion
 
 from stsci.tools import fileutil, logutil, textutil
@@ -16,9 +17,11 @@ from astropy.io import fits
 from . import util
 from . import wcs_functions
 from . import buildmask
+from . import refcache
 from . import __version__
 
-__all__ = ['baseImageObject', 'imageObject', 'WCSObject']
+__all__ = ['baseImageObject', 'imageObject', 'WCSObject', 'MaskCache',
+           'ConstantArray', 'constant_image']
 
 
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
@@ -30,6 +33,226 @@ _NUMPY_TO_IRAF_DTYPES = {'float64': -64, 'float32': -32, 'uint8': 8,
 _IRAF_DTYPES_TO_NUMPY = {-64: 'float64', -32: 'float32', 8: 'uint8',
                          16: 'int16', 32: 'int32', 64: 'int64'}
 
+# Maximum size (in MB) of the packed DQ masks cached for each input image
+_mask_cache_size_ = 16
+
+
+class ConstantArray(NDArrayOperatorsMixin):
+    """ An array of a given shape with the same value for all its elements,
+    such as the detector model images (read noise, dark, sky, ...) of a chip,
+    which stays a scalar until it gets combined with a per-pixel array.
+
+    Arithmetic operations and numpy ufuncs between `ConstantArray` objects
+    and scalars return a new `ConstantArray`. When combined with a regular
+    array, the constant value gets broadcast to the shape of that array,
+    without ever allocating a full array for it. The result has the same
+    type and values as if the constant had been a full array.
+    `numpy.asarray` returns the equivalent full array.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the array.
+
+    value : numpy.ndarray
+        Array with any number of elements set to the constant value and with
+        the data type of the array.
+
+    """
+    def __init__(self, shape, value):
+        self.shape = tuple(shape)
+        # A single element array keeps the type promotion rules of arrays
+        # (instead of those of scalars) when combined with other arrays.
+        self._unit = np.asarray(value).reshape(-1)[:1].reshape(
+            (1,) * len(self.shape))
+
+    @property
+    def value(self):
+        """ Constant value of all elements. """
+        return self._unit.flat[0]
+
+    @property
+    def dtype(self):
+        return self._unit.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __repr__(self):
+        return 'ConstantArray(shape={}, value={!r})'.format(self.shape,
+                                                           self.value)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.full(self.shape, self.value,
+                       dtype=self.dtype if dtype is None else dtype)
+
+    def __getitem__(self, key):
+        return np.asarray(self)[key]
+
+    def astype(self, dtype, copy=True):
+        """ Return a `ConstantArray` with the value converted to ``dtype``. """
+        return ConstantArray(self.shape, self._unit.astype(dtype))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__':
+            return NotImplemented
+        out = kwargs.get('out', ())
+        if any(isinstance(o, ConstantArray) for o in out):
+            # in-place operations (``a *= b``) return a new object instead
+            del kwargs['out']
+            out = ()
+
+        values = [x._unit if isinstance(x, ConstantArray) else x
+                  for x in inputs]
+        result = ufunc(*values, **kwargs)
+        if out:
+            return result
+
+        shape = np.broadcast(*[np.broadcast_to(0, x.shape) for x in inputs
+                               if hasattr(x, 'shape')]).shape
+        constant = not any(isinstance(x, np.ndarray) and x.ndim > 0
+                           for x in inputs)
+        if ufunc.nout > 1:
+            return tuple(self._result(r, shape, constant) for r in result)
+        return self._result(result, shape, constant)
+
+    @staticmethod
+    def _result(result, shape, constant):
+        if constant:
+            return ConstantArray(shape, result)
+        if result.shape != shape:
+            result = np.broadcast_to(result, shape).copy()
+        return result
+
+
+def constant_image(shape, dtype, value):
+    """ Return a `ConstantArray` equivalent to
+    ``np.ones(shape, dtype=dtype) * value``. """
+    return ConstantArray(shape, np.ones(1, dtype=dtype) * value)
+
+
+def _sample(x):
+    """ Single element of an array, `ConstantArray` or scalar ``x`` with
+    which to evaluate the type of the result of an operation. """
+    if isinstance(x, ConstantArray):
+        return x._unit.reshape(1)
+    if isinstance(x, np.ndarray):
+        return x.reshape(-1)[:1]
+    return x
+
+
+def _combine(ufunc, a, b, tmp=None):
+    """ Return ``ufunc(a, b)`` for arrays, `ConstantArray` or scalars ``a``
+    and ``b``, computed in place in ``tmp``, one of the inputs which is a
+    temporary array, when it has the type and shape of the result. """
+    if not isinstance(tmp, np.ndarray):
+        return ufunc(a, b)
+    with np.errstate(all='ignore'):
+        dtype = ufunc(_sample(a), _sample(b)).dtype
+    if dtype == tmp.dtype and \
+       np.broadcast(*[np.broadcast_to(0, np.shape(x)) for x in (a, b)
+                      if not np.isscalar(x)]).shape == tmp.shape:
+        return ufunc(a, b, out=tmp)
+    return ufunc(a, b)
+
+
+class MaskCache:
+    """ A least recently used cache of the DQ masks built for the chips of
+    an image, keyed by chip and bit value.
+
+    Masks built by `baseImageObject.buildMask` only hold 0 and 1 values: they
+    are kept packed, with 8 pixels per byte, and a new (writable) copy gets
+    unpacked for each request.
+
+    Parameters
+    ----------
+    max_size : float
+        Maximum total size (in MB) of the packed masks kept in the cache.
+        A value of 0 disables the cache.
+
+    """
+    def __init__(self, max_size=_mask_cache_size_):
+        self.max_size = max_size
+        self._masks = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._masks)
+
+    @property
+    def nbytes(self):
+        """ Total size (in bytes) of the packed masks. """
+        with self._lock:
+            return sum(m[0].nbytes for m in self._masks.values())
+
+    @staticmethod
+    def _key(chip, bits):
+        return (chip, bits if isinstance(bits, (int, type(None))) else str(bits))
+
+    def get(self, chip, bits):
+        """ Return a new copy of the mask of ``chip`` for ``bits`` or `None`.
+        """
+        key = self._key(chip, bits)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+            self._masks.move_to_end(key)
+            self.hits += 1
+
+        packed, shape, dtype = mask
+        count = int(np.prod(shape))
+        return np.unpackbits(packed, count=count).reshape(shape).astype(
+            dtype, copy=False)
+
+    def put(self, chip, bits, mask):
+        """ Save a packed copy of the 0/1 ``mask`` of ``chip`` for ``bits``.
+        """
+        max_bytes = int(self.max_size * 1048576)
+        if max_bytes <= 0 or mask is None:
+            return
+        packed = np.packbits(mask, axis=None)
+        if packed.nbytes > max_bytes:
+            return
+
+        with self._lock:
+            self._masks[self._key(chip, bits)] = (packed, mask.shape,
+                                                  mask.dtype)
+            nbytes = sum(m[0].nbytes for m in self._masks.values())
+            while nbytes > max_bytes and len(self._masks) > 1:
+                _, m = self._masks.popitem(last=False)
+                nbytes -= m[0].nbytes
+
+    def invalidate(self, chip=None):
+        """ Remove the masks of ``chip`` (or of all chips) from the cache. """
+        with self._lock:
+            for key in list(self._masks):
+                if chip is None or key[0] == chip:
+                    del self._masks[key]
+
+    def stats(self):
+        """ Return a dictionary with the number of hits and misses, and the
+        number and total size (in bytes) of the cached masks. """
+        return {'hits': self.hits, 'misses': self.misses,
+                'nmasks': len(self), 'nbytes': self.nbytes}
+
 
 class baseImageObject:
     """ Base ImageObject which defines the primary set of methods. """
@@ -53,6 +276,7 @@ class baseImageObject:
         self.createContext = True
 
         self.inmemory = False # flag for all in-memory operations
+        self.maskCache = MaskCache()
         #this is the number of science chips to be processed in the file
         self._numchips=1
         self._nextend=0
@@ -100,6 +324,11 @@ class baseImageObject:
         if self._image is None:
             return
 
+        if self.maskCache.hits or self.maskCache.misses:
+            log.debug("DQ mask cache of {:s}: {}".format(
+                self._filename, self.maskCache.stats()))
+        self.maskCache.invalidate()
+
         # mcara: I think the code below is not necessary but in order to
         #        preserve the same functionality as the code removed below,
         #        I make an empty copy of the image object:
@@ -546,10 +775,9 @@ class baseImageObject:
         # jref$, used in the specification of the reference filename
         if flat_file is None:
             flat_file = fileutil.osfn(self._image["PRIMARY"].header[self.flatkey])
-        hdulist = None
         try:
-            hdulist = fileutil.openImage(flat_file, mode='readonly', memmap=False)
-            data = hdulist[(flat_ext, chip)].data
+            # read-only array shared by all the exposures using this flat
+            data = refcache.reference_cache.getdata(flat_file, (flat_ext, chip))
 
             if data.shape[0] != sci_chip.image_shape[0]:
                 ltv2 = int(np.round(sci_chip.ltv2))
@@ -566,14 +794,11 @@ class baseImageObject:
             flat = data[ltv2:size2, ltv1:size1]
 
         except FileNotFoundError:
-            flat = np.ones(sci_chip.image_shape, dtype=sci_chip.image_dtype)
+            flat = constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                                  1)
             log.warning("Cannot find flat field file '{}'".format(flat_file))
             log.warning("Treating flatfield as a constant value of '1'.")
 
-        finally:
-            if hdulist is not None:
-                hdulist.close()
-
         return flat
 
     def getReadNoiseImage(self, chip):
@@ -583,13 +808,15 @@ class baseImageObject:
         Method for returning the readnoise image of a detector
         (in electrons).
 
-        The method will return an array of the same shape as the image.
+        The method will return a `ConstantArray` of the same shape as
+        the image.
 
         :units: electrons
 
         """
         sci_chip = self._image[self.scienceExt,chip]
-        return np.ones(sci_chip.image_shape,dtype=sci_chip.image_dtype) * sci_chip._rdnoise
+        return constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                              sci_chip._rdnoise)
 
     def getexptimeimg(self,chip):
         """
@@ -604,7 +831,7 @@ class baseImageObject:
 
         Returns
         =======
-        exptimeimg : numpy array
+        exptimeimg : ConstantArray
             The method will return an array of the same shape as the image.
 
         """
@@ -614,7 +841,8 @@ class baseImageObject:
         else:
             wtscl = sci_chip._exptime
 
-        return np.ones(sci_chip.image_shape,dtype=sci_chip.image_dtype)*wtscl
+        return constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                              wtscl)
 
     def getdarkimg(self,chip):
         """
@@ -622,12 +850,14 @@ class baseImageObject:
         =====
         Return an array representing the dark image for the detector.
 
-        The method will return an array of the same shape as the image.
+        The method will return a `ConstantArray` of the same shape as
+        the image.
 
         :units: electrons
         """
         sci_chip = self._image[self.scienceExt,chip]
-        return np.ones(sci_chip.image_shape,dtype=sci_chip.image_dtype)*sci_chip.darkcurrent
+        return constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                              sci_chip.darkcurrent)
 
     def getskyimg(self,chip):
         """
@@ -641,7 +871,8 @@ class baseImageObject:
 
         """
         sci_chip = self._image[self.scienceExt,chip]
-        return np.ones(sci_chip.image_shape,dtype=sci_chip.image_dtype)*sci_chip.subtractedSky
+        return constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                              sci_chip.subtractedSky)
 
     def getdarkcurrent(self):
         """
@@ -716,9 +947,17 @@ class baseImageObject:
         mask? Like vignetting areas and chip boundries in nicmos which
         are camera dependent? these are not defined in the DQ masks, but
         should be masked out to get the best results in multidrizzle.
+
+        Masks get cached (see `MaskCache`), and the DQ array read for the
+        first of them is kept with the image, until `invalidateMasks` is
+        called for the chip.
         """
-        dqarr = self.getData(exten=self.maskExt+','+str(chip))
-        dqmask = buildmask.buildMask(dqarr,bits)
+        dqmask = self.maskCache.get(chip, bits)
+        if dqmask is None:
+            dqarr = self.getData(exten=self.maskExt+','+str(chip))
+            dqmask = buildmask.buildMask(dqarr,bits)
+            self.maskCache.put(chip, bits, dqmask)
+            del dqarr
 
         if write:
             phdu = fits.PrimaryHDU(data=dqmask,header=self._image[self.maskExt,chip].header)
@@ -731,9 +970,23 @@ class baseImageObject:
             # record the name of this mask file that was created for later
             # removal by the 'clean()' method
             self._image[self.scienceExt,chip].outputNames['dqmask'] = dqmask_name
-        del dqarr
         return dqmask
 
+    def invalidateMasks(self, chip=None):
+        """ Discard the cached masks and DQ array of ``chip`` (or of all chips)
+        after the DQ array got modified in the input file, so that they get
+        built again from the file when needed.
+        """
+        self.maskCache.invalidate(chip)
+        if self._image is None:
+            return
+        chips = range(1, self._numchips + 1) if chip is None else [chip]
+        for c in chips:
+            try:
+                self._image[self.maskExt, c].data = None
+            except (KeyError, IndexError):
+                pass
+
     def buildEXPmask(self, chip, dqarr):
         """ Builds a weight mask from an input DQ array and the exposure time
         per pixel for this chip.
@@ -782,16 +1035,23 @@ class baseImageObject:
             #exptime = self.getexptimeimg(chip)
             #exptime = sci_chip._exptime
             #ivm = (flat*exptime)**2/(darkimg+(skyimg*flat)+RN**2)
-            ivm = (flat)**2/(darkimg+(skyimg*flat)+RN**2)
+            # Same as (flat)**2/(darkimg+(skyimg*flat)+RN**2) * dqarr with
+            # constant detector images kept as scalars and temporary
+            # arrays reused for the intermediate results.
+            noise = skyimg * flat
+            noise = _combine(np.add, noise, darkimg, tmp=noise)
+            noise = _combine(np.add, noise, RN**2, tmp=noise)
+            ivm = flat**2
+            ivm = _combine(np.divide, ivm, noise, tmp=ivm)
 
            # Multiply the IVM file by the input mask in place.
-            ivmarr = ivm * dqarr
+            ivmarr = _combine(np.multiply, ivm, dqarr, tmp=ivm)
 
         # Update 'wt_scl' parameter to match use of IVM file
         sci_chip._wtscl = pow(sci_chip._exptime,2)/pow(scale,4)
         #sci_chip._wtscl = 1.0/pow(scale,4)
 
-        return ivmarr.astype(np.float32)
+        return np.asarray(ivmarr).astype(np.float32, copy=False)
 
     def buildERRmask(self,chip,dqarr,scale):
         """
@@ -814,7 +1074,9 @@ class baseImageObject:
                 # Multiply the scaled ERR file by the input mask in place.
                 #exptime = self.getexptimeimg(chip)
                 exptime = sci_chip._exptime
-                errmask = (exptime/err)**2 * dqarr
+                errmask = exptime / err
+                np.square(errmask, out=errmask)
+                errmask = _combine(np.multiply, errmask, dqarr, tmp=errmask)
 
                 # Update 'wt_scl' parameter to match use of IVM file
                 #sci_chip._wtscl = pow(sci_chip._exptime,2)/pow(scale,4)
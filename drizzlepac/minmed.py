@@ -26,10 +26,13 @@ or median image based up bad pixel identification.
 #        code up to modern standards.-- Mihai Cara -- 02/19/2018
 import warnings
 import numpy as np
-from scipy import signal
+from scipy import ndimage, signal
 from stsci.image.numcombine import numCombine, num_combine
 from . import __version__
 
+# number of pixels of the stacks of images processed at once by fused_min_med
+_CHUNK_SIZE = 1 << 20
+
 class minmed:
     """ **DEPRECATED** Create a median array, rejecting the highest pixel and
     computing the lowest valid pixel after mask application
@@ -578,34 +581,7 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
         boxshape = (boxsize, boxsize)
         minimum_grow_file = np.zeros_like(images[0])
 
-        # If the boxcar convolution has failed it is potentially for
-        # two reasons:
-        #   1) The kernel size for the boxcar is bigger than the actual image.
-        #   2) The grow parameter was specified with a value < 0.  This would
-        #      result in an illegal boxshape kernel. The dimensions of the
-        #      kernel box *MUST* be integer and greater than zero.
-        #
-        #   If the boxcar convolution has failed, try to give a meaningfull
-        #   explanation as to why based upon the conditionals described above.
-        if boxsize <= 0:
-            errormsg1 = "############################################################\n"
-            errormsg1 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
-            errormsg1 += "# parameter must be greater than or equal to zero. You     #\n"
-            errormsg1 += "# specified an input value for the 'grow' parameter of:    #\n"
-            errormsg1 += "        combine_grow: " + str(combine_grow)+'\n'
-            errormsg1 += "############################################################\n"
-            raise ValueError(errormsg1)
-
-        if boxsize > images.shape[1]:
-            errormsg2 = "############################################################\n"
-            errormsg2 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
-            errormsg2 += "# parameter specified has resulted in a boxcar kernel that #\n"
-            errormsg2 += "# has dimensions larger than the actual image.  You        #\n"
-            errormsg2 += "# specified an input value for the 'grow' parameter of:    #\n"
-            errormsg2 += "        combine_grow: " + str(combine_grow) + '\n'
-            errormsg2 += "############################################################\n"
-            print(images.shape[1:])
-            raise ValueError(errormsg2)
+        _check_boxsize(boxsize, combine_grow, images.shape[1:])
 
         # Attempt the boxcar convolution using the boxshape based upon the user
         # input value of "grow"
@@ -631,3 +607,184 @@ def min_med(images, weight_images, readnoise_list, exptime_list,
     combined_array[all_bad_idx, all_bad_idy] = 0
 
     return combined_array
+
+
+
+def fused_min_med(images, weight_images, readnoise_list, exptime_list,
+                  background_values, weight_masks=None, combine_grow=1,
+                  combine_nsigma1=4, combine_nsigma2=3, fillval=False):
+    """ Create a median array, rejecting the highest pixel and
+    computing the lowest valid pixel after mask application.
+
+    This function returns the same array as `min_med`, which is the reference
+    implementation of the algorithm, while using less memory: the minimum,
+    background, readnoise and weight images are computed in a single pass
+    over chunks of rows of the stack of input images, instead of from
+    temporary copies of the whole stack, the images used to decide between
+    the median and the minimum are updated in place, and the ``combine_grow``
+    regions are found with a separable box filter instead of a 2D
+    convolution.
+
+    Parameters are the same as for `min_med`. ``weight_masks`` should
+    preferably be a boolean array, which avoids making a copy of it.
+
+    """
+    nimages = len(images)
+    combtype_median = 'imedian' if fillval else 'median'
+    images = np.asarray(images)
+    weight_images = np.asarray(weight_images)
+    ny, nx = images.shape[1:]
+
+    if weight_masks is None or np.size(weight_masks) == 0:
+        weight_masks = None
+        all_bad = None
+    else:
+        weight_masks = np.asarray(weight_masks, dtype=bool)
+        mask_sum = np.sum(weight_masks, axis=0, dtype=np.int16)
+        all_bad = mask_sum == nimages
+
+    # The median image is created as in min_med(), one chunk of rows at
+    # a time, in the loop below:
+    if nimages == 2:
+        median_kwargs = dict(combination_type='imean' if fillval else 'mean',
+                             nlow=0, nhigh=0, lower=None, upper=None)
+    else:
+        median_kwargs = dict(combination_type=combtype_median,
+                             nlow=0, nhigh=1, lower=None, upper=None)
+    median_file = np.empty((ny, nx), dtype=images.dtype)
+
+    # Compute the minimum image, and the total effective background,
+    # readnoise**2 and exposure time images (see min_med), in chunks of rows
+    # of the stacks of images:
+    s = np.asarray([bv / et for bv, et in
+                    zip(background_values, exptime_list)])
+    bkgd_file = np.empty((ny, nx), dtype=np.result_type(weight_images, s))
+    weight_file = np.empty((ny, nx), dtype=np.sum(weight_images[:, :1, :1],
+                                                  axis=0).dtype)
+    minimum_file = np.empty((ny, nx), dtype=images.dtype)
+    if weight_masks is None:
+        rdn2 = sum((r**2 for r in readnoise_list))
+        readnoise_file = rdn2 * np.ones_like(images[0])
+    else:
+        rdn2 = np.asarray(readnoise_list)**2
+        readnoise_file = np.empty((ny, nx), dtype=rdn2.dtype)
+        if nimages > 2:
+            one_good = mask_sum == (nimages - 1)
+        del mask_sum
+
+    chunk = max(1, _CHUNK_SIZE // (nimages * nx))
+    for r1 in range(0, ny, chunk):
+        rows = slice(r1, r1 + chunk)
+        median_file[rows] = num_combine(
+            images[:, rows],
+            masks=None if weight_masks is None else weight_masks[:, rows],
+            **median_kwargs
+        )
+        np.sum(weight_images[:, rows] * s[:, None, None], axis=0,
+               out=bkgd_file[rows])
+        np.sum(weight_images[:, rows], axis=0, out=weight_file[rows])
+
+        if weight_masks is None:
+            np.amin(images[:, rows], axis=0, out=minimum_file[rows])
+            continue
+
+        good = np.logical_not(weight_masks[:, rows])
+        np.sum(good * rdn2[:, None, None], axis=0, out=readnoise_file[rows])
+
+        if nimages > 2:
+            # Use the single good pixel value where the median has rejected
+            # it as the highest pixel:
+            idx = np.nonzero(one_good[rows])
+            if idx[0].size:
+                sci_sum = np.sum(images[:, rows] * good, axis=0)
+                median_file[rows][idx] = sci_sum[idx]
+
+        minimum = images[:, rows].copy()
+        minimum[weight_masks[:, rows]] = np.nan
+        minimum[:, all_bad[rows]] = 0
+        np.nanmin(minimum, axis=0, out=minimum_file[rows])
+        del good, minimum
+
+    # Scale up both the median and minimum arrays by the total effective
+    # exposure time per pixel.
+    minimum_file_weighted = minimum_file * weight_file
+    median_file_weighted = median_file * weight_file
+    del weight_file
+
+    # Calculate the 1-sigma r.m.s. (in electrons), in place of the
+    # background image:
+    rms_file = bkgd_file
+    np.add(median_file_weighted, rms_file, out=rms_file)
+    rms_file += readnoise_file
+    np.fmax(rms_file, 0, out=rms_file)
+    np.sqrt(rms_file, out=rms_file)
+    del readnoise_file
+
+    # For the median array, calculate the n-sigma lower threshold:
+    median_rms_file = median_file_weighted - rms_file * combine_nsigma1
+
+    if combine_grow != 0:
+        # Use the lower combine_nsigma2 threshold for the pixels within
+        # 'combine_grow' pixels of those where the minimum would be accepted
+        # (see min_med). These are the pixels where the maximum of the
+        # minimum flag image over the box around them is non-zero, which is
+        # computed one axis at a time.
+        boxsize = int(2 * combine_grow + 1)
+        _check_boxsize(boxsize, combine_grow, images.shape[1:])
+
+        grow = np.less(minimum_file_weighted, median_rms_file).view(np.uint8)
+        grow = ndimage.maximum_filter1d(grow, boxsize, axis=0,
+                                        mode='constant', cval=0)
+        grow = ndimage.maximum_filter1d(grow, boxsize, axis=1,
+                                        mode='constant', cval=0).view(bool)
+        median_rms_file[grow] = (median_file_weighted[grow] -
+                                 rms_file[grow] * combine_nsigma2)
+        del grow
+    del rms_file
+
+    # Finally decide whether to use the minimim or the median (in counts/s),
+    # based on whether the median is more than 3 sigma above the minimum.
+    combined_array = np.where(
+        np.less(minimum_file_weighted, median_rms_file),
+        minimum_file,
+        median_file
+    )
+    # Set fill regions to a pixel value of 0.
+    if all_bad is not None:
+        combined_array[all_bad] = 0
+
+    return combined_array
+
+
+def _check_boxsize(boxsize, combine_grow, shape):
+    """ Check that a boxcar of size ``boxsize``, computed from
+    ``combine_grow``, can be applied to images of the given ``shape``.
+    """
+    # If the boxcar convolution has failed it is potentially for
+    # two reasons:
+    #   1) The kernel size for the boxcar is bigger than the actual image.
+    #   2) The grow parameter was specified with a value < 0.  This would
+    #      result in an illegal boxshape kernel. The dimensions of the
+    #      kernel box *MUST* be integer and greater than zero.
+    #
+    #   If the boxcar convolution has failed, try to give a meaningfull
+    #   explanation as to why based upon the conditionals described above.
+    if boxsize <= 0:
+        errormsg1 = "############################################################\n"
+        errormsg1 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
+        errormsg1 += "# parameter must be greater than or equal to zero. You     #\n"
+        errormsg1 += "# specified an input value for the 'grow' parameter of:    #\n"
+        errormsg1 += "        combine_grow: " + str(combine_grow)+'\n'
+        errormsg1 += "############################################################\n"
+        raise ValueError(errormsg1)
+
+    if boxsize > shape[0]:
+        errormsg2 = "############################################################\n"
+        errormsg2 += "# The boxcar convolution in minmed has failed.  The 'grow' #\n"
+        errormsg2 += "# parameter specified has resulted in a boxcar kernel that #\n"
+        errormsg2 += "# has dimensions larger than the actual image.  You        #\n"
+        errormsg2 += "# specified an input value for the 'grow' parameter of:    #\n"
+        errormsg2 += "        combine_grow: " + str(combine_grow) + '\n'
+        errormsg2 += "############################################################\n"
+        print(shape)
+        raise ValueError(errormsg2)
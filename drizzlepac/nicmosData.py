@@ -10,7 +10,7 @@ import numpy as np
 
 from stsci.tools import fileutil
 
-from .imageObject import imageObject
+from .imageObject import imageObject, constant_image
 
 
 class NICMOSInputImage(imageObject):
@@ -184,7 +184,8 @@ class NICMOSInputImage(imageObject):
         tddobj = fromcalfile(self.name)
 
         if tddobj is None:
-            return np.ones(self.full_shape, dtype=self.image_dtype) * self.getdarkcurrent()
+            return constant_image(self.full_shape, self.image_dtype,
+                                  self.getdarkcurrent())
         else:
             # Create Dark Object from AMPGLOW and Lineark Dark components
             darkobj = tddobj.getampglow() + tddobj.getlindark()
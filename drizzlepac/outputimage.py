@@ -303,6 +303,12 @@ class OutputImage:
         prihdu.header['NDRIZIM'] = (len(self.parlist),
                                    'Drizzle, No. images drizzled onto output')
 
+        # Record where a cropped single drizzle product sits on the full
+        # output frame (see 'adrizzle._crop_wcs')
+        frame_offset = getattr(self.wcs, 'frame_offset', None)
+        if self.single and frame_offset is not None:
+            addFrameKeywords(prihdu.header, *frame_offset)
+
         # Only a subset of these keywords makes sense for the new WCS based
         # transformations. They need to be reviewed to decide what to keep
         # and what to leave out.
@@ -767,6 +773,45 @@ def addWCSKeywords(wcs, hdr, blot=False, single=False, after=None):
         blendheaders.remove_distortion_keywords(hdr)
 
 
+def addFrameKeywords(hdr, xoffset, yoffset, framenx, frameny):
+    """ Update header 'hdr' of an image cropped out of a larger output
+    frame with the position of its first pixel, (xoffset, yoffset), on that
+    frame (using the LTV convention) and with the size of the full frame.
+    """
+    hdr['LTV1'] = (float(-xoffset), 'offset in X to full output frame')
+    hdr['LTV2'] = (float(-yoffset), 'offset in Y to full output frame')
+    hdr['LTM1_1'] = (1.0, 'reciprocal of sampling rate in X')
+    hdr['LTM2_2'] = (1.0, 'reciprocal of sampling rate in Y')
+    hdr['FRAMENX'] = (int(framenx), 'size of full output frame in X')
+    hdr['FRAMENY'] = (int(frameny), 'size of full output frame in Y')
+
+
+def getFrameOffset(hdr):
+    """ Return the (xoffset, yoffset, framenx, frameny) position of an
+    image cropped out of a larger output frame, as written by
+    `addFrameKeywords`, or `None` when the header describes a full frame.
+    """
+    if 'FRAMENX' not in hdr or 'FRAMENY' not in hdr:
+        return None
+    return (int(round(-hdr.get('LTV1', 0.0))), int(round(-hdr.get('LTV2', 0.0))),
+            int(hdr['FRAMENX']), int(hdr['FRAMENY']))
+
+
+def getFullFrameHeader(hdr):
+    """ Return a copy of the header 'hdr' of a cropped image with the WCS
+    moved to the full output frame and the cropping keywords removed.
+    """
+    offset = getFrameOffset(hdr)
+    hdr = hdr.copy()
+    if offset is None:
+        return hdr
+    hdr['CRPIX1'] += offset[0]
+    hdr['CRPIX2'] += offset[1]
+    for kw in ['LTV1', 'LTV2', 'LTM1_1', 'LTM2_2', 'FRAMENX', 'FRAMENY']:
+        hdr.pop(kw, None)
+    return hdr
+
+
 def deleteDistortionKeywords(hdr):
     """ Delete distortion related keywords from output drizzle science header
         since the drizzled image should have no remaining distortion.
@@ -0,0 +1,206 @@
+"""
+Cache of the pixel maps used by the default WCS-based coordinate
+transformation of the drizzle and blot steps.
+
+`~drizzlepac.cdriz.DefaultWCSMapping` evaluates the full input WCS (including
+SIP, NPOL and D2IM distortions) and the output WCS on a grid of input pixels,
+every ``stepsize`` pixels, and interpolates this table of output positions
+while resampling. The separate drizzle and blot steps use the same chip and
+output WCS, so that the table computed for one can be reused by the other.
+Tables are kept in memory, with a least recently used policy and a limit on
+their total size, and can also be saved as ``.npy`` files in a directory
+from which they get memory-mapped, for instance to share them between
+processes.
+
+:License: :doc:`LICENSE`
+
+"""
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+from stsci.tools import logutil
+
+from . import cdriz
+
+__all__ = ['PixmapCache', 'wcs_hash', 'get_mapping', 'pixmap_cache']
+
+log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
+
+
+class PixmapCache:
+    """ A least recently used cache of pixel maps (tables of output
+    positions of `~drizzlepac.cdriz.DefaultWCSMapping`).
+
+    Parameters
+    ----------
+    max_size : float
+        Maximum total size (in MB) of the tables kept in memory. Tables larger
+        than this are not cached. A value of 0 disables the cache.
+
+    cache_dir : str, None
+        Directory in which tables also get saved, as ``.npy`` files, and from
+        which they get memory-mapped when not found in memory. The total size
+        of the files is limited to ``max_size`` as well, removing the oldest
+        ones first.
+
+    """
+    def __init__(self, max_size=64, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._tables = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        """ Total size (in bytes) of the tables kept in memory. """
+        with self._lock:
+            return sum(t.nbytes for t in self._tables.values())
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _max_bytes(self):
+        return int(self.max_size * 1048576)
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, 'pixmap_{:s}.npy'.format(key))
+
+    def get(self, key):
+        """ Return the table saved for ``key`` or `None`. """
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+
+        if self.cache_dir is not None:
+            try:
+                table = np.load(self._filename(key), mmap_mode='r')
+            except (OSError, ValueError):
+                table = None
+            if table is not None:
+                self._store(key, table)
+                with self._lock:
+                    self.hits += 1
+                return table
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, table):
+        """ Save ``table`` for ``key``. """
+        if self.max_size <= 0 or table is None or \
+           table.nbytes > self._max_bytes():
+            return
+        self._store(key, table)
+
+        if self.cache_dir is not None:
+            fname = self._filename(key)
+            if not os.path.exists(fname):
+                tmpname = '{:s}.{:d}.tmp'.format(fname, os.getpid())
+                with open(tmpname, 'wb') as f:
+                    np.save(f, table)
+                os.replace(tmpname, fname)
+                self._trim_dir()
+
+    def clear(self):
+        """ Remove all tables from memory. """
+        with self._lock:
+            self._tables.clear()
+
+    def _store(self, key, table):
+        max_bytes = self._max_bytes()
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            nbytes = sum(t.nbytes for t in self._tables.values())
+            while nbytes > max_bytes and len(self._tables) > 1:
+                k, t = self._tables.popitem(last=False)
+                nbytes -= t.nbytes
+
+    def _trim_dir(self):
+        files = [os.path.join(self.cache_dir, f)
+                 for f in os.listdir(self.cache_dir)
+                 if f.startswith('pixmap_') and f.endswith('.npy')]
+        files.sort(key=os.path.getmtime)
+        nbytes = sum(os.path.getsize(f) for f in files)
+        max_bytes = self._max_bytes()
+        while nbytes > max_bytes and len(files) > 1:
+            f = files.pop(0)
+            nbytes -= os.path.getsize(f)
+            os.remove(f)
+
+
+# Cache used by the drizzle and blot steps:
+pixmap_cache = PixmapCache()
+
+
+def _update_hash(h, wcs):
+    w = wcs.wcs
+    h.update(w.to_header().encode())
+    for value in (w.crpix, w.crval, w.get_cdelt(), w.get_pc(),
+                  w.lonpole, w.latpole):
+        h.update(np.asarray(value, dtype=np.float64).tobytes())
+    h.update(repr(w.get_pv()).encode())
+
+    sip = getattr(wcs, 'sip', None)
+    if sip is None:
+        h.update(b'nosip')
+    else:
+        for value in (sip.a, sip.b, sip.ap, sip.bp, sip.crpix):
+            h.update(b'none' if value is None else
+                     np.asarray(value, dtype=np.float64).tobytes())
+
+    for name in ('cpdis1', 'cpdis2', 'det2im1', 'det2im2'):
+        table = getattr(wcs, name, None)
+        if table is None:
+            h.update(b'none')
+            continue
+        for value in (table.data, table.crpix, table.crval, table.cdelt):
+            h.update(np.asarray(value, dtype=np.float64).tobytes())
+
+
+def wcs_hash(*wcs):
+    """ Return a hash of the content of the WCS objects ``wcs``, including
+    their SIP, NPOL (``cpdis``) and D2IM (``det2im``) distortions. """
+    h = hashlib.sha1()
+    for w in wcs:
+        _update_hash(h, w)
+    return h.hexdigest()
+
+
+def get_mapping(input_wcs, output_wcs, nx, ny, stepsize, cache=None):
+    """ Return a `~drizzlepac.cdriz.DefaultWCSMapping` from ``input_wcs`` to
+    ``output_wcs`` for an input image of ``nx`` by ``ny`` pixels, reusing
+    the table of output positions from ``cache`` (by default,
+    ``pixmap_cache``) when it has already been computed for the same WCS,
+    image size and ``stepsize``.
+    """
+    if cache is None:
+        cache = pixmap_cache
+
+    if stepsize <= 0 or cache.max_size <= 0:
+        return cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny,
+                                       stepsize)
+
+    key = '{:s}_{:d}_{:d}_{:g}'.format(wcs_hash(input_wcs, output_wcs),
+                                       nx, ny, stepsize)
+    table = cache.get(key)
+    if table is not None:
+        log.debug('Using cached pixel map {:s}'.format(key))
+        return cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny,
+                                       stepsize, table)
+
+    mapping = cdriz.DefaultWCSMapping(input_wcs, output_wcs, nx, ny, stepsize)
+    cache.put(key, mapping.table)
+    return mapping
@@ -33,6 +33,7 @@ import os
 import shutil
 import string
 import sys
+import time
 from packaging.version import Version
 
 import numpy as np
@@ -43,7 +44,7 @@ from stsci.tools.bitmask import interpret_bit_flags
 from stwcs import updatewcs as uw
 from stwcs.wcsutil import altwcs, wcscorr
 from stsci.tools import (cfgpars, parseinput, fileutil, asnutil, irafglob,
-                         check_files, logutil, mputil, textutil)
+                         check_files, logutil, textutil)
 
 from . import wcs_functions
 from . import util
@@ -104,6 +105,9 @@ def setCommonInput(configObj, createOutwcs=True):
         # we're probably just working on single images here
         configObj['updatewcs']=False
 
+    # 'num_cores' and 'combine_bufsize' are strings when read from .cfg files
+    interpretResourcePars(configObj)
+
     # maybe we can chunk this part up some more so that we can call just the
     # parts we want
 
@@ -112,6 +116,7 @@ def setCommonInput(configObj, createOutwcs=True):
     asndict, ivmlist, output = process_input(
             configObj['input'], configObj['output'],
             updatewcs=configObj['updatewcs'], wcskey=configObj['wcskey'],
+            num_cores=configObj.get('num_cores'),
             **configObj['STATE OF INPUT FILES'])
 
     if not asndict:
@@ -227,44 +232,42 @@ def setCommonInput(configObj, createOutwcs=True):
     else:
         outwcs = None
 
+    # resolve 'auto' values of 'num_cores' and 'combine_bufsize'
+    tuning = autoTuneResources(imageObjectList, outwcs, configObj)
+
     try:
         # Provide user with some information on resource usage for this run
         # raises ValueError Exception in interactive mode and user quits
         num_cores = configObj.get('num_cores') if use_parallel else 1
 
-        reportResourceUsage(imageObjectList, outwcs, num_cores)
+        reportResourceUsage(imageObjectList, outwcs, num_cores, tuning=tuning)
     except ValueError:
         imageObjectList = None
 
     return imageObjectList, outwcs
 
 
-def reportResourceUsage(imageObjectList, outwcs, num_cores,
-                        interactive=False):
-    """ Provide some information to the user on the estimated resource
-    usage (primarily memory) for this run.
-    """
-
+def _output_wcs(outwcs):
     from . import imageObject
+    if isinstance(outwcs, imageObject.WCSObject):
+        return outwcs.final_wcs
+    return outwcs
+
+
+def estimateMemoryUsage(imageObjectList, outwcs, pool_size):
+    """ Return the estimated memory usage (in bytes) of the drizzle steps
+    run with ``pool_size`` parallel workers, along with the size (in bytes) of
+    the output arrays (science, weight and context) of each drizzle product.
+    """
     if outwcs is None:
         output_mem = 0
     else:
-        if isinstance(outwcs,imageObject.WCSObject):
-            owcs = outwcs.final_wcs
-        else:
-            owcs = outwcs
-        output_mem = np.prod(owcs.pixel_shape) * 4 * 3  # bytes used for output arrays
-    img1 = imageObjectList[0]
-    numchips = 0
-    input_mem = 0
-    for img in imageObjectList:
-        numchips += img._nmembers # account for group parameter set by user
-
-    # if we have the cpus and s/w, ok, but still allow user to set pool size
-    pool_size = util.get_pool_size(num_cores, numchips)
+        # bytes used for output arrays
+        output_mem = int(np.prod(_output_wcs(outwcs).pixel_shape)) * 4 * 3
 
     inimg = 0
     chip_mem = 0
+    input_mem = 0
     for img in imageObjectList:
         for chip in range(1,img._numchips+1):
             cmem = img[chip].shape[0]*img[chip].shape[1]*4
@@ -273,14 +276,148 @@ def reportResourceUsage(imageObjectList, outwcs, num_cores,
                 input_mem += cmem*2
             if chip_mem == 0:
                 chip_mem = cmem
-    max_mem = (input_mem + output_mem*pool_size + chip_mem*2)//(1024*1024)
+    max_mem = input_mem + output_mem*pool_size + chip_mem*2
+
+    return max_mem, output_mem
+
+
+def _resourceValue(name, value, convert):
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value in ['', 'None', 'INDEF']:
+        return None
+    if value.lower() == 'auto':
+        return 'auto'
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError("Invalid value '{:s}' for '{:s}': expected a number, "
+                         "'auto' or None".format(value, name))
+
+
+def interpretResourcePars(configObj):
+    """ Convert the ``num_cores`` and ``combine_bufsize`` parameters in
+    ``configObj``, which accept ``'auto'`` and are therefore read as strings
+    from .cfg files, to an `int` and a `float` respectively, leaving `None`
+    and ``'auto'`` values as they are. """
+    if 'num_cores' in configObj:
+        configObj['num_cores'] = _resourceValue(
+            'num_cores', configObj['num_cores'], int)
+    step4name = util.getSectionName(configObj, 4)
+    if step4name is not None and 'combine_bufsize' in configObj[step4name]:
+        configObj[step4name]['combine_bufsize'] = _resourceValue(
+            'combine_bufsize', configObj[step4name]['combine_bufsize'], float)
+
+
+def autoTuneResources(imageObjectList, outwcs, configObj,
+                      memory_fraction=0.8):
+    """ Replace ``'auto'`` values of the ``num_cores`` and
+    ``combine_bufsize`` parameters in ``configObj`` by values chosen so that
+    the estimated memory usage fits in ``memory_fraction`` of the memory
+    available to this process (see `util.get_available_memory`).
+
+    The number of parallel workers is the largest one, up to the number of
+    CPU cores and of chips, for which the estimate of
+    `estimateMemoryUsage` fits in memory. The buffer size of the median
+    step is then the largest one for which the sections of rows held by all
+    the workers (science, weight and mask arrays of each single drizzle
+    image) fit in the memory left by the median image.
+
+    Returns a list of messages describing the values chosen and why.
+    """
+    step4name = util.getSectionName(configObj, 4)
+    auto_cores = configObj.get('num_cores') == 'auto'
+    auto_bufsize = (step4name is not None and
+                    configObj[step4name].get('combine_bufsize') == 'auto')
+    if not (auto_cores or auto_bufsize):
+        return []
+
+    available = util.get_available_memory()
+    if available is None:
+        budget = None
+        messages = ['Available memory unknown: using default values.']
+    else:
+        budget = available * memory_fraction
+        messages = ['Available memory: {:d} Mb, using up to {:d} Mb.'
+                    .format(available // 1048576, int(budget) // 1048576)]
+
+    numchips = sum(img._nmembers for img in imageObjectList)
+    num_cores = configObj.get('num_cores')
+    if auto_cores:
+        max_cores = util.get_pool_size(None, numchips)
+        num_cores = max_cores
+        if budget is not None:
+            while num_cores > 1 and \
+                  estimateMemoryUsage(imageObjectList, outwcs,
+                                      num_cores)[0] > budget:
+                num_cores -= 1
+        mem = estimateMemoryUsage(imageObjectList, outwcs, num_cores)[0]
+        messages.append(
+            'num_cores = {:d}: {:d} core(s) usable for {:d} chip(s), drizzle '
+            'steps estimated to use {:d} Mb.'.format(
+                num_cores, max_cores, numchips, mem // 1048576))
+        configObj['num_cores'] = num_cores
+
+    if auto_bufsize:
+        bufsize = None
+        if budget is not None and outwcs is not None:
+            nx, ny = _output_wcs(outwcs).pixel_shape
+            median_mem = nx * ny * 4
+            if configObj.get('in_memory'):
+                # single drizzle products are all kept in memory
+                median_mem += estimateMemoryUsage(
+                    imageObjectList, outwcs, 1)[1] * len(imageObjectList)
+            nworkers = util.get_pool_size(num_cores, None)
+            # each pixel (4 bytes) of the buffer of a single drizzle image
+            # comes with a weight (4 bytes) and a mask (1 byte) value
+            per_worker = (budget - median_mem) / nworkers
+            bufsize = int(per_worker / (len(imageObjectList) * 2.25 *
+                                        1048576))
+            # larger buffers than the whole image would not be used
+            bufsize = max(1, min(bufsize, int(np.ceil(median_mem / 1048576))))
+            messages.append(
+                'combine_bufsize = {:d}: median image of {:d} Mb, {:d} '
+                'worker(s) each combining {:d} single drizzle image(s).'
+                .format(bufsize, (nx * ny * 4) // 1048576, nworkers,
+                        len(imageObjectList)))
+        else:
+            messages.append('combine_bufsize = None: default buffer size.')
+        configObj[step4name]['combine_bufsize'] = bufsize
+
+    for msg in messages:
+        log.info('Auto-tuning: ' + msg)
+    return messages
+
+
+def reportResourceUsage(imageObjectList, outwcs, num_cores,
+                        interactive=False, tuning=None):
+    """ Provide some information to the user on the estimated resource
+    usage (primarily memory) for this run.
+    """
+    numchips = 0
+    for img in imageObjectList:
+        numchips += img._nmembers # account for group parameter set by user
+
+    # if we have the cpus and s/w, ok, but still allow user to set pool size
+    pool_size = util.get_pool_size(num_cores, numchips)
+
+    max_mem, output_mem = estimateMemoryUsage(imageObjectList, outwcs,
+                                              pool_size)
+    max_mem //= 1024*1024
 
     print('*'*80)
     print('*')
     print('*  Estimated memory usage:  up to %d Mb.'%(max_mem))
-    print('*  Output image size:       {:d} X {:d} pixels. '.format(*owcs.pixel_shape))
-    print('*  Output image file:       ~ %d Mb. '%(output_mem//(1024*1024)))
+    if outwcs is not None:
+        print('*  Output image size:       {:d} X {:d} pixels. '.format(*_output_wcs(outwcs).pixel_shape))
+        print('*  Output image file:       ~ %d Mb. '%(output_mem//(1024*1024)))
     print('*  Cores available:         %d'%(pool_size))
+    if tuning:
+        print('*')
+        print('*  Auto-tuned parameters:')
+        for msg in tuning:
+            print('*    ' + msg)
     print('*')
     print('*'*80)
 
@@ -523,15 +660,16 @@ def processFilenames(input=None,output=None,infilesOnly=False):
 
 
 def process_input(input, output=None, ivmlist=None, updatewcs=True,
-                  prodonly=False,  wcskey=None, **workinplace):
+                  prodonly=False,  wcskey=None, num_cores=None, **workinplace):
     """
     Create the full input list of filenames after verifying and converting
-    files as needed.
+    files as needed.  Up to ``num_cores`` parallel workers update the WCS of
+    the input files.
     """
 
     newfilelist, ivmlist, output, oldasndict, origflist = buildFileListOrig(
             input, output=output, ivmlist=ivmlist, wcskey=wcskey,
-            updatewcs=updatewcs, **workinplace)
+            updatewcs=updatewcs, num_cores=num_cores, **workinplace)
 
     if not newfilelist:
         buildEmptyDRZ(input, output)
@@ -573,47 +711,47 @@ def process_input(input, output=None, ivmlist=None, updatewcs=True,
     return asndict, ivmlist, output
 
 
-def _process_input_wcs(infiles, wcskey, updatewcs):
+def _process_input_wcs(infiles, wcskey, updatewcs, num_cores=None):
     """
     This is a subset of process_input(), for internal use only.  This is the
     portion of input handling which sets/updates WCS data, and is a performance
     hit - a target for parallelization. Returns the expanded list of filenames.
+
+    The files are processed by up to ``num_cores`` parallel workers (see
+    `util.get_pool_size`), and the time spent on each file is reported in the
+    log along with whether its headers could be updated in place.
     """
 
     # Run parseinput though it's likely already been done in processFilenames
     outfiles = parseinput.parseinput(infiles)[0]
 
-    # Disable parallel processing here for now until hardware I/O gets "wider".
-    # Since this part is IO bound, parallelizing doesn't help more than a little
-    # in most cases, and may actually slow this down on some desktop nodes.
-#   cfgval_num_cores = None # get this from paramDict
-#   pool_size = util.get_pool_size(cfgval_num_cores, len(outfiles))
-    pool_size = 1
-
     # do the WCS updating
     if wcskey in ['', ' ', 'INDEF', None]:
-        if updatewcs:
-            log.info('Updating input WCS using "updatewcs"')
+        if not updatewcs:
+            return outfiles
+        log.info('Updating input WCS using "updatewcs"')
     else:
         log.info('Resetting input WCS to be based on WCS key = %s' % wcskey)
 
+    # Most of the time goes into parsing and updating headers, which does not
+    # release the GIL: run the files in separate processes.
+    pool_size = util.get_pool_size(num_cores, len(outfiles))
+    tasks = [(fname, wcskey, updatewcs) for fname in outfiles]
+    start = time.perf_counter()
     if pool_size > 1:
         log.info('Executing %d parallel workers' % pool_size)
-        subprocs = []
         mp_ctx = multiprocessing.get_context('fork')
-
-        for fname in outfiles:
-            p = mp_ctx.Process(
-                target=_process_input_wcs_single,
-                name='processInput._process_input_wcs()', # for err msgs
-                args=(fname, wcskey, updatewcs)
-            )
-            subprocs.append(p)
-        mputil.launch_and_wait(subprocs, pool_size) # blocks till all done
+        with mp_ctx.Pool(pool_size) as pool:
+            timings = pool.starmap(_process_input_wcs_single, tasks)
     else:
         log.info('Executing serially')
-        for fname in outfiles:
-            _process_input_wcs_single(fname, wcskey, updatewcs)
+        timings = [_process_input_wcs_single(*task) for task in tasks]
+
+    for fname, (elapsed, in_place) in zip(outfiles, timings):
+        log.info('    {:s}: {:.3f} sec ({:s})'.format(
+            fname, elapsed, 'in place' if in_place else 'rewritten'))
+    log.info('WCS of {:d} input files updated in {:.3f} sec'.format(
+        len(outfiles), time.perf_counter() - start))
 
     return outfiles
 
@@ -621,43 +759,118 @@ def _process_input_wcs(infiles, wcskey, updatewcs):
 def _process_input_wcs_single(fname, wcskey, updatewcs):
     """
     See docs for _process_input_wcs.
-    This is separated to be spawned in parallel.
+    This is separated to be spawned in parallel.  Returns the time spent on
+    ``fname`` and whether only its headers had to be rewritten.
     """
+    start = time.perf_counter()
+    in_place = True
     if wcskey in ['', ' ', 'INDEF', None]:
         if updatewcs:
+            # updatewcs may add distortion extensions to the file
             uw.updatewcs(fname, checkfiles=False)
+            in_place = False
+        wkey = wname = None
+    elif wcskey in string.ascii_uppercase:
+        wkey = wcskey
+        wname = ' '
     else:
-        numext = fileutil.countExtn(fname)
-        extlist = []
-        for extn in range(1, numext + 1):
-            extlist.append(('SCI', extn))
-        if wcskey in string.ascii_uppercase:
-            wkey = wcskey
-            wname = ' '
-        else:
-            wname = wcskey
-            wkey = ' '
-        altwcs.restoreWCS(fname, extlist, wcskey=wkey, wcsname=wname)
+        wname = wcskey
+        wkey = ' '
+
     # make an asn table at the end
     # Make sure there is a WCSCORR table for each input image
     if wcskey not in ['', ' ', 'INDEF', None] or updatewcs:
-        wcscorr.init_wcscorr(fname)
+        if not _update_wcs_headers(fname, wcskey=wkey, wcsname=wname):
+            in_place = False
+            if wkey is not None:
+                numext = fileutil.countExtn(fname)
+                extlist = [('SCI', extn) for extn in range(1, numext + 1)]
+                altwcs.restoreWCS(fname, extlist, wcskey=wkey, wcsname=wname)
+            wcscorr.init_wcscorr(fname)
+
+    return time.perf_counter() - start, in_place
+
+
+class _HeaderList(fits.HDUList):
+    """ HDU list built in memory from the HDUs of a file opened read-only,
+    which the `~stwcs.wcsutil.altwcs` and `~stwcs.wcsutil.wcscorr` functions
+    can update without writing anything to the file. """
+    def flush(self, *args, **kwargs):
+        pass
+
+
+def _update_wcs_headers(fname, wcskey=None, wcsname=None):
+    """
+    Restore the WCS with key ``wcskey`` (or name ``wcsname``, as done by
+    `~stwcs.wcsutil.altwcs.restoreWCS`) as the primary WCS of all the ``SCI``
+    extensions of ``fname`` and make sure that the file has a ``WCSCORR``
+    table (`~stwcs.wcsutil.wcscorr.init_wcscorr`), reading and writing only
+    the headers of the file.
+
+    The file is opened read-only and its data are never read: the modified
+    headers are written back over the original ones and a new ``WCSCORR``
+    table is appended at the end of the file.  Returns `False`, leaving the
+    file untouched, when this cannot be done because a header outgrows the
+    space allocated to it in the file or the file is compressed.  When
+    ``wcskey`` is `None`, only the ``WCSCORR`` table gets created.
+    """
+    with fits.open(fname, memmap=True) as hdulist:
+        if (fname.endswith(('.gz', '.bz2', '.zip')) or
+                any(isinstance(hdu, fits.CompImageHDU) for hdu in hdulist)):
+            return False
+
+        hdus = _HeaderList(list(hdulist))
+        nhdus = len(hdus)
+        headers = [str(hdu.header) for hdu in hdus]
+
+        if wcskey is not None:
+            numext = fileutil.countExtn(hdus)
+            extlist = [('SCI', extn) for extn in range(1, numext + 1)]
+            altwcs.restoreWCS(hdus, extlist, wcskey=wcskey, wcsname=wcsname)
+        wcscorr.init_wcscorr(hdus)
+
+        if len(hdus) < nhdus:
+            return False
+
+        updates = []
+        for k, (hdu, header) in enumerate(zip(hdus, headers)):
+            new_header = str(hdu.header)
+            if new_header == header:
+                continue
+            info = hdulist.fileinfo(k)
+            if len(new_header) != info['datLoc'] - info['hdrLoc']:
+                return False
+            updates.append((info['hdrLoc'], new_header.encode('ascii')))
+        new_hdus = list(hdus[nhdus:])
+
+    with open(fname, 'r+b') as f:
+        for offset, header in updates:
+            f.seek(offset)
+            f.write(header)
+
+    if new_hdus:
+        with fits.open(fname, mode='append') as hdulist:
+            for hdu in new_hdus:
+                hdulist.append(hdu)
+
+    return True
 
 
 def buildFileList(input, output=None, ivmlist=None,
-                wcskey=None, updatewcs=True, **workinplace):
+                wcskey=None, updatewcs=True, num_cores=None, **workinplace):
     """
     Builds a file list which has undergone various instrument-specific
     checks for input to MultiDrizzle, including splitting STIS associations.
     """
     newfilelist, ivmlist, output, oldasndict, filelist = \
         buildFileListOrig(input=input, output=output, ivmlist=ivmlist,
-                    wcskey=wcskey, updatewcs=updatewcs, **workinplace)
+                    wcskey=wcskey, updatewcs=updatewcs, num_cores=num_cores,
+                    **workinplace)
     return newfilelist, ivmlist, output, oldasndict
 
 
 def buildFileListOrig(input, output=None, ivmlist=None,
-                wcskey=None, updatewcs=True, **workinplace):
+                wcskey=None, updatewcs=True, num_cores=None, **workinplace):
     """
     Builds a file list which has undergone various instrument-specific
     checks for input to MultiDrizzle, including splitting STIS associations.
@@ -699,7 +912,8 @@ def buildFileListOrig(input, output=None, ivmlist=None,
         filelist = checkDGEOFile(filelist)
 
     # run all WCS updating
-    updated_input = _process_input_wcs(filelist, wcskey, updatewcs)
+    updated_input = _process_input_wcs(filelist, wcskey, updatewcs,
+                                       num_cores=num_cores)
 
     newfilelist, ivmlist = check_files.checkFiles(updated_input, ivmlist)
 
@@ -855,6 +1069,7 @@ def resetDQBits(imageObjectList, cr_bits_value=4096):
                 sci_chip = img._image[img.scienceExt,chip]
                 resetbits.reset_dq_bits(sci_chip.dqfile, cr_bits_value,
                                         extver=chip, extname=sci_chip.dq_extn)
+                img.invalidateMasks(chip)
 
 
 def update_member_names(oldasndict, pydr_input):
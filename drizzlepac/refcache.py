@@ -0,0 +1,179 @@
+"""
+Cache of the reference files (flat fields, darks, distortion files, ...)
+shared by the exposures of an association.
+
+Exposures taken with the same detector and filter use the same reference
+files. `ReferenceCache` keeps the headers and data arrays read from these
+files, so that each of them is opened and decoded only once per process
+instead of once for every chip of every exposure. Data arrays are
+memory-mapped from the files when possible and are returned read-only, as
+they are shared by all the callers. Arrays are kept with a least recently
+used policy and a limit on their total size; cached entries are discarded
+when a file gets modified.
+
+:License: :doc:`LICENSE`
+
+"""
+import collections
+import os
+import threading
+
+from stsci.tools import fileutil, logutil
+
+__all__ = ['ReferenceCache', 'reference_cache']
+
+log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
+
+_missing = object()
+
+
+def _normalize_ext(ext):
+    if isinstance(ext, str):
+        ext = tuple(e.strip() for e in ext.split(','))
+        if len(ext) == 1:
+            ext = ext[0]
+            return int(ext) if ext.isdigit() else ext.upper()
+        return (ext[0].upper(), int(ext[1]))
+    if isinstance(ext, tuple):
+        return (ext[0].upper(), int(ext[1]))
+    return int(ext)
+
+
+class ReferenceCache:
+    """ A least recently used cache of headers and data arrays read from
+    reference files.
+
+    Parameters
+    ----------
+    max_size : float
+        Maximum total size (in MB) of the data arrays kept in the cache.
+        Arrays larger than this are not cached. A value of 0 disables the
+        cache.
+
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        """ Total size (in bytes) of the data arrays kept in the cache. """
+        with self._lock:
+            return sum(_nbytes(e) for e in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _max_bytes(self):
+        return int(self.max_size * 1048576)
+
+    @staticmethod
+    def _key(filename, ext):
+        path = os.path.realpath(fileutil.osfn(filename))
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size, _normalize_ext(ext))
+
+    def _read(self, filename, ext, data):
+        log.debug('Reading extension {} of reference file {:s}'
+                  .format(ext, filename))
+        handle = fileutil.openImage(fileutil.osfn(filename), mode='readonly',
+                                    memmap=True)
+        try:
+            ext = _normalize_ext(ext)
+            hdu = handle[ext]
+            header = hdu.header.copy()
+            arr = hdu.data if data else None
+        finally:
+            handle.close()
+        if arr is not None:
+            arr.flags.writeable = False
+        return header, arr
+
+    def _get(self, filename, ext, data):
+        try:
+            key = self._key(filename, ext)
+        except (OSError, ValueError, IndexError):
+            # let the reading of the file report the problem
+            return self._read(filename, ext, data)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is not None or not data):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._read(filename, ext, data)
+        if self.max_size > 0 and _nbytes(entry) <= self._max_bytes():
+            self._store(key, entry)
+        return entry
+
+    def getdata(self, filename, ext=0):
+        """ Return the (read-only) data array of extension ``ext`` of the
+        reference file ``filename``.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the file, which may include IRAF-style (``jref$``) or
+            environment variables.
+
+        ext : int, str, tuple
+            Extension number, name, or ``(EXTNAME, EXTVER)``, either as a
+            tuple or as a string such as ``'sci,1'``.
+
+        """
+        return self._get(filename, ext, data=True)[1]
+
+    def getheader(self, filename, ext=0):
+        """ Return the header of extension ``ext`` of the reference file
+        ``filename``, without reading its data. """
+        return self._get(filename, ext, data=False)[0].copy()
+
+    def getval(self, filename, keyword, ext=0, default=_missing):
+        """ Return the value of ``keyword`` in the header of extension
+        ``ext`` of ``filename``, or ``default`` (if given) when the keyword
+        is not found. """
+        header = self._get(filename, ext, data=False)[0]
+        if default is _missing:
+            return header[keyword]
+        return header.get(keyword, default)
+
+    def clear(self):
+        """ Remove all entries from the cache. """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Return the number of cache hits and misses and the number and
+        total size of the cached arrays. """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'nentries': len(self._entries),
+                    'nbytes': sum(_nbytes(e) for e in self._entries.values())}
+
+    def _store(self, key, entry):
+        max_bytes = self._max_bytes()
+        with self._lock:
+            # entries of older versions of the same file and extension
+            for k in [k for k in self._entries
+                      if k[0] == key[0] and k[3] == key[3] and k != key]:
+                del self._entries[k]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            nbytes = sum(_nbytes(e) for e in self._entries.values())
+            while nbytes > max_bytes and len(self._entries) > 1:
+                k, e = self._entries.popitem(last=False)
+                nbytes -= _nbytes(e)
+
+
+def _nbytes(entry):
+    return 0 if entry[1] is None else entry[1].nbytes
+
+
+# Cache used for the reference files of all the input images:
+reference_cache = ReferenceCache()
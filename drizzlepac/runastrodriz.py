@@ -5,7 +5,7 @@
 
 :License: :doc:`LICENSE`
 
-USAGE: runastrodriz.py [-bdahfginv] inputFilename [newpath]
+USAGE: runastrodriz.py [-bdahfgilnpv] inputFilename [newpath]
 
 Alternative USAGE:
     python
@@ -30,6 +30,13 @@ running AstroDrizzle.
 The '-g' option allows the user to TURN OFF alignment of the images to an external
 astrometric catalog, such as GAIA, as accessible through the MAST interface.
 
+The '-l' option verifies the alignment of each candidate WCS solution with
+lightweight drizzle products (see VERIFY_PROFILE) instead of full ones.
+
+The '-p' option evaluates the a priori and a posteriori alignment solutions
+concurrently, in separate processes which share the '-n' cores between them,
+instead of one after the other.
+
 See the main() at the end of this module for all available options and a
 terse description.
 
@@ -89,10 +96,15 @@ import errno
 from collections import OrderedDict
 import datetime
 import fnmatch
+import multiprocessing
 try:
     from psutil import Process
 except ImportError:
     Process = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # THIRD-PARTY
 import numpy as np
@@ -104,6 +116,7 @@ from stwcs import wcsutil
 from stwcs.wcsutil import HSTWCS
 from stwcs import updatewcs
 from stwcs.wcsutil import headerlet, altwcs
+from stwcs.distortion import utils as distortion_utils
 
 from stsci.tools import fileutil, asnutil
 import tweakwcs
@@ -137,6 +150,9 @@ __taskname__ = "runastrodriz"
 # Implement WIN specific check
 RM_LOGFILES = False if sys.platform.startswith('win') else True
 
+# ioctl request (Linux) to clone the contents of a file as copy-on-write
+FICLONE = 0x40049409
+
 # Define parameters which need to be set specifically for
 #    pipeline use of astrodrizzle
 # The parameter for resetbits resets DQ values of :
@@ -150,6 +166,11 @@ PIPELINE_PARS = {'mdriztab': True,
                  'clean': False,
                  'resetbits': 4096}
 
+# Profile of the lightweight drizzle products which may be used to verify
+# the alignment of each candidate WCS solution (see `verification_pars`);
+# the final products are always created with the full pipeline parameters.
+VERIFY_PROFILE = {'block': 2, 'skip_cr': True, 'overlap': True}
+
 # Values of good_bits are set to treat these DQ bit values as 'good':
 #  - 1024: sink pixel (ACS), charge trap (WFC3/UVIS)
 #  -  256: saturated pixel (ACS), full-well saturation (WFC3)
@@ -196,9 +217,22 @@ wcs_preference = ['IDC_?????????-FIT_REL_GAIA*', 'IDC_?????????-FIT_IMG_GAIA*',
 # Primary user interface
 def process(inFile, force=False, newpath=None, num_cores=None, inmemory=True,
             headerlets=True, align_to_gaia=True, force_alignment=False,
-            do_verify_guiding=True, debug=False, make_manifest=False):
+            do_verify_guiding=True, debug=False, make_manifest=False,
+            parallel_alignment=False, verify_profile=None):
     """ Run astrodrizzle on input file/ASN table
         using default values for astrodrizzle parameters.
+
+        With ``verify_profile`` (for instance, ``VERIFY_PROFILE``), the
+        products used to verify the alignment of the candidate WCS solutions
+        are created with the parameters returned by `verification_pars`.
+
+        With ``parallel_alignment``, the a posteriori alignment is evaluated
+        in this process while the a priori one is evaluated in a worker
+        process, each with half of the ``num_cores`` budget. This is only
+        done when both would start from the same inputs (that is, when the
+        pipeline-default products did not need new cosmic-ray flags); the
+        a posteriori alignment is evaluated again, as usual, when the a
+        priori solutions get rejected.
     """
     init_time = time.time()
     trlmsg = "{}: Calibration pipeline processing of {} started.\n".format(init_time, inFile)
@@ -560,8 +594,10 @@ def process(inFile, force=False, newpath=None, num_cores=None, inmemory=True,
                                                         _trlfile,
                                                         tmpdir=None, debug=debug,
                                                         force_alignment=force_alignment,
+                                                        verify_profile=verify_profile,
                                                         find_crs=True, **adriz_pars)
 
+        aposteriori_run = None
         if align_with_apriori:
             _trlmsg = _timestamp('Starting alignment with a priori solutions')
             _trlmsg += __trlmarker__
@@ -591,19 +627,45 @@ def process(inFile, force=False, newpath=None, num_cores=None, inmemory=True,
 
                 _trlmsg += verify_gaia_wcsnames(_calfiles_flc) + '\n'
 
+            # The a posteriori alignment starts from the same inputs as the a
+            # priori one when no new CRs need to be flagged and the a priori
+            # solutions get accepted: it can then be evaluated at the same time.
+            split_cores = None
+            if parallel_alignment and align_to_gaia and not find_crs:
+                split_cores = _split_num_cores(num_cores)
+
             try:
                 tmpname = "_".join([_trlroot, 'apriori'])
                 sub_dirs.append(tmpname)
-                # Generate initial default products and perform verification
-                align_apriori, apriori_table = verify_alignment(_inlist,
-                                                 _calfiles, _calfiles_flc,
-                                                 _trlfile,
-                                                 tmpdir=tmpname, debug=debug,
-                                                 good_bits=focus_pars[inst_mode]['good_bits'],
-                                                 alignment_mode='apriori',
-                                                 force_alignment=force_alignment,
-                                                 find_crs=find_crs,
-                                                 **adriz_pars)
+                apriori_pars = dict(adriz_pars, tmpdir=tmpname, debug=debug,
+                                    good_bits=focus_pars[inst_mode]['good_bits'],
+                                    alignment_mode='apriori',
+                                    force_alignment=force_alignment,
+                                    verify_profile=verify_profile,
+                                    find_crs=find_crs)
+                if split_cores:
+                    apriori_pars['num_cores'] = split_cores[0]
+                    wait_apriori = _start_verify_alignment(
+                        _inlist, _calfiles, _calfiles_flc, _trlfile,
+                        **apriori_pars
+                    )
+                    aposteriori_run = _run_verify_alignment(
+                        _inlist, _calfiles, _calfiles_flc, _trlfile,
+                        **dict(apriori_pars, num_cores=split_cores[1],
+                               tmpdir="_".join([_trlroot, 'aposteriori']),
+                               alignment_mode='aposteriori')
+                    )
+                    apriori_products = []
+                    try:
+                        (align_apriori, apriori_table), apriori_products = wait_apriori()
+                    finally:
+                        _save_alignment_products(tmpname, apriori_products,
+                                                 _trlfile)
+                else:
+                    # Generate initial default products and perform verification
+                    align_apriori, apriori_table = verify_alignment(_inlist,
+                                                     _calfiles, _calfiles_flc,
+                                                     _trlfile, **apriori_pars)
             except Exception:
                 # Reset to state prior to applying a priori solutions
                 traceback.print_exc()
@@ -651,15 +713,30 @@ def process(inFile, force=False, newpath=None, num_cores=None, inmemory=True,
                 find_crs = False
             tmpname = "_".join([_trlroot, 'aposteriori'])
             sub_dirs.append(tmpname)
-            align_aposteriori, aposteriori_table = verify_alignment(_inlist,
-                                             _calfiles, _calfiles_flc,
-                                             _trlfile,
-                                             tmpdir=tmpname, debug=debug,
-                                             good_bits=focus_pars[inst_mode]['good_bits'],
-                                             alignment_mode='aposteriori',
-                                             force_alignment=force_alignment,
-                                             find_crs=find_crs,
-                                             **adriz_pars)
+            if aposteriori_run is not None and align_apriori and \
+                    align_apriori[0]['alignment_verified']:
+                # Use the alignment evaluated along with the a priori one
+                result, aposteriori_products, err = aposteriori_run
+                _save_alignment_products(tmpname, aposteriori_products,
+                                         _trlfile)
+                if err is not None:
+                    raise err
+                align_aposteriori, aposteriori_table = result
+            else:
+                if aposteriori_run is not None:
+                    # Its inputs were not those used for the a priori
+                    # alignment after all
+                    rmtree2(tmpname)
+                align_aposteriori, aposteriori_table = verify_alignment(_inlist,
+                                                 _calfiles, _calfiles_flc,
+                                                 _trlfile,
+                                                 tmpdir=tmpname, debug=debug,
+                                                 good_bits=focus_pars[inst_mode]['good_bits'],
+                                                 alignment_mode='aposteriori',
+                                                 force_alignment=force_alignment,
+                                                 verify_profile=verify_profile,
+                                                 find_crs=find_crs,
+                                                 **adriz_pars)
             if align_aposteriori:
                 align_dicts = align_aposteriori
                 align_qual = align_dicts[0]['alignment_quality']
@@ -879,7 +956,7 @@ def process(inFile, force=False, newpath=None, num_cores=None, inmemory=True,
 
 
 def run_driz(inlist, trlfile, calfiles, mode='default-pipeline', verify_alignment=True,
-            debug=False, good_bits=512, **pipeline_pars):
+            debug=False, good_bits=512, verify_profile=None, **pipeline_pars):
 
     import drizzlepac
     pyver = drizzlepac.astrodrizzle.__version__
@@ -898,6 +975,14 @@ def run_driz(inlist, trlfile, calfiles, mode='default-pipeline', verify_alignmen
 
         drz_products.append(drz_product)
 
+        # Products only used to verify the alignment may be lightweight ones
+        block = 1
+        driz_pars = pipeline_pars
+        if verify_alignment and verify_profile and len(calfiles) > 1:
+            driz_pars = verification_pars(calfiles, pipeline_pars,
+                                          **verify_profile)
+            block = verify_profile.get('block', 1)
+
         # Create trailer marker message for start of astrodrizzle processing
         _trlmsg = _timestamp('astrodrizzle started ')
         _trlmsg += __trlmarker__
@@ -909,7 +994,7 @@ def run_driz(inlist, trlfile, calfiles, mode='default-pipeline', verify_alignmen
 
         try:
             drizzlepac.astrodrizzle.AstroDrizzle(input=infile, configobj=None,
-                                                 **pipeline_pars)
+                                                 **driz_pars)
 
             # Edit trailer file name since 'runastrodriz' copies what astrodrizzle used
             # to another file...
@@ -943,13 +1028,16 @@ def run_driz(inlist, trlfile, calfiles, mode='default-pipeline', verify_alignmen
             if not os.path.exists(sfile):
                 # Working with data where CR is turned off by default (ACS/SBC, for example)
                 # Reset astrodrizzle parameters to generate single_sci images
-                reset_mdriztab_nocr(pipeline_pars, good_bits, pipeline_pars['skysub'])
+                reset_mdriztab_nocr(driz_pars, good_bits, driz_pars['skysub'])
 
                 drizzlepac.astrodrizzle.AstroDrizzle(input=infile, configobj=None,
-                                                     **pipeline_pars)
+                                                     **driz_pars)
 
             instr_det = "{}/{}".format(fits.getval(sfile, 'instrume'), fits.getval(sfile, 'detector'))
             focus_sigma = focus_pars[instr_det]['sigma']
+            if block > 1:
+                # in pixels of the block-averaged products
+                focus_sigma = max(focus_sigma / block, 1.0)
             print("Measuring similarity and focus for: \n{} \n    {}".format(single_files, drz_product))
             focus_dicts.append(amutils.build_focus_dict(single_files, drz_product, sigma=focus_sigma))
             if debug:
@@ -985,6 +1073,71 @@ def run_driz(inlist, trlfile, calfiles, mode='default-pipeline', verify_alignmen
     return drz_products, focus_dicts, diff_dicts
 
 
+def verification_pars(calfiles, pipeline_pars, block=2, skip_cr=True,
+                      overlap=True):
+    """ Return a copy of the astrodrizzle ``pipeline_pars`` modified to
+    create lightweight drizzle products of ``calfiles``, which are only used
+    to verify (score) the alignment of their WCS solutions.
+
+    Parameters
+    ----------
+    calfiles : list of str
+        Input exposures.
+
+    pipeline_pars : dict
+        Parameters of the full astrodrizzle run.
+
+    block : int
+        The output pixels of the separate and final drizzle products are
+        ``block`` times larger than those of the default output frame.
+
+    skip_cr : bool
+        Turn off the median, blot and driz_cr steps: the cosmic rays already
+        flagged in the DQ arrays of the inputs are still masked out.
+
+    overlap : bool
+        Restrict the output frame to the region covered by all the exposures,
+        when they overlap.
+
+    """
+    pars = dict(pipeline_pars, mdriztab=False, driz_separate=True,
+                driz_combine=True)
+    if skip_cr:
+        pars.update(median=False, blot=False, driz_cr=False)
+
+    # Default output frame, as computed by astrodrizzle
+    exposures = [[HSTWCS(f, ext=('SCI', i))
+                  for i in range(1, fileutil.countExtn(f) + 1)]
+                 for f in calfiles]
+    outwcs = distortion_utils.output_wcs(sum(exposures, []), undistort=True)
+    # (any custom WCS from the pipeline parameters gets overridden)
+    wcs_pars = {'refimage': '', 'rot': None, 'scale': outwcs.pscale * block,
+                'outnx': None, 'outny': None, 'ra': None, 'dec': None,
+                'crpix1': None, 'crpix2': None}
+
+    if overlap:
+        # Intersection of the bounding boxes of the exposures in the frame
+        lower = np.array([-np.inf, -np.inf])
+        upper = np.array([np.inf, np.inf])
+        for chips in exposures:
+            corners = np.vstack([c.calc_footprint() for c in chips])
+            xy = outwcs.wcs_world2pix(corners, 0)
+            lower = np.maximum(lower, xy.min(axis=0))
+            upper = np.minimum(upper, xy.max(axis=0))
+        size = np.ceil((upper - lower) / block)
+        # Skip tiny (or no) overlaps, for instance in mosaics
+        if np.all(size >= 64):
+            ra, dec = outwcs.wcs_pix2world([(lower + upper) / 2.0], 0)[0]
+            wcs_pars.update(ra=float(ra), dec=float(dec), outnx=int(size[0]),
+                            outny=int(size[1]))
+
+    for prefix in ['driz_sep_', 'final_']:
+        pars[prefix + 'wcs'] = True
+        for key, value in wcs_pars.items():
+            pars[prefix + key] = value
+    return pars
+
+
 def reset_mdriztab_nocr(pipeline_pars, good_bits, skysub):
     # Need to turn off MDRIZTAB if any other parameters are to be set
     pipeline_pars['mdriztab'] = False
@@ -1004,8 +1157,21 @@ def reset_mdriztab_nocr(pipeline_pars, good_bits, skysub):
 def verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
                      find_crs=True, tmpdir=None, debug=False, good_bits=512,
                      alignment_mode=None, force_alignment=False,
-                     **pipeline_pars):
-
+                     products=None, verify_profile=None, **pipeline_pars):
+    """ Create the drizzle products of ``inlist`` with the current (or, for
+    ``alignment_mode='aposteriori'``, a newly fit) WCS solutions, in
+    directory ``tmpdir``, and verify their alignment.
+
+    When ``products`` is a list, the names of the files which would be
+    copied back to the parent directory, if the alignment is verified, are
+    appended to it instead, and the trailer file written in ``tmpdir`` is not
+    appended to the one of the parent directory: this is left to the caller
+    (see `_save_alignment_products`).
+
+    The products used to verify the alignment are created with the
+    parameters returned by `verification_pars` for the ``verify_profile``
+    arguments, when given.
+    """
     headerlet_files = []
     for infile in inlist:
         asndict, ivmlist, drz_product = processInput.process_input(infile, updatewcs=False,
@@ -1041,9 +1207,9 @@ def verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
                 os.makedirs(tmpdir)
 
             # Now, copy all necessary files to tmpdir
-            _ = [shutil.copy(f, tmpdir) for f in inlist + calfiles]
+            _ = [_clone_file(f, tmpdir) for f in inlist + calfiles]
             if calfiles_flc:
-                _ = [shutil.copy(f, tmpdir) for f in calfiles_flc]
+                _ = [_clone_file(f, tmpdir) for f in calfiles_flc]
 
             parent_dir = os.getcwd()
             os.chdir(tmpdir)
@@ -1171,6 +1337,7 @@ def verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
         drz_products, focus_dicts, diff_dicts = run_driz(inlist, trlfile, calfiles,
                                                          mode=tmpmode, verify_alignment=True,
                                                          debug=debug, good_bits=good_bits,
+                                                         verify_profile=verify_profile,
                                                          **pipeline_pars)
 
         # Start verification of alignment using focus and similarity indices
@@ -1181,6 +1348,8 @@ def verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
             align_focus = focus_dicts[-1] if 'drc' in focus_dicts[-1]['prodname'] else focus_dicts[0]
 
             pscale = HSTWCS(alignfiles[0], ext=1).pscale
+            if verify_profile:
+                pscale *= verify_profile.get('block', 1)
 
             det_pars = align.get_default_pars(inst, det)['generate_source_catalogs']
             default_fwhm = det_pars['fwhmpsf'] / pscale
@@ -1251,24 +1420,115 @@ def verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
         # If CRs were identified, copy updated input files to main directory
         if tmpdir and alignment_verified:
             _trlmsg += "Saving products with new alignment.\n"
-            _ = [shutil.copy(f, parent_dir) for f in calfiles]
-            if calfiles_flc:
-                _ = [shutil.copy(f, parent_dir) for f in calfiles_flc]
+            saved_files = calfiles + (calfiles_flc or [])
             # Copy drizzle products to parent directory to replace 'less aligned' versions
-            _ = [shutil.copy(f, parent_dir) for f in headerlet_files]
+            saved_files += headerlet_files
+            if products is None:
+                _ = [shutil.copy(f, parent_dir) for f in saved_files]
+            else:
+                products.extend(saved_files)
 
         _trlmsg += _timestamp('Verification of alignment completed ')
         _updateTrlFile(trlfile, _trlmsg)
 
     finally:
         if tmpdir:
-            _appendTrlFile(os.path.join(parent_dir, trlfile), trlfile)
+            if products is None:
+                _appendTrlFile(os.path.join(parent_dir, trlfile), trlfile)
             # Return to main processing dir
             os.chdir(parent_dir)
 
     return focus_dicts, full_table
 
 
+def _run_verify_alignment(*args, **kwargs):
+    """ Run `verify_alignment`, leaving the saving of its products to the
+    caller. Returns its results (`None` if it failed), the list of products
+    to be saved and the exception raised, if any. """
+    products = []
+    try:
+        return verify_alignment(*args, products=products, **kwargs), products, None
+    except Exception as err:
+        traceback.print_exc()
+        return None, products, err
+
+
+def _verify_alignment_process(conn, args, kwargs):
+    result, products, err = _run_verify_alignment(*args, **kwargs)
+    # Exceptions may not be picklable: only their description is sent
+    conn.send((result, products, None if err is None else repr(err)))
+    conn.close()
+
+
+def _start_verify_alignment(*args, **kwargs):
+    """ Start `verify_alignment` in a new process, leaving the saving of its
+    products to the caller, and return a function which waits for it to
+    finish and returns its results and the list of products to be saved.
+
+    ``tmpdir`` must be set, as the process changes its working directory.
+    """
+    mp_ctx = multiprocessing.get_context('fork')
+    recv_conn, send_conn = mp_ctx.Pipe(duplex=False)
+    p = mp_ctx.Process(target=_verify_alignment_process,
+                       name='runastrodriz.verify_alignment()',
+                       args=(send_conn, args, kwargs))
+    p.start()
+    send_conn.close()
+
+    def wait():
+        try:
+            result, products, err = recv_conn.recv()
+        except EOFError:
+            result, products, err = None, [], 'no result returned'
+        finally:
+            recv_conn.close()
+            p.join()
+        if err is not None:
+            raise RuntimeError("Problem during: {:s}, exitcode: {}: {:s}"
+                               .format(p.name, p.exitcode, err))
+        return result, products
+
+    return wait
+
+
+def _save_alignment_products(tmpdir, products, trlfile):
+    """ Copy the ``products`` of an alignment verified in ``tmpdir`` (see
+    `verify_alignment`) to the current directory and append the trailer file
+    written in ``tmpdir`` to ``trlfile``. """
+    _ = [shutil.copy(os.path.join(tmpdir, f), f) for f in products]
+    _appendTrlFile(trlfile, os.path.join(tmpdir, trlfile))
+
+
+def _split_num_cores(num_cores, nruns=2):
+    """ Return the number of cores for each of ``nruns`` concurrent runs of
+    astrodrizzle sharing a budget of ``num_cores``, or `None` if there are
+    not enough of them. """
+    total = util.get_pool_size(num_cores, None)
+    if total < nruns:
+        return None
+    return [total // nruns + (k < total % nruns) for k in range(nruns)]
+
+
+def _clone_file(filename, dirname):
+    """ Copy ``filename`` into directory ``dirname``, as a copy-on-write
+    clone of its contents (reflink) when the file system supports it, and
+    return the name of the new file.
+
+    Unlike hard links, clones can be updated independently of the original
+    file, as done by the processing of the inputs in each alignment mode.
+    """
+    newname = os.path.join(dirname, os.path.basename(filename))
+    if fcntl is not None:
+        try:
+            with open(filename, 'rb') as src, open(newname, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copymode(filename, newname)
+            return newname
+        except OSError:
+            pass
+    return shutil.copy(filename, newname)
+
+
 def apply_headerlet(filename, headerlet_file, flcfile=None):
 
     # Use headerlet module to apply headerlet as PRIMARY WCS
@@ -2112,7 +2372,7 @@ def main():
     import getopt
 
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], 'bdahfgimn:v:')
+        optlist, args = getopt.getopt(sys.argv[1:], 'bdahfgilmpn:v:')
     except getopt.error as e:
         print(str(e))
         print(__doc__)
@@ -2130,6 +2390,8 @@ def main():
     force_alignment = False
     do_verify_guiding = False
     make_manifest = False
+    parallel_alignment = False
+    verify_profile = None
 
     # read options
     for opt, value in optlist:
@@ -2150,6 +2412,10 @@ def main():
             make_manifest = True
         if opt == "-v":
             do_verify_guiding = True
+        if opt == "-p":
+            parallel_alignment = True
+        if opt == "-l":
+            verify_profile = VERIFY_PROFILE
         if opt == '-n':
             if not value.isdigit():
                 print('ERROR: num_cores value must be an integer!')
@@ -2159,7 +2425,7 @@ def main():
             # turn off writing headerlets
             headerlets = False
     if len(args) < 1:
-        print("syntax: runastrodriz.py [-bdahfginv] inputFilename [newpath]")
+        print("syntax: runastrodriz.py [-bdahfgilnpv] inputFilename [newpath]")
         sys.exit()
     if len(args) > 1:
         newdir = args[-1]
@@ -2172,7 +2438,9 @@ def main():
                     inmemory=inmemory, headerlets=headerlets,
                     align_to_gaia=align_to_gaia, force_alignment=force_alignment,
                     do_verify_guiding=do_verify_guiding, debug=debug,
-                    make_manifest=make_manifest)
+                    make_manifest=make_manifest,
+                    parallel_alignment=parallel_alignment,
+                    verify_profile=verify_profile)
 
         except Exception as errorobj:
             print(str(errorobj))
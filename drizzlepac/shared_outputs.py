@@ -0,0 +1,153 @@
+"""
+In-memory intermediate products kept in named shared memory.
+
+When AstroDrizzle runs with ``in_memory=True``, the intermediate products
+(single drizzle images, weights and contexts, masks, ...) are kept as
+`~astropy.io.fits.HDUList` objects in ``imageObject.virtualOutputs``. The
+separate drizzle step creates them in worker processes, from which they used
+to be sent back by pickling the whole arrays through a
+`multiprocessing.Manager` dictionary.
+
+Here, the data arrays of these products are instead allocated in named
+blocks of shared memory (`multiprocessing.shared_memory`). A
+`SharedHDUList` only holds the headers of a product and the names, offsets,
+shapes and types of the blocks holding its arrays, so that it can be sent to
+another process at the cost of pickling the headers alone. The receiving
+process rebuilds the same `~astropy.io.fits.HDUList`, with data arrays that
+are views of the shared blocks, without copying them.
+
+Blocks can be unlinked as soon as all the processes using them have mapped
+them: their memory then gets released along with the last array using it.
+
+:License: :doc:`LICENSE`
+
+"""
+import ctypes
+from multiprocessing import shared_memory
+
+import numpy as np
+from astropy.io import fits
+
+__all__ = ['SharedHDUList', 'shared_zeros', 'unlink']
+
+
+class _SharedBuffer:
+    """ Named block of shared memory exposed through the numpy array
+    interface. Arrays created from it keep it (and the mapping of the block)
+    alive for as long as they exist. """
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        # The address is taken without keeping an export of the memoryview
+        # so that the block can be closed when the last array goes away.
+        buf = ctypes.c_char.from_buffer(shm.buf)
+        self.address = ctypes.addressof(buf)
+        del buf
+        self.__array_interface__ = {
+            'shape': tuple(shape),
+            'typestr': np.dtype(dtype).str,
+            'data': (self.address, False),
+            'version': 3,
+        }
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _array(shape, dtype, name=None):
+    dtype = np.dtype(dtype)
+    nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    return np.asarray(_SharedBuffer(shm, shape, dtype))
+
+
+def _buffer(arr):
+    """ Return the `_SharedBuffer` holding the data of ``arr``, if any. """
+    base = arr
+    while base is not None and not isinstance(base, _SharedBuffer):
+        base = getattr(base, 'base', None)
+    return base
+
+
+def shared_zeros(shape, dtype):
+    """ Return a zero-initialized array allocated in a new named block of
+    shared memory. """
+    return _array(shape, dtype)
+
+
+def unlink(arr):
+    """ Unlink the block of shared memory holding the data of ``arr``, which
+    remains usable until it gets deleted. """
+    buf = _buffer(arr)
+    if buf is not None:
+        buf.unlink()
+
+
+class SharedHDUList:
+    """ Picklable description of an `~astropy.io.fits.HDUList` (or of a
+    single HDU) whose data arrays are held in named shared memory.
+
+    Parameters
+    ----------
+    hdulist : `~astropy.io.fits.HDUList`, HDU
+        Product to share. Data arrays of image HDUs which are not already
+        held in shared memory (see `shared_zeros`) get copied into new
+        blocks. Other HDUs (tables) are kept as they are and get pickled
+        along with the headers.
+
+    """
+    def __init__(self, hdulist):
+        self.single_hdu = not isinstance(hdulist, fits.HDUList)
+        if self.single_hdu:
+            hdulist = [hdulist]
+
+        self.hdus = []
+        for hdu in hdulist:
+            data = hdu.data
+            if not isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU,
+                                    fits.CompImageHDU)) or data is None:
+                self.hdus.append({'hdu': hdu})
+                continue
+
+            buf = _buffer(data)
+            if buf is None or not data.flags.c_contiguous:
+                arr = _array(data.shape, data.dtype)
+                arr[...] = data
+                data, buf = arr, _buffer(arr)
+
+            self.hdus.append({
+                'cls': type(hdu),
+                'header': hdu.header,
+                'name': buf.shm.name,
+                'offset': data.ctypes.data - buf.address,
+                'shape': data.shape,
+                'dtype': data.dtype.str,
+            })
+
+    def to_hdulist(self, unlink=False):
+        """ Return the `~astropy.io.fits.HDUList` (or HDU) described by this
+        object, with data arrays mapped from shared memory. With ``unlink``,
+        the blocks of shared memory get unlinked once mapped, so that they
+        are released along with the returned arrays. """
+        hdus = []
+        for h in self.hdus:
+            if 'hdu' in h:
+                hdus.append(h['hdu'])
+                continue
+
+            dtype = np.dtype(h['dtype'])
+            nbytes = int(np.prod(h['shape'])) * dtype.itemsize
+            block = _array((h['offset'] + nbytes,), np.uint8, name=h['name'])
+            if unlink:
+                _buffer(block).unlink()
+            data = block[h['offset']:].view(dtype).reshape(h['shape'])
+            hdus.append(h['cls'](data=data, header=h['header']))
+
+        if self.single_hdu:
+            return hdus[0]
+        return fits.HDUList(hdus)
@@ -15,14 +15,16 @@ import numpy as np
 
 from stsci.tools import fileutil, teal, logutil
 from stsci.tools.bitmask import interpret_bit_flags
-import stsci.imagestats as imagestats
 
+from stsci.skypac import __version__ as skypac_version
 from stsci.skypac.skymatch import skymatch
 from stsci.skypac.utils import MultiFileLog, ResourceRefCount, ext2str, \
      file_name_components, in_memory_mask, temp_mask_file, openImageEx
 from stsci.skypac.parseat import FileExtMaskInfo, parse_at_file
 
 from . import processInput
+from . import skycache
+from .chipstats import sampled_stats
 from .imageObject import imageObject
 
 from . import util
@@ -35,6 +37,10 @@ _step_num_ = 2  #this relates directly to the syntax in the cfg file
 
 log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
 
+# parameters that change the sky values saved in a 'sky_cache' file
+_SKY_CACHE_PARS = ['skymethod', 'skystat', 'skylower', 'skyupper', 'skyclip',
+                   'skylsigma', 'skyusigma', 'skywidth', 'skysub']
+
 
 #this is the user access function
 def sky(input=None,outExt=None,configObj=None, group=None, editpars=False, **inputDict):
@@ -78,6 +84,7 @@ def sky(input=None,outExt=None,configObj=None, group=None, editpars=False, **inp
     skyfile     'Name of file with user-computed sky values'
     skyuser     'KEYWORD indicating a sky subtraction value if done by user'
     in_memory   'Optimize for speed or for memory use'
+    sky_cache   'File caching sky values across runs (blank = no cache)'
 
     ==========  ===================================================================
 
@@ -194,18 +201,23 @@ def subtractSky(imageObjList,configObj,saveFile=False,procSteps=None):
         else:
             clean = True
 
-        _skymatch(imageObjList, paramDict, inmemory, clean, log)
+        _skymatch(imageObjList, paramDict, inmemory, clean, log,
+                  num_cores=configObj.get('num_cores'))
 
     if procSteps is not None:
         procSteps.endStep('Subtract Sky')
 
 
-def _skymatch(imageList, paramDict, in_memory, clean, logfile):
+def _skymatch(imageList, paramDict, in_memory, clean, logfile,
+              num_cores=None):
     # '_skymatch' converts input imageList and other parameters to
     # data structures accepted by the "skymatch" package.
     # It also creates a temporary mask by combining 'static' mask,
     # DQ image, and user-supplied mask. The combined mask is then
     # passed to 'skymatch' to be used for excluding "bad" pixels.
+    # When a 'sky_cache' file is given, the sky values computed by an
+    # earlier run on the same chips, masks and parameters are reused
+    # instead of running 'skymatch'.
 
     #header keyword that contains the sky that's been subtracted
     skyKW = "MDRIZSKY"
@@ -256,7 +268,10 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
     # reason is that we want to combine user supplied masks with DQ+static
     # masks provided by astrodrizzle.
     new_fi = []
+    mask_digests = []
     sky_bits = interpret_bit_flags(paramDict['sky_bits'])
+    cache_file = paramDict.get('sky_cache', '')
+    use_cache = not util.is_blank(cache_file)
     for i in range(nimg):
         # extract extension information:
         extname = imageList[i].scienceExt
@@ -308,6 +323,11 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
 
             masklist.append(mask)
             mextlist.append(mext)
+            if use_cache:
+                mask_digests.append(
+                    None if mask is None else
+                    skycache.array_digest(mask.hdu[mext].data)
+                )
 
         # replace the original user-supplied masks with the
         # newly computed combined static+DQ+user masks:
@@ -327,6 +347,59 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
 
         new_fi.append(fi)
 
+    if use_cache:
+        chips = [(new_fi[i].image.hdu.filename(), ext)
+                 for i in range(nimg) for ext in new_fi[i].fext]
+        cache, cache_key, chip_keys, cached_sky = _lookupSkyCache(
+            cache_file.strip(), paramDict, chips, mask_digests, num_cores
+        )
+    else:
+        cached_sky = None
+
+    if cached_sky is not None:
+        k = 0
+        for fi in new_fi:
+            for ext in fi.fext:
+                fi.image.hdu[ext].header[skyKW] = (
+                    cached_sky[k], 'Sky value computed by AstroDrizzle'
+                )
+                k += 1
+    else:
+        _runSkymatch(new_fi, paramDict, skyKW, in_memory, clean)
+        if use_cache:
+            skyvals = [fi.image.hdu[ext].header.get(skyKW, 0.)
+                   for fi in new_fi for ext in fi.fext]
+            names = ['{:s}[{:s}]'.format(os.path.basename(fname),
+                                         ext2str(ext))
+                     for fname, ext in chips]
+            try:
+                cache.put(cache_key, chip_keys, skyvals, names)
+            except OSError as e:
+                log.warning("Unable to write sky cache file '{:s}': {}"
+                            .format(cache.filename, e))
+
+    # Populate 'subtractedSky' and 'computedSky' of input image objects:
+    for i in range(nimg):
+        assert(not new_fi[i].fnamesOnly and not new_fi[i].image.closed)
+        image = imageList[i]
+        skysubimage = new_fi[i].image.hdu
+        numchips = image._numchips
+        extname = image.scienceExt
+        assert(os.path.samefile(image._filename, skysubimage.filename()))
+
+        for extver in range(1, numchips + 1, 1):
+            chip = image[extname, extver]
+            if not chip.group_member:
+                continue
+            subtracted_sky = skysubimage[extname, extver].header.get(skyKW, 0.)
+            chip.subtractedSky = subtracted_sky
+            chip.computedSky = subtracted_sky
+
+    # clean-up:
+    for fi in new_fi:
+        fi.release_all_images()
+
+def _runSkymatch(new_fi, paramDict, skyKW, in_memory, clean):
     try:
         # Run skymatch algorithm:
         skymatch(new_fi,
@@ -376,26 +449,38 @@ def _skymatch(imageList, paramDict, in_memory, clean, logfile):
         else:
             raise
 
-    # Populate 'subtractedSky' and 'computedSky' of input image objects:
-    for i in range(nimg):
-        assert(not new_fi[i].fnamesOnly and not new_fi[i].image.closed)
-        image = imageList[i]
-        skysubimage = new_fi[i].image.hdu
-        numchips = image._numchips
-        extname = image.scienceExt
-        assert(os.path.samefile(image._filename, skysubimage.filename()))
 
-        for extver in range(1, numchips + 1, 1):
-            chip = image[extname, extver]
-            if not chip.group_member:
-                continue
-            subtracted_sky = skysubimage[extname, extver].header.get(skyKW, 0.)
-            chip.subtractedSky = subtracted_sky
-            chip.computedSky = subtracted_sky
+def _lookupSkyCache(cache_file, paramDict, chips, mask_digests, num_cores):
+    # Compute the keys of all the chips to be matched and look up the sky
+    # values saved for them by an earlier run.
+    pars = {k: paramDict[k] for k in _SKY_CACHE_PARS}
+    pars['skypac'] = skypac_version
+    pars['units_kwd'] = 'BUNIT'
+
+    chip_keys = skycache.chip_keys(
+        [(fname, ext, mdigest)
+         for (fname, ext), mdigest in zip(chips, mask_digests)],
+        num_cores=num_cores
+    )
+    cache = skycache.SkyMatchCache(cache_file)
+    cache_key = cache.key(pars, chip_keys)
+    cached_sky = cache.get(cache_key)
+
+    if cached_sky is not None:
+        log.info("Using the sky values of {:d} chips saved in '{:s}'"
+                 .format(len(chips), cache_file))
+    else:
+        nchanged = cache.changed_chips(chip_keys)
+        if nchanged is None or nchanged == 0:
+            log.info("No sky values saved in '{:s}' for these images and "
+                     "parameters".format(cache_file))
+        else:
+            log.info("No sky values saved in '{:s}': {:d} of {:d} chips "
+                     "changed since an earlier run"
+                     .format(cache_file, nchanged, len(chips)))
+
+    return cache, cache_key, chip_keys, cached_sky
 
-    # clean-up:
-    for fi in new_fi:
-        fi.release_all_images()
 
 def _buildStaticDQUserMask(img, ext, sky_bits, use_static, umask,
                            umaskext, in_memory):
@@ -731,9 +816,12 @@ def _computeSky(image, skypars, memmap=False):
 
     skypars is passed in as paramDict
 
+    The statistics are computed by the same engine as those of the static
+    mask step (`~drizzlepac.chipstats.sampled_stats`), from all the pixels.
+
     """
     #this object contains the returned values from the image stats routine
-    _tmp = imagestats.ImageStats(image.data,
+    _tmp = sampled_stats(image.data,
             fields      = skypars['skystat'],
             lower       = skypars['skylower'],
             upper       = skypars['skyupper'],
@@ -744,8 +832,8 @@ def _computeSky(image, skypars, memmap=False):
             )
 
     _skyValue = _extractSkyValue(_tmp,skypars['skystat'].lower())
-    log.info("    Computed sky value/pixel for %s: %s "%
-             (image.rootname, _skyValue))
+    log.info("    Computed sky value/pixel for %s: %s (%s)"%
+             (image.rootname, _skyValue, _tmp))
 
     del _tmp
 
@@ -0,0 +1,228 @@
+"""
+Cache of the sky values computed by ``skymatch`` for the input images of
+AstroDrizzle, so that reruns on the same images (for example with different
+drizzle parameters) do not have to match the sky again.
+
+The cache is a JSON file holding a few entries. An entry is keyed by the sky
+parameters and by the keys of all the chips that were matched together, in
+order. The key of a chip combines digests of its science header (which holds
+its WCS), of its science data and of the combined static, DQ and user mask
+used to select the sky pixels. Any change to any of them, or to the set of
+images, gives a new entry, so that stale sky values are never reused.
+
+:License: :doc:`LICENSE`
+
+"""
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+from stsci.tools import logutil
+
+from . import util
+
+__all__ = ['SkyMatchCache', 'array_digest', 'header_digest', 'chip_key',
+           'chip_keys']
+
+# largest number of entries kept in a cache file
+MAX_ENTRIES = 32
+
+# version of the layout of the cache file
+_CACHE_VERSION = 1
+
+# header keywords that do not change the sky computed for a chip
+_IGNORED_KEYWORDS = ('', 'COMMENT', 'HISTORY', 'MDRIZSKY')
+
+log = logutil.create_logger(__name__, level=logutil.logging.NOTSET)
+
+
+def _digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def array_digest(data):
+    """ Return a digest of the type, shape and values of an array. """
+    if data is None:
+        return None
+    h = _digest()
+    h.update('{:s} {}'.format(data.dtype.str, data.shape).encode())
+    h.update(np.ascontiguousarray(data).data)
+    return h.hexdigest()
+
+
+def header_digest(header):
+    """ Return a digest of the cards of a header, leaving out comments,
+    history and the sky keyword. """
+    h = _digest()
+    for card in header.cards:
+        if card.keyword not in _IGNORED_KEYWORDS:
+            h.update(card.image.encode())
+    return h.hexdigest()
+
+
+def chip_key(filename, ext, mask_digest=None):
+    """
+    Compute the key of a chip from the digests of its header, its data and
+    the mask of its sky pixels.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the FITS file with the chip.
+
+    ext : tuple, int
+        Extension of the chip in the file.
+
+    mask_digest : str, None
+        Digest of the mask used for the sky computations (see
+        `array_digest`).
+
+    Returns
+    -------
+    dict
+        The ``'header'``, ``'data'`` and ``'mask'`` digests.
+
+    """
+    with fits.open(filename, memmap=True,
+                   do_not_scale_image_data=True) as hdulist:
+        hdu = hdulist[ext]
+        return {'header': header_digest(hdu.header),
+                'data': array_digest(hdu.data),
+                'mask': mask_digest}
+
+
+def chip_keys(chips, num_cores=None):
+    """
+    Compute the keys of several chips, in threads when more than one core
+    is available.
+
+    Parameters
+    ----------
+    chips : list of tuple
+        ``(filename, ext, mask_digest)`` arguments of `chip_key`.
+
+    num_cores : int, None
+        Largest number of threads to use (see
+        `~drizzlepac.util.get_pool_size`).
+
+    Returns
+    -------
+    list of dict
+
+    """
+    tasks = [functools.partial(chip_key, *chip) for chip in chips]
+    pool_size = util.get_pool_size(num_cores, len(tasks))
+    if pool_size > 1:
+        # reading and hashing the data release the GIL
+        return util.launch_threads_and_wait(tasks, pool_size)
+    return [task() for task in tasks]
+
+
+class SkyMatchCache:
+    """
+    Sky values computed by ``skymatch``, stored in a JSON file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the cache file. It is created when the first entry gets
+        saved. A file that cannot be read is treated as an empty cache.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable sky cache file '{:s}': {}"
+                        .format(self.filename, e))
+            return {}
+        if not isinstance(cache, dict) or \
+           cache.get('version') != _CACHE_VERSION:
+            log.warning("Ignoring sky cache file '{:s}' written by another "
+                        "version of AstroDrizzle".format(self.filename))
+            return {}
+        return cache.get('entries', {})
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(pars, chips):
+        """ Return the key of the entry for the sky parameters ``pars`` (a
+        dictionary) and the list of chip keys ``chips``. """
+        h = _digest()
+        h.update(json.dumps([pars, chips], sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """ Return the list of sky values saved under ``key``, or `None`. """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry['sky']
+
+    def changed_chips(self, chips):
+        """ Return the smallest number of the given chips whose key differs
+        from that of the chip at the same position in any entry with the same
+        number of chips, or `None` when there is no such entry. """
+        changed = [
+            sum(c != e for c, e in zip(chips, entry['chips']))
+            for entry in self._entries.values()
+            if len(entry['chips']) == len(chips)
+        ]
+        return min(changed) if changed else None
+
+    def put(self, key, chips, sky, names=None):
+        """
+        Save sky values and write the cache file.
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry (see `key`).
+
+        chips : list of dict
+            Keys of the chips.
+
+        sky : list of float
+            Sky value of each chip.
+
+        names : list of str, None
+            Names of the chips, for the record only.
+
+        """
+        self._entries[key] = {'time': time.time(), 'chips': chips,
+                              'sky': [float(s) for s in sky],
+                              'names': names}
+        if len(self._entries) > MAX_ENTRIES:
+            oldest = sorted(self._entries,
+                            key=lambda k: self._entries[k]['time'])
+            for k in oldest[:len(self._entries) - MAX_ENTRIES]:
+                del self._entries[k]
+        self._write()
+
+    def _write(self):
+        # write a new file and rename it, so that concurrent runs never read
+        # a partially written cache
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': _CACHE_VERSION,
+                           'entries': self._entries}, f, indent=1)
+            os.replace(tmpname, self.filename)
+        except BaseException:
+            os.remove(tmpname)
+            raise
@@ -9,16 +9,18 @@ For ``staticMask``, the user interface function is :py:func:`createMask`.
 :License: :doc:`LICENSE`
 
 """
+import functools
 import os
 import sys
+import threading
 
 import numpy as np
 from stsci.tools import fileutil, teal, logutil
 import astropy
 from astropy.io import fits
-from stsci.imagestats import ImageStats
 from . import util
 from . import processInput
+from .chipstats import sampled_stats
 
 __taskname__ = "staticMask"
 _step_num_ = 1
@@ -86,8 +88,9 @@ def createStaticMask(imageObjectList=[],configObj=None,procSteps=None):
     #create a static mask object
     myMask = staticMask(configObj)
 
-    for image in imageObjectList:
-        myMask.addMember(image) # create tmp filename here...
+    worker_times = util.WorkerTimes()
+    myMask.addMembers(imageObjectList, num_cores=configObj.get('num_cores'),
+                      worker_times=worker_times)
 
 
     #save the masks to disk for later access
@@ -95,6 +98,7 @@ def createStaticMask(imageObjectList=[],configObj=None,procSteps=None):
     myMask.close()
 
     if procSteps is not None:
+        procSteps.addWorkerTimes('Static Mask', worker_times)
         procSteps.endStep('Static Mask')
 
 def constructFilename(signature):
@@ -134,11 +138,15 @@ class staticMask:
 
         self.masklist={}
         self.masknames = {}
+        self._locks = {}
         self.step_name=util.getSectionName(configObj,_step_num_)
         if configObj is not None:
             self.static_sig = configObj[self.step_name]['static_sig']
+            self.static_tolerance = configObj[self.step_name].get(
+                'static_tolerance')
         else:
             self.static_sig = 4. # define a reasonable number
+            self.static_tolerance = None
             log.warning('Using default of 4. for static mask sigma.')
 
     def addMember(self, imagePtr=None):
@@ -160,48 +168,97 @@ class staticMask:
         The signature is defined in the image object for each chip
 
         """
-        numchips=imagePtr._numchips
-        log.info("Computing static mask:\n")
-
-        chips = imagePtr.group
-        if chips is None:
-            chips = imagePtr.getExtensions()
-
-        #for chip in range(1,numchips+1,1):
-        for chip in chips:
-            chipid=imagePtr.scienceExt + ','+ str(chip)
-            chipimage=imagePtr.getData(chipid)
-            signature=imagePtr[chipid].signature
-
-            # If this is a new signature, create a new Static Mask file which is empty
-            # only create a new mask if one doesn't already exist
-            if ((signature not in self.masklist) or (len(self.masklist) == 0)):
-                self.masklist[signature] = self._buildMaskArray(signature)
-                maskname =  constructFilename(signature)
-                self.masknames[signature] = maskname
-            else:
-                chip_sig = buildSignatureKey(signature)
-                for s in self.masknames:
-                    if chip_sig in self.masknames[s]:
-                        maskname  = self.masknames[s]
-                        break
-            imagePtr[chipid].outputNames['staticMask'] = maskname
-
-            stats = ImageStats(chipimage,nclip=3,fields='mode')
-            mode = stats.mode
-            rms  = stats.stddev
-            nbins = len(stats.histogram)
-            del stats
+        self.addMembers([imagePtr], num_cores=1)
 
-            log.info('  mode = %9f;   rms = %7f;   static_sig = %0.2f' %
-                     (mode, rms, self.static_sig))
+    def addMembers(self, imageObjectList, num_cores=None, worker_times=None):
+        """
+        Combines all the chips of the input images with the static masks
+        that have the same signature, processing up to ``num_cores`` chips
+        at a time in separate threads.
+
+        Reading the chips and comparing them with their threshold release
+        the GIL, while the statistics of each chip, which do not, can be
+        computed from a subsample of its pixels (see ``static_tolerance``).
+        The masks do not depend on the order in which the chips get
+        combined. When given a `~drizzlepac.util.WorkerTimes` object,
+        ``worker_times`` receives the number of threads that were used and
+        the times spent on each chip.
+
+        """
+        if worker_times is None:
+            worker_times = util.WorkerTimes()
+
+        chips = []
+        for imagePtr in imageObjectList:
+            chipids = imagePtr.group
+            if chipids is None:
+                chipids = imagePtr.getExtensions()
+            for chip in chipids:
+                chipid = imagePtr.scienceExt + ',' + str(chip)
+                self._registerChip(imagePtr, chipid)
+                chips.append((imagePtr, chipid))
+
+        tasks = [functools.partial(
+                     worker_times.wrap('%s[%s]' % (imagePtr._filename, chipid),
+                                       self._combineChip),
+                     imagePtr, chipid)
+                 for imagePtr, chipid in chips]
+        pool_size = util.get_pool_size(num_cores, len(tasks))
+        if pool_size > 1:
+            worker_times.workers = pool_size
+            worker_times.backend = 'thread'
+            log.info('Computing static masks with %d parallel workers' %
+                     pool_size)
+            chip_stats = util.launch_threads_and_wait(tasks, pool_size)
+        else:
+            chip_stats = [task() for task in tasks]
 
-            if nbins >= 2: # only combine data from new image if enough data to mask
-                sky_rms_diff = mode - (self.static_sig*rms)
-                np.bitwise_and(self.masklist[signature],
-                               np.logical_not(np.less(chipimage, sky_rms_diff)),
+        for (imagePtr, chipid), stats in zip(chips, chip_stats):
+            log.info("Computing static mask for %s[%s]:" %
+                     (imagePtr._filename, chipid))
+            log.info('  mode = %9f;   rms = %7f;   static_sig = %0.2f' %
+                     (stats.mode, stats.stddev, self.static_sig))
+            log.info('  statistics computed %s' % stats)
+
+    def _registerChip(self, imagePtr, chipid):
+        """ Creates the static mask for the signature of a chip if it does
+        not exist yet and records its name in the chip's output names. """
+        signature=imagePtr[chipid].signature
+
+        # If this is a new signature, create a new Static Mask file which is empty
+        # only create a new mask if one doesn't already exist
+        if ((signature not in self.masklist) or (len(self.masklist) == 0)):
+            self.masklist[signature] = self._buildMaskArray(signature)
+            self._locks[signature] = threading.Lock()
+            maskname =  constructFilename(signature)
+            self.masknames[signature] = maskname
+        else:
+            chip_sig = buildSignatureKey(signature)
+            for s in self.masknames:
+                if chip_sig in self.masknames[s]:
+                    maskname  = self.masknames[s]
+                    break
+        imagePtr[chipid].outputNames['staticMask'] = maskname
+
+    def _combineChip(self, imagePtr, chipid):
+        """ Masks the pixels of a chip that are more than ``static_sig``
+        times the rms below the mode in the static mask of its signature.
+        Returns the statistics of the chip. """
+        chipimage=imagePtr.getData(chipid)
+        signature=imagePtr[chipid].signature
+
+        stats = sampled_stats(chipimage, nclip=3, fields='mode',
+                              tolerance=self.static_tolerance)
+        nbins = len(stats.histogram)
+
+        if nbins >= 2: # only combine data from new image if enough data to mask
+            sky_rms_diff = stats.mode - (self.static_sig*stats.stddev)
+            keep = np.logical_not(np.less(chipimage, sky_rms_diff))
+            with self._locks[signature]:
+                np.bitwise_and(self.masklist[signature], keep,
                                self.masklist[signature])
-            del chipimage
+        del chipimage
+        return stats
 
     def _buildMaskArray(self,signature):
         """ Creates empty  numpy array for static mask array signature. """
@@ -10,6 +10,7 @@ data.
 from stsci.tools import fileutil
 import numpy as np
 from .imageObject import imageObject
+from . import refcache
 
 
 class STISInputImage (imageObject):
@@ -41,9 +42,7 @@ class STISInputImage (imageObject):
 
         # Try to open the file in the location specified by LFLTFILE.
         try:
-            handle = fileutil.openImage(lflatfile, mode='readonly', memmap=False)
-            hdu = fileutil.getExtn(handle,extn=exten)
-            lfltdata = hdu.data
+            lfltdata = refcache.reference_cache.getdata(lflatfile, exten)
             if lfltdata.shape != self.full_shape:
                 lfltdata = expand_image(lfltdata, self.full_shape)
         except IOError:
@@ -53,9 +52,7 @@ class STISInputImage (imageObject):
 
         # Try to open the file in the location specified by PFLTFILE.
         try:
-            handle = fileutil.openImage(pflatfile, mode='readonly', memmap=False)
-            hdu = fileutil.getExtn(handle,extn=exten)
-            pfltdata = hdu.data
+            pfltdata = refcache.reference_cache.getdata(pflatfile, exten)
         except IOError:
             pfltdata = np.ones(self.full_shape, dtype=sci_chip.data.dtype)
             print("Cannot find file '{:s}'. Treating flatfield constant value "
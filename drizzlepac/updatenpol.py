@@ -27,6 +27,7 @@ from stsci.tools import teal
 
 from stwcs import updatewcs
 from . import util
+from .refcache import reference_cache
 from . import __version__
 
 
@@ -131,7 +132,7 @@ def update(input, refdir="jref$",local=None, interactive=False, wcsupdate=True):
         if dfile in ['N/A','',' ',None]:
             npolname = ''
         else:
-            dhdr = fits.getheader(fu.osfn(dfile), memmap=False)
+            dhdr = reference_cache.getheader(dfile)
             if not interactive:
                 # search all new NPOLFILEs for one that matches current DGEOFILE config
                 npol = find_npolfile(ngeofiles,fdet,[phdr['filter1'],phdr['filter2']])
@@ -207,7 +208,7 @@ def find_d2ifile(flist,detector):
     """
     d2ifile = None
     for f in flist:
-        fdet = fits.getval(f, 'detector', memmap=False)
+        fdet = reference_cache.getval(f, 'detector')
         if fdet == detector:
             d2ifile = f
     return d2ifile
@@ -218,11 +219,11 @@ def find_npolfile(flist,detector,filters):
     """
     npolfile = None
     for f in flist:
-        fdet = fits.getval(f, 'detector', memmap=False)
+        fdet = reference_cache.getval(f, 'detector')
         if fdet == detector:
-            filt1 = fits.getval(f, 'filter1', memmap=False)
-            filt2 = fits.getval(f, 'filter2', memmap=False)
-            fdate = fits.getval(f, 'date', memmap=False)
+            filt1 = reference_cache.getval(f, 'filter1')
+            filt2 = reference_cache.getval(f, 'filter2')
+            fdate = reference_cache.getval(f, 'date')
             if filt1 == 'ANY' or \
              (filt1 == filters[0] and filt2 == filters[1]):
                 npolfile = f
@@ -10,17 +10,20 @@ A library of utility functions
 """
 import logging
 import functools
+import json
 import os
 import sys
 import string
 import errno
 import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import astropy
 
 from astropy.io import fits
-from stsci.tools import fileutil, teal, cfgpars, logutil
+from stsci.tools import fileutil, logutil
 from stsci.tools import configobj
 
 from stwcs import wcsutil
@@ -28,6 +31,11 @@ from stwcs.wcsutil import altwcs
 
 from . import __version__
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
 __fits_version__ = astropy.__version__
 __numpy_version__ = np.__version__
 
@@ -62,7 +70,8 @@ def get_pool_size(usr_config_value, num_tasks):
     if not can_parallel:
         return 1
     # Give priority to their specified cfg value, over the actual cpu count
-    if usr_config_value is not None:
+    # ('auto' values are normally resolved by processInput.setCommonInput)
+    if usr_config_value is not None and usr_config_value != 'auto':
         if num_tasks is None:
             return usr_config_value
         else:
@@ -76,6 +85,66 @@ def get_pool_size(usr_config_value, num_tasks):
         return min(_cpu_count, num_tasks)
 
 
+def _read_memory_value(filename):
+    try:
+        with open(filename) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def get_available_memory():
+    """ Return the memory (in bytes) available to this process: the memory
+    available on the system (``MemAvailable`` in ``/proc/meminfo``), limited
+    by what is left under the memory limit of the control group (cgroup v1
+    or v2) of the process, if any.  Returns `None` when this cannot be
+    determined (for instance on non-Linux platforms).
+    """
+    available = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+
+    for limit_file, usage_file in [
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes')]:
+        limit = _read_memory_value(limit_file)
+        if limit is None:
+            continue
+        # cgroup v1 reports a huge number when there is no limit
+        if limit >= 2**60:
+            break
+        left = max(limit - (_read_memory_value(usage_file) or 0), 0)
+        available = left if available is None else min(available, left)
+        break
+
+    return available
+
+
+def launch_threads_and_wait(tasks, pool_size):
+    """ Run each callable in ``tasks`` in a pool of ``pool_size`` threads and
+    block until the last one finishes.  This is the thread-based counterpart
+    of `stsci.tools.mputil.launch_and_wait`: the tasks share all of their
+    arguments (including numpy arrays) with the caller without copying, which
+    pays off only for work that releases the GIL, such as ``cdriz.tdriz`` and
+    ``cdriz.tblot``.  Returns the list of values returned by the tasks, in
+    order.  The first exception raised by any task is re-raised here once
+    all the tasks are done.
+    """
+    if len(tasks) < 1:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, pool_size)) as executor:
+        futures = [executor.submit(task) for task in tasks]
+    return [f.result() for f in futures]
+
+
 DEFAULT_LOGNAME = 'astrodrizzle.log'
 blank_list = [None, '', ' ', 'None', 'INDEF']
 
@@ -297,9 +366,26 @@ class ProcSteps:
         The code for each processing step must call the 'addStep()'
         method to initialize the information for that step, then
         the 'endStep()' method to record the end and elapsed times.
+        Both methods accept a ``chip`` argument in order to time the
+        processing of a single chip (or image) within a step.
+
+        Steps whose results get reused from an earlier run (see
+        `~drizzlepac.checkpoint.Checkpoint`) are recorded with the
+        'reuseStep()' method instead.
 
         The 'reportTimes()' method can then be used to provide a summary
         of all the elapsed times and total run time.
+
+        Besides the wall-clock times, each step records the CPU time
+        (including that of worker processes which have finished), the
+        peak resident memory and the number of bytes read from and written
+        to storage. Additional values (number of chips, output pixels,
+        workers, ...) can be attached to a step with 'setStepInfo()', and
+        the number of workers and the times of the chips processed by them
+        with 'addWorkerTimes()'. The
+        'writeTelemetry()' method saves all of these records as JSON lines
+        or as a Chrome trace (viewable with ``chrome://tracing`` or
+        Perfetto).
     """
     __report_header = '\n   %20s          %s\n' % ('-' * 20, '-' * 20)
     __report_header += '   %20s          %s\n' % ('Step', 'Elapsed time')
@@ -311,34 +397,85 @@ class ProcSteps:
         self.start = _ptime()
         self.end = None
 
-    def addStep(self, key):
+    def addStep(self, key, chip=None):
         """
         Add information about a new step to the dict of steps
         The value 'ptime' is the output from '_ptime()' containing
         both the formatted and unformatted time for the start of the
         step.
+
+        When ``chip`` is specified, start timing the processing of that
+        chip within step ``key`` instead.
         """
         ptime = _ptime()
+        if chip is not None:
+            chips = self.steps[key].setdefault('chips', {})
+            chips[chip] = {'start': ptime, 'usage': _resource_usage()}
+            return
+
         print('==== Processing Step ', key, ' started at ', ptime[0])
         print("", flush=True)
-        self.steps[key] = {'start': ptime}
+        self.steps[key] = {'start': ptime, 'usage': _resource_usage()}
         self.order.append(key)
 
-    def endStep(self, key):
+    def endStep(self, key, chip=None):
         """
         Record the end time for the step.
 
         If key==None, simply record ptime as end time for class to represent
         the overall runtime since the initialization of the class.
+
+        When ``chip`` is specified, record the end time for the processing
+        of that chip within step ``key``.
         """
         ptime = _ptime()
+        if chip is not None:
+            _end_record(self.steps[key]['chips'][chip], ptime)
+            return
+
         if key is not None:
-            self.steps[key]['end'] = ptime
-            self.steps[key]['elapsed'] = ptime[1] - self.steps[key]['start'][1]
+            _end_record(self.steps[key], ptime)
         self.end = ptime
 
         print('==== Processing Step {} finished at {}'.format(key, ptime[0]), flush=True)
 
+    def reuseStep(self, key):
+        """
+        Record a step whose results were reused instead of being computed.
+        """
+        ptime = _ptime()
+        print('==== Processing Step {} reused from checkpoint at {}'
+              .format(key, ptime[0]), flush=True)
+        self.steps[key] = {'start': ptime, 'end': ptime, 'elapsed': 0.0,
+                           'reused': True}
+        self.order.append(key)
+        self.end = ptime
+
+    def setStepInfo(self, key, **info):
+        """
+        Attach additional values (for instance ``nchips``, ``npix`` or
+        ``workers``) to the telemetry record of step ``key``.
+        Steps that were not run are ignored.
+        """
+        if key in self.steps:
+            self.steps[key].setdefault('info', {}).update(info)
+
+    def addWorkerTimes(self, key, worker_times):
+        """
+        Attach the number of parallel workers used by step ``key`` and the
+        records of the chips they processed, as collected by a
+        `WorkerTimes` object, to the telemetry record of the step.
+        Steps that were not run are ignored.
+        """
+        if key not in self.steps:
+            return
+        self.setStepInfo(key, workers=worker_times.workers,
+                         backend=worker_times.backend)
+        chips = self.steps[key].setdefault('chips', {})
+        for chip, start, elapsed, cpu in worker_times.records():
+            chips[chip] = {'start': _ptime(start), 'elapsed': elapsed,
+                           'cpu': cpu}
+
     def reportTimes(self):
         """
         Print out a formatted summary of the elapsed times for all the
@@ -354,20 +491,195 @@ class ProcSteps:
             else:
                 _time = 0.0
             total_time += _time
-            print('   %20s          %0.4f sec.' % (step, _time))
+            if self.steps[step].get('reused', False):
+                print('   %20s          %0.4f sec. (reused)' % (step, _time))
+            else:
+                print('   %20s          %0.4f sec.' % (step, _time))
 
         print('   %20s          %s' % ('=' * 20, '=' * 20))
         print('   %20s          %0.4f sec.' % ('Total', total_time))
         print("", flush=True)
 
+    def telemetry(self):
+        """
+        Return a list of dictionaries with the performance record of each
+        step followed by the records of its chips, in order of execution.
+        """
+        records = []
+        for step in self.order:
+            entry = self.steps[step]
+            records.append(_telemetry_record(step, None, entry))
+            for chip, chip_entry in entry.get('chips', {}).items():
+                records.append(_telemetry_record(step, chip, chip_entry))
+        return records
+
+    def writeTelemetry(self, filename, format='jsonl'):
+        """
+        Write the performance records of all steps to ``filename``, either
+        as JSON lines (``format='jsonl'``), one record per line, or as a
+        Chrome trace (``format='chrome'``).
+        """
+        records = self.telemetry()
+        if format == 'chrome':
+            pid = os.getpid()
+            events = []
+            for rec in records:
+                event = {
+                    'name': rec['step'] if rec['chip'] is None else rec['chip'],
+                    'cat': 'step' if rec['chip'] is None else rec['step'],
+                    'ph': 'X',
+                    'ts': rec['start'] * 1e6,
+                    'dur': rec['wall_time'] * 1e6,
+                    'pid': pid,
+                    'tid': 0 if rec['chip'] is None else 1,
+                    'args': {k: v for k, v in rec.items()
+                             if k not in ('step', 'chip', 'start')}
+                }
+                events.append(event)
+            with open(filename, 'w') as f:
+                json.dump({'traceEvents': events,
+                           'displayTimeUnit': 'ms'}, f)
+
+        elif format == 'jsonl':
+            with open(filename, 'w') as f:
+                for rec in records:
+                    f.write(json.dumps(rec) + '\n')
+
+        else:
+            raise ValueError("Unsupported telemetry format '{}'."
+                             .format(format))
+
 
-def _ptime():
+class WorkerTimes:
+    """ Number of parallel workers used by a processing step and the
+    wall-clock and CPU times of the chips (or other units of work) that they
+    processed, to be attached to the step with `ProcSteps.addWorkerTimes`.
+
+    The code launching the workers sets ``workers`` (and ``backend``) and
+    wraps the function run for each chip with `wrap`. Wrapped functions
+    record their times whether they run in the calling thread, in worker
+    threads (CPU time of the thread) or in forked worker processes (CPU
+    time of the process, written to a small block of shared memory).
+    """
+    def __init__(self):
+        self.workers = 1
+        self.backend = 'serial'
+        self._records = []
+        self._shared = []
+
+    def wrap(self, chip, func, process=False):
+        """ Return a function calling ``func`` with the same arguments and
+        recording its times under the name ``chip``. Use ``process=True``
+        when it is run in a forked process. """
+        if process:
+            shared = multiprocessing.get_context('fork').RawArray('d', 3)
+            shared[1] = -1.0  # not run
+            self._shared.append((chip, shared))
+            cpu_time = time.process_time
+        else:
+            cpu_time = time.thread_time
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.time()
+            cpu = cpu_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times = (start, time.time() - start, cpu_time() - cpu)
+                if process:
+                    shared[:] = times
+                else:
+                    # list.append is atomic, so threads need no lock
+                    self._records.append((chip,) + times)
+        return timed
+
+    def records(self):
+        """ Return the ``(chip, start, elapsed, cpu)`` records of all the
+        wrapped functions that have run. """
+        records = list(self._records)
+        for chip, shared in self._shared:
+            if shared[1] >= 0:
+                records.append((chip,) + tuple(shared))
+        return sorted(records, key=lambda r: r[1])
+
+
+def telemetry_filename(logfile, format='jsonl'):
+    """ Return the name of the file, next to the trailer file ``logfile``,
+    to which `ProcSteps.writeTelemetry` writes records in ``format``. """
+    root = os.path.splitext(logfile)[0]
+    if format == 'chrome':
+        return '{:s}_trace.json'.format(root)
+    return '{:s}_telemetry.jsonl'.format(root)
+
+
+def _resource_usage():
+    """ Return the CPU time (in seconds) used by the process and by its
+    terminated children, its peak resident set size (in bytes) and the
+    number of bytes it read from and wrote to storage. Values which are not
+    available on this platform are `None`. """
+    usage = {'cpu': time.process_time(), 'maxrss': None,
+             'read_bytes': None, 'write_bytes': None}
+
+    if resource is not None:
+        rself = resource.getrusage(resource.RUSAGE_SELF)
+        rchild = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage['cpu'] = (rself.ru_utime + rself.ru_stime +
+                        rchild.ru_utime + rchild.ru_stime)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS:
+        scale = 1 if sys.platform == 'darwin' else 1024
+        usage['maxrss'] = max(rself.ru_maxrss, rchild.ru_maxrss) * scale
+        usage['read_bytes'] = 512 * (rself.ru_inblock + rchild.ru_inblock)
+        usage['write_bytes'] = 512 * (rself.ru_oublock + rchild.ru_oublock)
+
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(':') for line in f if ':' in line)
+        usage['read_bytes'] = int(io['read_bytes'])
+        usage['write_bytes'] = int(io['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    return usage
+
+
+def _end_record(entry, ptime):
+    entry['end'] = ptime
+    entry['elapsed'] = ptime[1] - entry['start'][1]
+    if 'usage' in entry:
+        start = entry['usage']
+        end = _resource_usage()
+        entry['cpu'] = end['cpu'] - start['cpu']
+        entry['maxrss'] = end['maxrss']
+        for k in ('read_bytes', 'write_bytes'):
+            if start[k] is not None and end[k] is not None:
+                entry[k] = end[k] - start[k]
+
+
+def _telemetry_record(step, chip, entry):
+    rec = {
+        'step': step,
+        'chip': chip,
+        'start': entry['start'][1],
+        'wall_time': entry.get('elapsed', 0.0),
+        'cpu_time': entry.get('cpu'),
+        'peak_rss': entry.get('maxrss'),
+        'read_bytes': entry.get('read_bytes'),
+        'write_bytes': entry.get('write_bytes'),
+        'reused': entry.get('reused', False),
+    }
+    rec.update(entry.get('info', {}))
+    return rec
+
+
+def _ptime(ftime=None):
     import time
     try:
         import datetime as dtime
     except ImportError:
         dtime = None
-    ftime = time.time()
+    if ftime is None:
+        ftime = time.time()
     if dtime:
         # This time stamp includes sub-second timing...
         _ltime = dtime.datetime.fromtimestamp(ftime)
@@ -693,6 +1005,9 @@ def getDefaultConfigObj(taskname, configObj, input_dict={}, loadOnly=True):
             user to edit the values further and then run the task if desired.
 
     """
+    # TEAL (and tkinter) are only needed when loading task parameters
+    from stsci.tools import cfgpars, teal
+
     if configObj is None:
         # Start by grabbing the default values without using the GUI
         # This insures that all subsequent use of the configObj includes
@@ -741,6 +1056,7 @@ def getConfigObjPar(configObj, parname):
     """ Return parameter value without having to specify which section
         holds the parameter.
     """
+    from stsci.tools import cfgpars
     return cfgpars.findFirstPar(configObj, parname)[1]
 
 def displayMakewcsWarningBox(display=True, parent=None):
@@ -1220,6 +1536,7 @@ def _get_help_as_string(docstring, show_ver, module_file, task_name, module_doc)
     if docstring or not os.path.exists(htmlfile):
         helpString = f"Task: '{task_name}'. '{__package__}' version: {__version__}\n\n" if show_ver else '\n'
         if os.path.exists(helpfile):
+            from stsci.tools import teal
             helpString += teal.getHelpFileAsString(taskname, module_file).rstrip() + '\n'
         elif module_doc is not None:
             helpString += module_doc + '\n'
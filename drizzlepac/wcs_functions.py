@@ -20,7 +20,6 @@ from stwcs.wcsutil import altwcs
 
 from stsci.tools.fileutil import countExtn
 
-from drizzlepac.haputils import processing_utils as proc_utils
 
 DEFAULT_WCS_PARS = {'ra': None, 'dec': None, 'scale': None, 'rot': None,
                     'outnx': None, 'outny': None,
@@ -1168,6 +1167,9 @@ def verify_sci_hdrname(filename):
     extension of the science image ``filename`` is populated with a valid
     non-empty string.
     """
+    # imported here as it brings in most of the HAP dependencies
+    from drizzlepac.haputils import processing_utils as proc_utils
+
     fhdu, closefits = proc_utils._process_input(filename)
 
     # Find all extensions to be updated
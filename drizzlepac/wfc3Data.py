@@ -7,7 +7,8 @@
 
 """
 from stsci.tools import fileutil
-from .imageObject import imageObject
+from .imageObject import imageObject, constant_image
+from . import refcache
 import numpy as np
 
 class WFC3InputImage(imageObject):
@@ -251,17 +252,16 @@ class WFC3IRInputImage(WFC3InputImage):
         # keyword in the primary keyword of the science data.
         try:
             filename = self.header["DARKFILE"]
-            handle = fileutil.openImage(filename, mode='readonly', memmap=False)
-            hdu = fileutil.getExtn(handle,extn="sci,1")
-            darkobj = hdu.data[sci_chip.ltv2:sci_chip.size2,sci_chip.ltv1:sci_chip.size1]
+            data = refcache.reference_cache.getdata(filename, "sci,1")
+            darkobj = data[sci_chip.ltv2:sci_chip.size2,sci_chip.ltv1:sci_chip.size1]
 
         # If the darkfile cannot be located, create the dark image from
         # what we know about the detector dark current and assume a
         # constant dark current for the whole image.
         except:
-            darkobj = (np.ones(sci_chip.image_shape,
-                               dtype=sci_chip.image_dtype) *
-                       self.getdarkcurrent())
+            darkobj = constant_image(sci_chip.image_shape,
+                                     sci_chip.image_dtype,
+                                     self.getdarkcurrent())
         return darkobj
 
     def getskyimg(self,chip):
@@ -276,9 +276,10 @@ class WFC3IRInputImage(WFC3InputImage):
 
         """
         sci_chip = self._image[self.scienceExt,chip]
-        skyimg = np.ones(sci_chip.image_shape,dtype=sci_chip.image_dtype)*sci_chip.subtractedSky
+        skyimg = constant_image(sci_chip.image_shape, sci_chip.image_dtype,
+                                sci_chip.subtractedSky)
         if sci_chip._conversionFactor != 1.0: # If units are not already ELECTRONS
-            skyimg *= self.getexptimeimg(chip)
+            skyimg = skyimg * self.getexptimeimg(chip)
         return skyimg
 
     def getdarkcurrent(self):
@@ -332,6 +332,10 @@ class WFPC2InputImage (imageObject):
         """ Build masks as specified in the user parameters found in the
             configObj object.
         """
+        dqmask = self.maskCache.get(chip, bits)
+        if dqmask is not None:
+            return dqmask
+
         sci_chip = self._image[self.scienceExt,chip]
         ### For WFPC2 Data, build mask files using:
         maskname = sci_chip.dqrootname+'_dqmask.fits'
@@ -340,6 +344,7 @@ class WFPC2InputImage (imageObject):
         sci_chip.outputNames['dqmask'] = dqmask_name
         sci_chip.outputNames['tmpmask'] = 'wfpc2_inmask%d.fits'%(sci_chip.detnum)
         dqmask = fits.getdata(dqmask_name, ext=0, memmap=False)
+        self.maskCache.put(chip, bits, dqmask)
         return dqmask
 
     def _assignSignature(self, chip):
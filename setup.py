@@ -1,11 +1,14 @@
 #!/usr/bin/env python
+import os
 import sys
+import tempfile
 from glob import glob
 from pathlib import Path
 
 import numpy
 from astropy import wcs
 from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
 
 # Setup C module include directories
 include_dirs = []
@@ -29,6 +32,44 @@ if sys.platform == 'win32':
         ('__STDC__', 1)
     ]
 
+
+class BuildExtOpenMP(build_ext):
+    """ Build ``cdriz`` with OpenMP whenever the compiler supports it, which
+    allows ``tdriz`` to use several threads. Set ``DRIZZLEPAC_OPENMP=0`` in the
+    environment to build without OpenMP.
+    """
+    def _openmp_flags(self):
+        if os.environ.get('DRIZZLEPAC_OPENMP', '1') == '0':
+            return None
+        if self.compiler.compiler_type == 'msvc':
+            return ['/openmp'], []
+        flags = ['-fopenmp']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, 'check_openmp.c')
+            with open(src, 'w') as f:
+                f.write('#include <omp.h>\n'
+                        'int main(void) { return omp_get_max_threads() < 1; }\n')
+            try:
+                objs = self.compiler.compile([src], output_dir=tmpdir,
+                                             extra_postargs=flags)
+                self.compiler.link_executable(objs, 'check_openmp',
+                                              output_dir=tmpdir,
+                                              extra_postargs=flags)
+            except Exception:
+                return None
+        return flags, flags
+
+    def build_extensions(self):
+        flags = self._openmp_flags()
+        if flags is None:
+            print('Building the drizzle kernel without OpenMP support')
+        else:
+            for ext in self.extensions:
+                ext.extra_compile_args += flags[0]
+                ext.extra_link_args += flags[1]
+        super().build_extensions()
+
+
 ext_modules = [
     Extension(
         'drizzlepac.cdriz',
@@ -40,4 +81,5 @@ ext_modules = [
 
 setup(
     ext_modules=ext_modules,
+    cmdclass={'build_ext': BuildExtOpenMP},
 )
@@ -34,6 +34,9 @@ static PyObject *gl_Error;
  xin, yin are the input coordinates, and xout and yout are the output
  coordinates.  All are 1-dimensional Numpy DOUBLE arrays of the same
  length.
+
+ The drizzling and blotting loops run without holding the GIL, so it
+ gets re-acquired here for the duration of the call.
 */
 static int
 py_mapping_callback(void* state,
@@ -54,6 +57,9 @@ py_mapping_callback(void* state,
   PyObject* callback_result = NULL;
   PyObject* callback_tuple = NULL;
   int result = TRUE;
+  PyGILState_STATE gstate;
+
+  gstate = PyGILState_Ensure();
 
   py_xin = (PyArrayObject*)PyArray_SimpleNewFromData(1, &dims, NPY_FLOAT64, (double*)xin);
   if (py_xin == NULL)
@@ -110,6 +116,8 @@ py_mapping_callback(void* state,
   Py_XDECREF(py_xout);
   Py_XDECREF(py_yout);
 
+  PyGILState_Release(gstate);
+
   if (result)
     driz_error_set_message(error, "<PYTHON>");
 
@@ -165,6 +173,8 @@ PyWCSMap_init(PyWCSMap *self, PyObject *args, PyObject *kwds)
   /* Arguments in the order they appear */
   PyObject *input_obj = NULL;
   PyObject *output_obj = NULL;
+  PyObject *table_obj = NULL;
+  PyArrayObject *table = NULL;
   int nx, ny;
   double factor;
   int status = -1;
@@ -176,16 +186,40 @@ PyWCSMap_init(PyWCSMap *self, PyObject *args, PyObject *kwds)
   driz_error_init(&error);
 
   /* TODO: Make factor a kwarg */
-  if (! PyArg_ParseTuple(args, "OOiid:DefaultWCSMapping.__init__",
-                         &input_obj, &output_obj, &nx, &ny, &factor)){
+  if (! PyArg_ParseTuple(args, "OOiid|O:DefaultWCSMapping.__init__",
+                         &input_obj, &output_obj, &nx, &ny, &factor,
+                         &table_obj)){
     goto exit;
   }
 
+  /* A table of output positions, as returned by the 'table' attribute of
+     a mapping with the same parameters, may be given to avoid computing
+     it again. */
+  if (table_obj != NULL && table_obj != Py_None) {
+    if (factor <= 0) {
+      PyErr_SetString(PyExc_ValueError,
+                      "A table can only be used with a positive factor");
+      goto exit;
+    }
+    table = (PyArrayObject *)PyArray_ContiguousFromAny(table_obj, NPY_FLOAT64, 3, 3);
+    if (!table) {
+      goto exit;
+    }
+    if (PyArray_DIM(table, 0) != (int)((double)ny / factor) + 2 ||
+        PyArray_DIM(table, 1) != (int)((double)nx / factor) + 2 ||
+        PyArray_DIM(table, 2) != 2) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Table shape does not match the mapping parameters");
+      goto exit;
+    }
+  }
+
   /* Create the C struct from all of these mapping parameters */
   istat = default_wcsmap_init(
       &self->m,
       &((Wcs*)input_obj)->x, &((Wcs*)output_obj)->x,
       nx, ny, factor,
+      table ? (double *)PyArray_DATA(table) : NULL,
       &error);
 
   if (istat || driz_error_is_set(&error)) {
@@ -202,10 +236,42 @@ PyWCSMap_init(PyWCSMap *self, PyObject *args, PyObject *kwds)
   status = 0;
 
  exit:
+  Py_XDECREF(table);
 
   return status;
 }
 
+static PyObject*
+PyWCSMap_get_table(PyWCSMap* self, void* closure)
+{
+  npy_intp dims[3];
+  PyArrayObject* table;
+
+  if (self->m.table == NULL) {
+    Py_RETURN_NONE;
+  }
+
+  dims[0] = self->m.sny;
+  dims[1] = self->m.snx;
+  dims[2] = 2;
+  table = (PyArrayObject*)PyArray_SimpleNew(3, dims, NPY_FLOAT64);
+  if (table == NULL) {
+    return NULL;
+  }
+  memcpy(PyArray_DATA(table), self->m.table,
+         (size_t)self->m.snx * self->m.sny * 2 * sizeof(double));
+
+  return (PyObject*)table;
+}
+
+static PyGetSetDef PyWCSMap_getset[] = {
+  {"table", (getter)PyWCSMap_get_table, NULL,
+   "Copy of the table of output positions at every 'factor' input pixels "
+   "used for interpolating the mapping (None when computed directly).",
+   NULL},
+  {NULL}  /* Sentinel */
+};
+
 static PyObject*
 PyWCSMap_call(PyWCSMap* self, PyObject* args, PyObject* kwargs)
 {
@@ -302,7 +368,7 @@ static PyTypeObject WCSMapType = {
   0,                                               /*tp_setattro*/
   0,                                               /*tp_as_buffer*/
   (long) Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
-  (char *) "DefaultWCSMapping(input,output)",      /* tp_doc */
+  (char *) "DefaultWCSMapping(input,output,nx,ny,factor[,table])", /* tp_doc */
   0,                                               /* tp_traverse */
   0,                                               /* tp_clear */
   0,                                               /* tp_richcompare */
@@ -311,7 +377,7 @@ static PyTypeObject WCSMapType = {
   0,                                               /* tp_iternext */
   0,                                               /* tp_methods */
   0,                                               /* tp_members */
-  0,                                               /* tp_getset */
+  PyWCSMap_getset,                                 /* tp_getset */
   0,                                               /* tp_base */
   0,                                               /* tp_dict */
   0,                                               /* tp_descr_get */
@@ -336,6 +402,8 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   char *fillstr;
   integer_t nmiss, nskip, vflag;
   PyObject *callback_obj;
+  long ybmin = 0, ybmax = -1;
+  long num_threads = 1;
 
   /* Derived values */
   PyArrayObject *img = NULL, *wei = NULL, *out = NULL, *wht = NULL, *con = NULL;
@@ -358,12 +426,12 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
 
   driz_error_init(&error);
 
-  if (!PyArg_ParseTuple(args,"OOOOOllllldddsdssffsiiiO:tdriz",
+  if (!PyArg_ParseTuple(args,"OOOOOllllldddsdssffsiiiO|lll:tdriz",
                         &oimg, &owei, &oout, &owht, &ocon, &uniqid, &ystart,
                         &xmin, &ymin, &dny, &scale, &xscale, &yscale,
                         &align_str, &pfract, &kernel_str, &inun_str,
                         &expin, &wtscl, &fillstr, &nmiss,&nskip, &vflag,
-                        &callback_obj)) {
+                        &callback_obj, &ybmin, &ybmax, &num_threads)) {
     return PyErr_Format(gl_Error, "cdriz.tdriz: Invalid Parameters.");
   }
 
@@ -389,9 +457,15 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
     callback = default_wcsmap;
     callback_state = (void *)&(((PyWCSMap *)callback_obj)->m);
     /*scale = ((PyWCSMap *)callback_obj)->m.scale; */
+    /* Only the interpolated (table) mapping may be shared by threads:
+       the direct one updates the WCS structures on every call. */
+    if (((PyWCSMap *)callback_obj)->m.factor == 0) {
+      num_threads = 1;
+    }
   } else {
     callback = py_mapping_callback;
     callback_state = (void *)callback_obj;
+    num_threads = 1;
   }
 
   /* Get raw C-array data */
@@ -463,6 +537,15 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   onx = PyArray_DIMS(out)[1];
   ony = PyArray_DIMS(out)[0];
 
+  if (ybmax < 0) {
+    ybmax = ony - 1;
+  }
+  if (ybmin < 0 || ybmin > ybmax || ybmax >= ony) {
+    driz_error_format_message(&error, "Invalid band of output rows [%ld, %ld]",
+                              ybmin, ybmax);
+    goto _exit;
+  }
+
   nmiss = 0;
   nskip = 0;
 
@@ -481,6 +564,9 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   p.ny = dny;
   p.onx = p.xmax = onx;
   p.ony = p.ymax = ony;
+  p.ybmin = ybmin;
+  p.ybmax = ybmax;
+  p.nthreads = (num_threads > 1) ? num_threads : 1;
   p.scale = scale;
   p.x_scale = xscale;
   p.y_scale = yscale;
@@ -499,10 +585,10 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   /*
   start_t = clock();
   */
-  /* Do the drizzling */
-  if (dobox(&p, ystart, &nmiss, &nskip, &error)) {
-    goto _exit;
-  }
+  /* Do the drizzling.  The arrays are owned by this function for the
+     duration of the call, so other Python threads may run meanwhile. */
+  Py_BEGIN_ALLOW_THREADS
+  istat = dobox(&p, ystart, &nmiss, &nskip, &error);
   /*
   end_t = clock();
   delta_time = difftime(end_t, start_t)/1e+6;
@@ -511,9 +597,14 @@ tdriz(PyObject *obj UNUSED_PARAM, PyObject *args)
   start_t = clock();
   */
   /* Put in the fill values (if defined) */
-  if (do_fill) {
+  if (!istat && do_fill) {
     put_fill(&p, fill_value);
   }
+  Py_END_ALLOW_THREADS
+
+  if (istat) {
+    goto _exit;
+  }
   /*
   if (callback == default_wcsmap){
     m = (struct wcsmap_param_t *)p.mapping_callback_state;
@@ -666,8 +757,15 @@ tblot(PyObject *obj, PyObject *args)
     goto _exit;
   }
 
-  callback = py_mapping_callback;
-  callback_state = (void *)callback_obj;
+  if (PyObject_TypeCheck(callback_obj, &WCSMapType)) {
+    /* If we're using the default mapping, we can set things up to avoid
+       the Python/C bridge */
+    callback = default_wcsmap;
+    callback_state = (void *)&(((PyWCSMap *)callback_obj)->m);
+  } else {
+    callback = py_mapping_callback;
+    callback_state = (void *)callback_obj;
+  }
 
   img = (PyArrayObject *)PyArray_ContiguousFromAny(oimg, NPY_FLOAT32, 2, 2);
   if (!img) {
@@ -715,7 +813,9 @@ tblot(PyObject *obj, PyObject *args)
   p.mapping_callback = callback;
   p.mapping_callback_state = callback_state;
 
+  Py_BEGIN_ALLOW_THREADS
   istat = doblot(&p, &error);
+  Py_END_ALLOW_THREADS
 
  _exit:
   Py_DECREF(img);
@@ -731,24 +831,22 @@ tblot(PyObject *obj, PyObject *args)
 }
 
 
-/* To replace the default prinf log; instead log to a pythonic log */
+/* To replace the default prinf log; instead log to a pythonic log.
+   This may get called from code running without the GIL, so the GIL
+   gets acquired here before calling into Python. */
 void cdriz_log_func(const char *format, ...) {
   static PyObject *logging = NULL;
   va_list args;
   PyObject *logger;
   PyObject *string;
+  PyObject *result;
+  PyObject *etype, *evalue, *etb;
+  PyGILState_STATE gstate;
   char msg[256];
   int n;
 
   va_start(args, format);
-
-  if (logging == NULL) {
-    logging = PyImport_ImportModuleNoBlock("logging");
-    if (logging == NULL) return;
-  }
-
   n = PyOS_vsnprintf(msg, sizeof(msg), format, args);
-
   va_end(args);
 
   if (n < 0) {
@@ -756,21 +854,36 @@ void cdriz_log_func(const char *format, ...) {
     return;
   }
 
+  gstate = PyGILState_Ensure();
+  PyErr_Fetch(&etype, &evalue, &etb);
+
+  if (logging == NULL) {
+    logging = PyImport_ImportModuleNoBlock("logging");
+    if (logging == NULL) goto _exit;
+  }
+
   /* XXX: Provide a way to specify the log level to use */
   string = Py_BuildValue("s", msg);
-  if (string == NULL) return;
+  if (string == NULL) goto _exit;
 
   logger = PyObject_CallMethod(logging, "getLogger", "s",
                                "drizzlepac.cdriz");
   if (logger == NULL) {
       Py_XDECREF(string);
-      return;
+      goto _exit;
   }
 
-  PyObject_CallMethod(logger, "info", "O", string);
+  result = PyObject_CallMethod(logger, "info", "O", string);
 
+  Py_XDECREF(result);
   Py_XDECREF(logger);
   Py_XDECREF(string);
+
+ _exit:
+  /* Logging must never change the exception state of the caller */
+  PyErr_Clear();
+  PyErr_Restore(etype, evalue, etb);
+  PyGILState_Release(gstate);
   return;
 }
 
@@ -1164,7 +1277,7 @@ arrxyzero(PyObject *obj, PyObject *args)
 
 static PyMethodDef cdriz_methods[] =
   {
-    {"tdriz",  tdriz, METH_VARARGS, "tdriz(image, weight, output, outweight, context, uniqid, ystart, xmin, ymin, dny, scale, xscale, yscale, align, pfrace, kernel, inun, expin, wtscl, fill, nmiss, nskip, vflag, callback)"},
+    {"tdriz",  tdriz, METH_VARARGS, "tdriz(image, weight, output, outweight, context, uniqid, ystart, xmin, ymin, dny, scale, xscale, yscale, align, pfrace, kernel, inun, expin, wtscl, fill, nmiss, nskip, vflag, callback[, ybmin, ybmax[, num_threads]])"},
     /*{"twdriz",  tdriz, METH_VARARGS, "triz(image, weight, output, outweight, ystart, xmin, ymin, dny, wcsin, wcsout,pxg,pyg,pfract, kernel, coeffs, fillstr,nmiss,nskip,vflag)"},*/
     {"tblot",  tblot, METH_VARARGS, "tblot(image, output, xmin, xmax, ymin, ymax, scale, kscale, xscale, yscale, align, interp, ef, misval, sinscl, vflag, callback)"},
     {"arrmoments", arrmoments, METH_VARARGS, "arrmoments(image, p, q)"},
@@ -1204,5 +1317,12 @@ PyObject *PyInit_cdriz(void)
   Py_INCREF(&WCSMapType);
   PyModule_AddObject(m, "DefaultWCSMapping", (PyObject *)&WCSMapType);
 
+  /* Whether 'tdriz' can use more than one thread (num_threads > 1) */
+#ifdef _OPENMP
+  PyModule_AddIntConstant(m, "has_openmp", 1);
+#else
+  PyModule_AddIntConstant(m, "has_openmp", 0);
+#endif
+
   return m;
 }
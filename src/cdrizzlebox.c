@@ -54,6 +54,7 @@ check_over(struct driz_param_t* p, const integer_t y, const integer_t margin,
   integer_t step, first, last;
   integer_t nhit, nmiss;
   integer_t i, np;
+  double ylo, yhi, bmargin;
 
   assert(p);
   assert(ofrac);
@@ -89,11 +90,24 @@ check_over(struct driz_param_t* p, const integer_t y, const integer_t margin,
     logo[i] = 0;
   }
 
+  ylo = 1.0 - (double)margin;
+  yhi = (double)(p->ony + margin);
+
+  /* When only a band of output rows is to be updated, also skip the
+     parts of the line which cannot reach that band.  The margin is
+     widened by the kernel footprint so that every input pixel which
+     contributes to the band is still drizzled. */
+  if (p->ybmin > 0 || p->ybmax < p->nsy - 1) {
+    bmargin = (double)margin + ceil(2.0 * p->pfo);
+    ylo = MAX(ylo, (double)(p->ymin + p->ybmin) - bmargin);
+    yhi = MIN(yhi, (double)(p->ymin + p->ybmax) + bmargin);
+  }
+
   for (i = 0; i < np - 1; ++i) {
     if (MAX(xout[i], xout[i+1]) >= 1.0 - (double)margin &&
         MIN(xout[i], xout[i+1]) < (double)(p->onx + margin) &&
-        MAX(yout[i], yout[i+1]) >= 1.0 - (double)margin &&
-        MIN(yout[i], yout[i+1]) < (double)(p->ony + margin)) {
+        MAX(yout[i], yout[i+1]) >= ylo &&
+        MIN(yout[i], yout[i+1]) < yhi) {
       logo[i] = 1;
       logo[i+1] = 1;
     }
@@ -541,7 +555,7 @@ do_kernel_point(struct driz_param_t* p, const integer_t j,
 
     /* Check it is on the output image */
     if (ii >= 0 && ii < p->nsx &&
-        jj >= 0 && jj < p->nsy) {
+        jj >= p->ybmin && jj <= p->ybmax) {
       vc = *output_counts_ptr(p, ii, jj);
     /* Convert i,j 1-based pixel positions into 0-based
        indices for accessing data array. */
@@ -602,8 +616,8 @@ do_kernel_tophat(struct driz_param_t* p, const integer_t j,
 
     nxi = MAX(fortran_round(xxi), 0);
     nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nyi = MAX(fortran_round(yyi), p->ybmin);
+    nya = MIN(fortran_round(yya), p->ybmax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -684,8 +698,8 @@ do_kernel_gaussian(struct driz_param_t* p, const integer_t j,
 
     nxi = MAX(fortran_round(xxi), 0);
     nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nyi = MAX(fortran_round(yyi), p->ybmin);
+    nya = MIN(fortran_round(yya), p->ybmax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -766,8 +780,8 @@ do_kernel_lanczos(struct driz_param_t* p, const integer_t j,
 
     nxi = MAX(fortran_round(xxi), 0);
     nxa = MIN(fortran_round(xxa), p->nsx - 1);
-    nyi = MAX(fortran_round(yyi), 0);
-    nya = MIN(fortran_round(yya), p->nsy - 1);
+    nyi = MAX(fortran_round(yyi), p->ybmin);
+    nya = MIN(fortran_round(yya), p->ybmax);
 
     nhit = 0;
     /* Convert i,j 1-based pixel positions into 0-based
@@ -854,8 +868,8 @@ do_kernel_turbo(struct driz_param_t* p, const integer_t j,
     nya = fortran_round(yya);
     iis = MAX(nxi, 0);  /* Needed to be set to 0 to avoid edge effects */
     iie = MIN(nxa, p->nsx - 1);
-    jjs = MAX(nyi, 0);  /* Needed to be set to 0 to avoid edge effects */
-    jje = MIN(nya, p->nsy - 1);
+    jjs = MAX(nyi, p->ybmin);  /* Needed to be set to 0 to avoid edge effects */
+    jje = MIN(nya, p->ybmax);
 
     nhit = 0;
 
@@ -999,8 +1013,8 @@ do_kernel_square(struct driz_param_t* p,
     }
 
     /* Loop over output pixels which could be affected */
-    min_jj = MAX(fortran_round(min_doubles(yout, 4)), 0);
-    max_jj = MIN(fortran_round(max_doubles(yout, 4)), p->nsy - 1);
+    min_jj = MAX(fortran_round(min_doubles(yout, 4)), p->ybmin);
+    max_jj = MIN(fortran_round(max_doubles(yout, 4)), p->ybmax);
     min_ii = MAX(fortran_round(min_doubles(xout, 4)), 0);
     max_ii = MIN(fortran_round(max_doubles(xout, 4)), p->nsx - 1);
 
@@ -1047,6 +1061,215 @@ kernel_handler_map[] = {
   do_kernel_lanczos
 };
 
+/**
+Drizzle all the lines of the input image onto the band of output rows
+[p->ybmin, p->ybmax].  All the kernel parameters in p must have been
+set up by dobox() beforehand.  The coordinate buffers are allocated here
+so that several bands can be processed at the same time.
+*/
+static int
+dobox_rows(struct driz_param_t* p, const integer_t ystart,
+           kernel_handler_t kernel_handler,
+           /* Output parameters */
+           integer_t* nmiss, integer_t* nskip, struct driz_error_t* error) {
+  integer_t j, x1, x2, last_x1, last_x2;
+  double y, dh, ofrac;
+  integer_t oldcon, newcon;
+  double* xi = NULL;
+  double* yi = NULL;
+  double* xtmp = NULL;
+  double* ytmp = NULL;
+  double* xo = NULL;
+  double* yo = NULL;
+  size_t new_buffer_size;
+
+  /* Some initial settings - note that the reference pixel position is
+     determined by the value of ALIGN */
+  oldcon = -1;
+
+  /* Before we start we can fill the X arrays as they don't change
+     with Y */
+  new_buffer_size = (size_t)((p->kernel == kernel_square) ? p->dnx*4 : p->dnx);
+
+  xi = malloc(new_buffer_size * sizeof(double));
+  if (xi == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  yi = malloc(new_buffer_size * sizeof(double));
+  if (yi == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  xtmp = malloc(new_buffer_size * sizeof(double));
+  if (xtmp == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  ytmp = malloc(new_buffer_size * sizeof(double));
+  if (ytmp == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  xo = malloc((new_buffer_size + 1) * sizeof(double));
+  if (xo == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  yo = malloc((new_buffer_size + 1) * sizeof(double));
+  if (yo == NULL) {
+    driz_error_set_message(error, "Out of memory");
+    goto dobox_rows_exit_;
+  }
+
+  if (p->kernel == kernel_square) {
+    dh = 0.5 * p->pixel_fraction;
+    *mapping_4_ptr(p, xi, 1, 0) = 1.0 - dh;
+    *mapping_4_ptr(p, xi, 1, 1) = 1.0 + dh;
+    *mapping_4_ptr(p, xi, 1, 2) = 1.0 + dh;
+    *mapping_4_ptr(p, xi, 1, 3) = 1.0 - dh;
+  } else {
+    *mapping_ptr(p, xi, 0) = 1.0;
+  }
+
+  /* This is the outer loop over all the lines in the input image */
+  last_x1 = p->dnx;
+  last_x2 = 0;
+  y = (double)ystart;
+  for (j = 0; j < p->ny; ++j) {
+    y += 1.0;
+    /* Check the overlap with the output */
+    if (check_over(p, (integer_t)y, 5, &ofrac, &x1, &x2, error)) {
+      goto dobox_rows_exit_;
+    }
+
+    /* If the line falls completely off the output, then skip it */
+    if (ofrac != 0.0) {
+      assert(x1 > 0 && x1 <= p->dnx);
+      assert(x2 > 0 && x2 <= p->dnx);
+
+      /* We know there may be some misses */
+      *nmiss += p->dnx - (x2 - x1 + 1);
+
+      /* Don't read past the edge of the image
+      if (x2 == p->dnx) {
+          x2 -= 1;
+      }
+      */
+      /* At this point we can handle the different kernels separately.
+         First the cases where we just transform a single point rather
+         than four - every case except the "classic" square-pixel
+         kernel */
+      if (p->kernel != kernel_square) {
+        *mapping_ptr(p, xi, x1) = (double)x1;
+
+        *mapping_ptr(p, yi, x1) = y;
+        *mapping_ptr(p, yi, x1+1) = 0.0;
+
+
+        if (map_value(p, TRUE, x2 - x1 + 1,
+                      mapping_ptr(p, xi, x1), mapping_ptr(p, yi, x1),
+                      xtmp, ytmp,
+                      mapping_ptr(p, xo, x1), mapping_ptr(p, yo, x1), error)) {
+          goto dobox_rows_exit_;
+        }
+
+        if (kernel_handler(p, y, x1, x2, xo, yo,
+                           &oldcon, &newcon, nmiss, error)) {
+          goto dobox_rows_exit_;
+        }
+      } else {
+        if (do_kernel_square(p, j, y, x1, x2, last_x1, last_x2,
+                             xi, yi, xtmp, ytmp, xo, yo,
+                             &oldcon, &newcon, nmiss, error)) {
+          goto dobox_rows_exit_;
+        }
+      }
+      last_x1 = x1;
+      last_x2 = x2;
+    } else {
+      /* If we are skipping a line, count it */
+      ++(*nskip);
+      *nmiss += p->dnx;
+      last_x1 = p->dnx;
+      last_x2 = 0;
+    }
+  }
+
+ dobox_rows_exit_:
+  free(xi); xi = NULL;
+  free(yi); yi = NULL;
+  free(xo); xo = NULL;
+  free(yo); yo = NULL;
+  free(xtmp); xtmp = NULL;
+  free(ytmp); ytmp = NULL;
+
+  return driz_error_is_set(error);
+}
+
+#ifdef _OPENMP
+/**
+Split the band of output rows [p->ybmin, p->ybmax] into nthreads
+contiguous sub-bands and drizzle each of them in its own thread.
+
+Every output pixel belongs to exactly one sub-band and so is only ever
+updated by one thread, which receives the contributions from the input
+pixels in the same order as a serial run would.  The result is
+therefore identical to that of a single thread.  The mapping callback
+must be safe to call from several threads at once.
+
+The values returned in nmiss and nskip are the smallest of the counts
+from all the threads.  As each thread only counts the input pixels
+which do not fall onto its own sub-band, these are upper limits.
+*/
+static int
+dobox_threads(struct driz_param_t* p, const integer_t ystart,
+              kernel_handler_t kernel_handler, integer_t nthreads,
+              /* Output parameters */
+              integer_t* nmiss, integer_t* nskip, struct driz_error_t* error) {
+  const integer_t nrows = p->ybmax - p->ybmin + 1;
+  integer_t min_nmiss = -1, min_nskip = -1;
+  integer_t t;
+  int failed = 0;
+
+  #pragma omp parallel for num_threads(nthreads) schedule(static, 1)
+  for (t = 0; t < nthreads; ++t) {
+    struct driz_param_t q = *p;
+    struct driz_error_t terr;
+    integer_t tmiss = 0, tskip = 0;
+    int tstat;
+
+    driz_error_init(&terr);
+    q.ybmin = p->ybmin + (nrows * t) / nthreads;
+    q.ybmax = p->ybmin + (nrows * (t + 1)) / nthreads - 1;
+
+    tstat = dobox_rows(&q, ystart, kernel_handler, &tmiss, &tskip, &terr);
+
+    #pragma omp critical (dobox_threads_)
+    {
+      if (tstat) {
+        if (!failed) {
+          driz_error_set_message(error, driz_error_get_message(&terr));
+        }
+        failed = 1;
+      }
+      if (min_nmiss < 0 || tmiss < min_nmiss) min_nmiss = tmiss;
+      if (min_nskip < 0 || tskip < min_nskip) min_nskip = tskip;
+    }
+  }
+
+  *nmiss += min_nmiss;
+  *nskip += min_nskip;
+
+  return failed;
+}
+#endif
+
 /**
 This module does the actual mapping of input flux to output images
 using "boxer", a code written by Bill Sparks for FOC geometric
@@ -1059,6 +1282,9 @@ output is covered, or not.
 
 In V1.6 this was simplified to use the DRIVAL routine and also to
 include some limited multi-kernel support.
+
+When built with OpenMP and p->nthreads > 1, the band of output rows is
+split among that many threads (see dobox_threads()).
 */
 int
 dobox(struct driz_param_t* p, const integer_t ystart,
@@ -1067,21 +1293,12 @@ dobox(struct driz_param_t* p, const integer_t ystart,
   const double nsig = 2.5;
   const size_t nlut = 512;
   const float del = 0.01;
-  integer_t j, x1, x2, last_x1, last_x2;
-  double y, dh, ofrac;
   kernel_handler_t kernel_handler = NULL;
-  integer_t oldcon, newcon;
   integer_t np;
-  double* xi = NULL;
-  double* yi = NULL;
-  double* xtmp = NULL;
-  double* ytmp = NULL;
-  double* xo = NULL;
-  double* yo = NULL;
+  integer_t nthreads;
   float inv_exposure_time;
   float* data_begin, *data_end;
   int kernel_order;
-  size_t new_buffer_size;
   size_t bit_no;
 
   assert(p);
@@ -1097,23 +1314,21 @@ dobox(struct driz_param_t* p, const integer_t ystart,
     return 0;
   }
 
-  /* Some initial settings - note that the reference pixel position is
-     determined by the value of ALIGN */
-  oldcon = -1;
-
   /* The bitmask, trimmed to the appropriate range */
   np = (p->uuid - 1) / 32 + 1;
   bit_no = (size_t)(p->uuid - 1 - (32 * (np - 1)));
   assert(bit_no < 32);
   p->bv = (integer_t)(1 << bit_no);
 
-  /* Before we start we can fill the X arrays as they don't change
-     with Y */
-  new_buffer_size = (size_t)((p->kernel == kernel_square) ? p->dnx*4 : p->dnx);
-
   /* Image subset size */
   p->nsx = p->xmax - p->xmin + 1;
   p->nsy = p->ymax - p->ymin + 1;
+  if (p->ybmax < 0 || p->ybmax > p->nsy - 1) {
+    p->ybmax = p->nsy - 1;
+  }
+  if (p->ybmin < 0) {
+    p->ybmin = 0;
+  }
   assert(p->pixel_fraction != 0.0);
   p->ac = 1.0 / (p->pixel_fraction * p->pixel_fraction);
 
@@ -1157,61 +1372,7 @@ dobox(struct driz_param_t* p, const integer_t ystart,
 
   p->pfo2 = p->pfo*p->pfo;
 
-  /* assert(p->output_done == NULL); */
-  /* p->output_done = malloc(p->nsx * p->nsy * sizeof(integer_t)); */
-  /* if (p->output_done == NULL) { */
-  /*   driz_error_set_message(error, "Out of memory"); */
-  /*   goto dobox_exit_; */
-  /* } */
-  /* for (i = 0; i < p->nsx * p->nsy; ++i) { */
-  /*   p->output_done[i] = 0; */
-  /* } */
-
-  xi = malloc(new_buffer_size * sizeof(double));
-  if (xi == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  yi = malloc(new_buffer_size * sizeof(double));
-  if (yi == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  xtmp = malloc(new_buffer_size * sizeof(double));
-  if (xtmp == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  ytmp = malloc(new_buffer_size * sizeof(double));
-  if (ytmp == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  xo = malloc((new_buffer_size + 1) * sizeof(double));
-  if (xo == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  yo = malloc((new_buffer_size + 1) * sizeof(double));
-  if (yo == NULL) {
-    driz_error_set_message(error, "Out of memory");
-    goto dobox_exit_;
-  }
-
-  if (p->kernel == kernel_square) {
-    dh = 0.5 * p->pixel_fraction;
-    *mapping_4_ptr(p, xi, 1, 0) = 1.0 - dh;
-    *mapping_4_ptr(p, xi, 1, 1) = 1.0 + dh;
-    *mapping_4_ptr(p, xi, 1, 2) = 1.0 + dh;
-    *mapping_4_ptr(p, xi, 1, 3) = 1.0 - dh;
-  } else {
-    *mapping_ptr(p, xi, 0) = 1.0;
-
+  if (p->kernel != kernel_square) {
     /* Set up a function pointer to handle the appropriate kernel */
     if (p->kernel >= kernel_LAST) {
       driz_error_set_message(error, "Invalid kernel type");
@@ -1245,79 +1406,20 @@ dobox(struct driz_param_t* p, const integer_t ystart,
 
   DRIZLOG("-Drizzling using kernel = %s\n",kernel_enum2str(p->kernel));
 
-  /* This is the outer loop over all the lines in the input image */
-  last_x1 = p->dnx;
-  last_x2 = 0;
-  y = (double)ystart;
-  for (j = 0; j < p->ny; ++j) {
-    y += 1.0;
-    /* Check the overlap with the output */
-    if (check_over(p, (integer_t)y, 5, &ofrac, &x1, &x2, error)) {
-      goto dobox_exit_;
-    }
+  /* Never use more threads than there are output rows to share */
+  nthreads = MIN(MAX(p->nthreads, 1), p->ybmax - p->ybmin + 1);
 
-    /* If the line falls completely off the output, then skip it */
-    if (ofrac != 0.0) {
-      assert(x1 > 0 && x1 <= p->dnx);
-      assert(x2 > 0 && x2 <= p->dnx);
-
-      /* We know there may be some misses */
-      *nmiss += p->dnx - (x2 - x1 + 1);
-
-      /* Don't read past the edge of the image
-      if (x2 == p->dnx) {
-          x2 -= 1;
-      }
-      */
-      /* At this point we can handle the different kernels separately.
-         First the cases where we just transform a single point rather
-         than four - every case except the "classic" square-pixel
-         kernel */
-      if (p->kernel != kernel_square) {
-        *mapping_ptr(p, xi, x1) = (double)x1;
-
-        *mapping_ptr(p, yi, x1) = y;
-        *mapping_ptr(p, yi, x1+1) = 0.0;
-
-
-        if (map_value(p, TRUE, x2 - x1 + 1,
-                      mapping_ptr(p, xi, x1), mapping_ptr(p, yi, x1),
-                      xtmp, ytmp,
-                      mapping_ptr(p, xo, x1), mapping_ptr(p, yo, x1), error)) {
-          goto dobox_exit_;
-        }
-
-        if (kernel_handler(p, y, x1, x2, xo, yo,
-                           &oldcon, &newcon, nmiss, error)) {
-          goto dobox_exit_;
-        }
-      } else {
-        if (do_kernel_square(p, j, y, x1, x2, last_x1, last_x2,
-                             xi, yi, xtmp, ytmp, xo, yo,
-                             &oldcon, &newcon, nmiss, error)) {
-          goto dobox_exit_;
-        }
-      }
-      last_x1 = x1;
-      last_x2 = x2;
-    } else {
-      /* If we are skipping a line, count it */
-      ++(*nskip);
-      *nmiss += p->dnx;
-      last_x1 = p->dnx;
-      last_x2 = 0;
-    }
+#ifdef _OPENMP
+  if (nthreads > 1) {
+    dobox_threads(p, ystart, kernel_handler, nthreads, nmiss, nskip, error);
+    goto dobox_exit_;
   }
+#endif
+  dobox_rows(p, ystart, kernel_handler, nmiss, nskip, error);
 
  dobox_exit_:
   free(p->lanczos.lut); p->lanczos.lut = NULL;
   free(p->output_done); p->output_done = NULL;
-  free(xi); xi = NULL;
-  free(yi); yi = NULL;
-  free(xo); xo = NULL;
-  free(yo); yo = NULL;
-  free(xtmp); xtmp = NULL;
-  free(ytmp); ytmp = NULL;
 
   return driz_error_is_set(error);
 }
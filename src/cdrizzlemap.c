@@ -473,6 +473,7 @@ default_wcsmap_init(struct wcsmap_param_t* m,
                     pipeline_t* output,
                     int nx, int ny,
                     double factor,
+                    const double* table,
                     struct driz_error_t* error) {
   int     n;
   int     table_size;
@@ -503,6 +504,18 @@ default_wcsmap_init(struct wcsmap_param_t* m,
     n = (snx) * (sny);
     table_size = n << 1;
 
+    if (table != NULL) {
+      /* Use a table of output positions computed previously, with the same
+         input and output WCS, size and factor. */
+      m->table = malloc(table_size * sizeof(double));
+      if (m->table == NULL) {
+        driz_error_set_message(error, "Out of memory");
+        goto exit;
+      }
+      memcpy(m->table, table, table_size * sizeof(double));
+      goto done;
+    }
+
     pixcrd = malloc(table_size * sizeof(double));
     if (pixcrd == NULL) {
       driz_error_set_message(error, "Out of memory");
@@ -576,6 +589,7 @@ default_wcsmap_init(struct wcsmap_param_t* m,
     }
   } /* End if_then for factor > 0 */
 
+ done:
   m->input_wcs = input;
   m->output_wcs = output;
 
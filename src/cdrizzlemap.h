@@ -48,6 +48,9 @@ default_wcsmap_init(struct wcsmap_param_t* m,
                     pipeline_t* input,
                     pipeline_t* output,
                     int nx, int ny, double factor,
+                    /* Optional table of output positions to use (when not
+                       NULL) instead of computing it from the WCS */
+                    const double* table,
                     /* Output parameters */
                     struct driz_error_t* error);
 
@@ -179,6 +179,11 @@ driz_param_init(struct driz_param_t* p) {
 
   p->nen = 0;
 
+  /* Update all output rows by default */
+  p->ybmin = 0;
+  p->ybmax = -1;
+  p->nthreads = 1;
+
   p->scale = 1.0;
   p->scale2 = 1.0;
   p->x_scale = 1.0;
@@ -382,7 +387,12 @@ put_fill(struct driz_param_t* p, const float fill_value) {
   onx = p->xmax - p->xmin + 1;
   ony = p->ymax - p->ymin + 1;
 
-  for (j = 0; j < ony; ++j) {
+  /* Only fill the band of output rows owned by this call */
+  if (p->ybmax >= 0 && p->ybmax < ony) {
+    ony = p->ybmax + 1;
+  }
+
+  for (j = MAX(p->ybmin, 0); j < ony; ++j) {
     for (i = 0; i < onx; ++i) {
       if (*output_counts_ptr(p, i, j) == 0.0) {
         *output_data_ptr(p, i, j) = fill_value;
@@ -205,6 +205,16 @@ struct driz_param_t {
   bool_t sub;
   bool_t no_over;
 
+  /* Band of output rows (0-based, inclusive, relative to the output
+     subset) which may be updated.  Used to split a single output frame
+     among independent workers; ybmax < 0 means the last row. */
+  integer_t ybmin;
+  integer_t ybmax;
+
+  /* Number of threads among which dobox() splits the band of output
+     rows above (only when built with OpenMP). */
+  integer_t nthreads;
+
   integer_t nsx;
   integer_t nsy;
 
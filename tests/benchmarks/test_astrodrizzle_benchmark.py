@@ -0,0 +1,46 @@
+""" Benchmarks of full `AstroDrizzle` runs on associations of synthetic
+two-chip exposures (run with ``pytest tests/benchmarks``; requires the
+``pytest-benchmark`` plugin).
+
+Save the results with ``--benchmark-autosave`` (as done by ``tox -e
+benchmark``) and compare them across commits with
+``pytest-benchmark compare``. """
+import os
+import shutil
+
+import pytest
+
+from drizzlepac import astrodrizzle
+
+from ..synthetic import make_exposures
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('nexp', [2, 8, 32])
+def test_astrodrizzle(benchmark, tmp_path, nexp):
+    benchmark.group = 'astrodrizzle'
+    inputs = tmp_path / 'inputs'
+    inputs.mkdir()
+    filenames = [os.path.basename(f) for f in make_exposures(inputs, nexp)]
+    cwd = os.getcwd()
+
+    def setup():
+        # AstroDrizzle updates the DQ arrays of its inputs: start each round
+        # from the original files in a new directory.
+        workdir = tmp_path / 'run'
+        shutil.rmtree(workdir, ignore_errors=True)
+        shutil.copytree(inputs, workdir)
+        os.chdir(workdir)
+
+    try:
+        benchmark.pedantic(
+            astrodrizzle.AstroDrizzle, args=(filenames, ),
+            kwargs=dict(output='bench', updatewcs=False, build=True,
+                        clean=True, in_memory=False, num_cores=1),
+            setup=setup, rounds=3
+        )
+        assert os.path.isfile('bench_drz.fits')
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,70 @@
+""" Benchmarks of the drizzling (`cdriz.tdriz`) of a distorted chip onto an
+output frame with each of the kernels, and of its blotting back
+(`cdriz.tblot`) with each of the interpolants (run with
+``pytest tests/benchmarks``; requires the ``pytest-benchmark`` plugin). """
+import numpy as np
+import pytest
+
+from drizzlepac import cdriz
+
+from ..synthetic import make_wcs
+
+pytest.importorskip('pytest_benchmark')
+
+SHAPE = (1024, 1024)
+OUT_SHAPE = (1100, 1100)
+
+
+def _mapping(input_wcs, output_wcs):
+    return cdriz.DefaultWCSMapping(input_wcs, output_wcs,
+                                   input_wcs.pixel_shape[0],
+                                   input_wcs.pixel_shape[1], 1)
+
+
+@pytest.fixture(scope='module')
+def frames():
+    rng = np.random.default_rng(0)
+    input_wcs = make_wcs(SHAPE, chip=1, nchips=1)
+    input_wcs.pixel_shape = SHAPE[::-1]
+    output_wcs = make_wcs(OUT_SHAPE, chip=1, nchips=1, sip=False)
+    output_wcs.pixel_shape = OUT_SHAPE[::-1]
+    sci = rng.normal(80, 9, SHAPE).astype(np.float32)
+    return sci, input_wcs, output_wcs
+
+
+@pytest.mark.parametrize('kernel', ['square', 'point', 'turbo', 'tophat',
+                                    'gaussian', 'lanczos3'])
+def test_tdriz(benchmark, frames, kernel):
+    benchmark.group = 'tdriz'
+    sci, input_wcs, output_wcs = frames
+    wht = np.ones(SHAPE, dtype=np.float32)
+    mapping = _mapping(input_wcs, output_wcs)
+    pixfrac = 0.8 if kernel in ['square', 'turbo', 'tophat'] else 1.0
+
+    def driz():
+        outsci = np.zeros(OUT_SHAPE, dtype=np.float32)
+        outwht = np.zeros(OUT_SHAPE, dtype=np.float32)
+        outctx = np.zeros(OUT_SHAPE, dtype=np.int32)
+        return cdriz.tdriz(sci, wht, outsci, outwht, outctx, 1, 0, 1, 1,
+                           SHAPE[1], 1.0, 1.0, 1.0, 'center', pixfrac,
+                           kernel, 'cps', 1.0, 1.0, 'INDEF', 0, 0, 1,
+                           mapping)
+
+    benchmark(driz)
+
+
+@pytest.mark.parametrize('interp', ['nearest', 'linear', 'poly3', 'poly5',
+                                    'sinc', 'lan3', 'lan5'])
+def test_tblot(benchmark, frames, interp):
+    benchmark.group = 'tblot'
+    sci, input_wcs, output_wcs = frames
+    source = np.full(OUT_SHAPE, 80, dtype=np.float32)
+    mapping = _mapping(input_wcs, output_wcs)
+
+    def blot():
+        outsci = np.zeros(SHAPE, dtype=np.float32)
+        return cdriz.tblot(source, outsci, 1, OUT_SHAPE[1], 1, OUT_SHAPE[0],
+                           1.0, 1.0, 1.0, 1.0, 'center', interp, 1.0, 0.0,
+                           1.0, 1, mapping)
+
+    benchmark(blot)
@@ -0,0 +1,39 @@
+""" Benchmarks of the time taken to import the package and some of its
+modules in a new interpreter, with the cumulative import time of each top
+level module (measured with ``python -X importtime``) saved with the results
+(run with ``pytest tests/benchmarks``; requires the ``pytest-benchmark``
+plugin). """
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+
+def _import_times(stderr):
+    """ Return the cumulative import time (in s) of the top level modules
+    listed in the output of ``python -X importtime``. """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if fields[2].startswith(' ') and not fields[2].startswith('  '):
+            try:
+                times[fields[2].strip()] = int(fields[1]) * 1e-6
+            except ValueError:  # header line
+                pass
+    return times
+
+
+@pytest.mark.parametrize('module', ['drizzlepac', 'drizzlepac.util',
+                                    'drizzlepac.wcs_functions',
+                                    'drizzlepac.astrodrizzle'])
+def test_import(benchmark, module):
+    benchmark.group = 'import'
+    proc = benchmark(subprocess.run,
+                     [sys.executable, '-X', 'importtime', '-c',
+                      'import {:s}'.format(module)],
+                     capture_output=True, text=True, check=True)
+    benchmark.extra_info['import_times'] = _import_times(proc.stderr)
@@ -0,0 +1,19 @@
+""" Benchmarks of the implementations of the 'minmed' combination for a
+section of rows of the median step (run with ``pytest tests/benchmarks``;
+requires the ``pytest-benchmark`` plugin). """
+import pytest
+
+from drizzlepac import minmed
+
+from ..test_minmed import minmed_stack
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.mark.parametrize('nimages', [2, 5, 10, 25, 50, 100])
+@pytest.mark.parametrize('func', [minmed.min_med, minmed.fused_min_med],
+                         ids=['min_med', 'fused_min_med'])
+def test_min_med(benchmark, func, nimages):
+    benchmark.group = f'minmed {nimages:d} images'
+    args, masks = minmed_stack(nimages, shape=(256, 1024))
+    benchmark(func, *args, weight_masks=masks, combine_grow=1)
@@ -0,0 +1,68 @@
+""" Benchmarks of the combination of single drizzled images with
+`numcombine.num_combine` and of the identification of cosmic rays in
+synthetic exposures with `drizCR._driz_cr` (run with
+``pytest tests/benchmarks``; requires the ``pytest-benchmark`` plugin). """
+import os
+
+import numpy as np
+import pytest
+from stsci.image import numcombine
+from stsci.tools import teal
+
+from drizzlepac import astrodrizzle, drizCR, processInput, util
+
+from ..test_minmed import minmed_stack
+from ..synthetic import make_exposures
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.mark.parametrize('nimages', [5, 25])
+@pytest.mark.parametrize('combine_type', ['mean', 'median', 'imedian'])
+def test_num_combine(benchmark, combine_type, nimages):
+    benchmark.group = f'numcombine {nimages:d} images'
+    (sci, wht, *_), masks = minmed_stack(nimages, shape=(256, 1024))
+    benchmark(numcombine.num_combine, sci, masks=masks,
+              combination_type=combine_type, nlow=0, nhigh=1)
+
+
+def _config(filenames, **pars):
+    configobj = teal.load('astrodrizzle', defaults=True)
+    configobj['updatewcs'] = False
+    pars['input'] = ','.join(filenames)
+    return util.getDefaultConfigObj('astrodrizzle', configobj, pars,
+                                    loadOnly=True)
+
+
+@pytest.fixture(scope='module')
+def blotted(tmp_path_factory):
+    """ Synthetic exposures processed up to the blot step, with their image
+    objects. """
+    path = tmp_path_factory.mktemp('drizcr')
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        filenames = make_exposures(path, 4)
+        pars = dict(output='bench', driz_cr=False, driz_combine=False,
+                    clean=False, in_memory=False, num_cores=1)
+        astrodrizzle.AstroDrizzle(filenames, updatewcs=False, **pars)
+        configobj = _config(filenames, **pars)
+        images, _ = processInput.setCommonInput(configobj,
+                                                createOutwcs=False)
+        yield images, configobj
+    finally:
+        os.chdir(cwd)
+
+
+def test_driz_cr(benchmark, blotted):
+    benchmark.group = 'drizcr'
+    images, configobj = blotted
+    pars = configobj[util.getSectionName(configobj, drizCR._STEP_NUM)].dict()
+    pars['crbit'] = configobj['crbit']
+    pars['inmemory'] = False
+
+    def driz_cr():
+        for image in images:
+            drizCR._driz_cr(image, image.virtualOutputs, pars)
+
+    benchmark(driz_cr)
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import numpy as np
+from astropy.io import fits
+
+import cdriz_setup
+from drizzlepac import adrizzle, cdriz, createMedian, outputimage
+
+
+def _chip(shape, angle):
+    w = cdriz_setup.get_wcs(shape[::-1], pscale=0.05)
+    c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    w.wcs.pc = [[c, -s], [s, c]]
+    w.wcs.crval = [10.0005, 10.0003]
+    w.wcs.set()
+    w.pixel_shape = shape[::-1]
+    return SimpleNamespace(wcs=w, wcslin_pscale=0.05)
+
+
+def _tdriz(chip, outwcs, insci):
+    outsci = np.zeros(outwcs.array_shape, dtype=np.float32)
+    outwht = np.zeros(outwcs.array_shape, dtype=np.float32)
+    outctx = np.zeros(outwcs.array_shape, dtype=np.int32)
+    ny, nx = insci.shape
+    mapping = cdriz.DefaultWCSMapping(chip.wcs, outwcs, nx, ny, 1)
+    cdriz.tdriz(insci.copy(), np.ones_like(insci), outsci, outwht, outctx, 1,
+                0, 1, 1, ny, 1.25, 1.0, 1.0, "center", 1.0, "lanczos3", "cps",
+                1.0, 1.0, "INDEF", 0, 0, 1, mapping)
+    return outsci, outwht
+
+
+def test_cropped_single_matches_full_frame():
+    """Drizzling onto the cropped footprint box must give the same pixels
+    as drizzling onto the full output frame, with nothing left outside."""
+    chip = _chip((40, 30), 20.0)
+    outwcs = cdriz_setup.get_wcs((200, 160), pscale=0.04)
+    outwcs.pixel_shape = (200, 160)
+    outwcs.pscale = 0.04
+
+    box = adrizzle._footprint_box([chip], outwcs)
+    assert 0 < box[2] - box[0] < 100 and 0 < box[3] - box[1] < 100
+    cropped = adrizzle._crop_wcs(outwcs, box)
+    assert cropped.frame_offset == (box[0], box[1], 200, 160)
+
+    np.random.seed(0)
+    insci = np.random.randn(40, 30).astype(np.float32)
+    full_sci, full_wht = _tdriz(chip, outwcs, insci)
+    crop_sci, crop_wht = _tdriz(chip, cropped, insci)
+
+    # place the cropped product back on the full frame as the median step does
+    hdr = fits.Header()
+    outputimage.addFrameKeywords(hdr, *cropped.frame_offset)
+    offset = outputimage.getFrameOffset(hdr)
+    section = np.empty(full_sci.shape, dtype=np.float32)
+    createMedian._read_section(crop_sci, offset, 0, full_sci.shape[0], section, 0)
+    weights = np.empty(full_wht.shape, dtype=np.float32)
+    createMedian._read_section(crop_wht, offset, 0, full_wht.shape[0], weights, 0)
+
+    assert np.allclose(section, full_sci, rtol=1e-5, atol=1e-6)
+    assert np.allclose(weights, full_wht, rtol=1e-5, atol=1e-6)
+    assert np.sum(full_wht) > 0
+
+
+def test_full_frame_header():
+    hdr = fits.Header({'CRPIX1': 10.5, 'CRPIX2': -3.0})
+    outputimage.addFrameKeywords(hdr, 7, 12, 300, 200)
+    assert outputimage.getFrameOffset(hdr) == (7, 12, 300, 200)
+
+    full = outputimage.getFullFrameHeader(hdr)
+    assert full['CRPIX1'] == 17.5
+    assert full['CRPIX2'] == 9.0
+    assert outputimage.getFrameOffset(full) is None
+    assert 'LTV1' not in full
+
+    # no negative zero for an image starting at the origin of the frame
+    outputimage.addFrameKeywords(hdr, 0, 0, 300, 200)
+    assert not np.signbit(hdr['LTV1']) and not np.signbit(hdr['LTV2'])
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from astropy import wcs
+
+import cdriz_setup
+from drizzlepac import cdriz, pixmap_cache
+
+
+def _wcs_pair(sip=True):
+    inwcs = cdriz_setup.get_wcs((300, 200), pscale=0.05)
+    inwcs.pixel_shape = (300, 200)
+    if sip:
+        a = np.zeros((3, 3))
+        b = np.zeros((3, 3))
+        a[2, 0] = 1e-5
+        b[0, 2] = -2e-5
+        inwcs.sip = wcs.Sip(a, b, None, None, inwcs.wcs.crpix)
+    outwcs = cdriz_setup.get_wcs((400, 300), pscale=0.04)
+    outwcs.pixel_shape = (400, 300)
+    return inwcs, outwcs
+
+
+def _drizzle(mapping, insci):
+    outsci = np.zeros((300, 400), dtype=np.float32)
+    outwht = np.zeros((300, 400), dtype=np.float32)
+    outctx = np.zeros((300, 400), dtype=np.int32)
+    ny, nx = insci.shape
+    cdriz.tdriz(insci.copy(), np.ones_like(insci), outsci, outwht, outctx, 1,
+                0, 1, 1, ny, 1.25, 1.0, 1.0, "center", 1.0, "square", "cps",
+                1.0, 1.0, "INDEF", 0, 0, 1, mapping)
+    return outsci, outwht
+
+
+def test_mapping_from_table():
+    inwcs, outwcs = _wcs_pair()
+    mapping = cdriz.DefaultWCSMapping(inwcs, outwcs, 300, 200, 10)
+    table = mapping.table
+    assert table.shape == (22, 32, 2)
+    copy = cdriz.DefaultWCSMapping(inwcs, outwcs, 300, 200, 10, table)
+    assert np.array_equal(copy.table, table)
+
+    x = np.linspace(0, 299, 77)
+    y = np.linspace(0, 199, 77)
+    assert np.array_equal(np.array(copy(x, y)), np.array(mapping(x, y)))
+
+    assert cdriz.DefaultWCSMapping(inwcs, outwcs, 300, 200, 0).table is None
+    with pytest.raises(ValueError):
+        cdriz.DefaultWCSMapping(inwcs, outwcs, 300, 201, 5, table)
+
+
+def test_cached_mapping_drizzles_the_same():
+    inwcs, outwcs = _wcs_pair()
+    cache = pixmap_cache.PixmapCache()
+    np.random.seed(0)
+    insci = np.random.randn(200, 300).astype(np.float32)
+
+    first = _drizzle(pixmap_cache.get_mapping(inwcs, outwcs, 300, 200, 10,
+                                              cache=cache), insci)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+    second = _drizzle(pixmap_cache.get_mapping(inwcs, outwcs, 300, 200, 10,
+                                               cache=cache), insci)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+    assert np.array_equal(first[0], second[0])
+    assert np.array_equal(first[1], second[1])
+
+    # a different stepsize is another map
+    pixmap_cache.get_mapping(inwcs, outwcs, 300, 200, 5, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+
+def test_wcs_hash():
+    inwcs, outwcs = _wcs_pair()
+    key = pixmap_cache.wcs_hash(inwcs, outwcs)
+    assert key == pixmap_cache.wcs_hash(*_wcs_pair())
+    assert key != pixmap_cache.wcs_hash(outwcs, inwcs)
+    assert key != pixmap_cache.wcs_hash(*_wcs_pair(sip=False))
+
+    inwcs.sip.a[2, 0] *= 1.0 + 1e-15
+    assert key != pixmap_cache.wcs_hash(inwcs, outwcs)
+
+    inwcs, outwcs = _wcs_pair()
+    outwcs.wcs.crval[0] += 1e-12
+    assert key != pixmap_cache.wcs_hash(inwcs, outwcs)
+
+
+def test_cache_size_limit(tmp_path):
+    table = np.zeros((100, 100, 2))  # 160 kB
+    cache = pixmap_cache.PixmapCache(max_size=0.4, cache_dir=str(tmp_path))
+    for k in range(4):
+        cache.put(str(k), table + k)
+    assert len(cache) == 2
+    assert cache.get('0') is None and cache.get('1') is None
+    assert cache.get('3')[0, 0, 0] == 3
+
+    assert len(list(tmp_path.glob('pixmap_*.npy'))) == 2
+
+    # tables saved to disk are found by other caches using the directory
+    other = pixmap_cache.PixmapCache(cache_dir=str(tmp_path))
+    assert isinstance(other.get('2'), np.memmap)
+    assert other.get('2')[0, 0, 0] == 2
+
+    disabled = pixmap_cache.PixmapCache(max_size=0)
+    disabled.put('0', table)
+    assert len(disabled) == 0 and disabled.get('0') is None
@@ -0,0 +1,102 @@
+""" Tests of the helpers used by runastrodriz to verify the alignment of
+candidate WCS solutions. """
+import os
+
+import pytest
+
+from drizzlepac import runastrodriz, util
+
+from ..synthetic import PSCALE, make_exposures
+
+
+def _fake_verify_alignment(inlist, calfiles, calfiles_flc, trlfile,
+                           tmpdir=None, products=None, fail=False, **pars):
+    os.makedirs(tmpdir, exist_ok=True)
+    with open(os.path.join(tmpdir, trlfile), 'w') as f:
+        f.write('{:s} {}\n'.format(tmpdir, pars['num_cores']))
+    with open(os.path.join(tmpdir, calfiles[0]), 'w') as f:
+        f.write(tmpdir)
+    products.append(calfiles[0])
+    if fail:
+        raise ValueError('alignment failed')
+    return [{'alignment_verified': True, 'pid': os.getpid()}], None
+
+
+def test_concurrent_verify_alignment(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(runastrodriz, 'verify_alignment',
+                        _fake_verify_alignment)
+    with open('j8c0d1011_drz.tra', 'w') as f:
+        f.write('start\n')
+    args = (['j8c0d1011_asn.fits'], ['j8c0d1aaq_flt.fits'], None,
+            'j8c0d1011_drz.tra')
+
+    wait = runastrodriz._start_verify_alignment(*args, tmpdir='apriori',
+                                                num_cores=2)
+    result, products, err = runastrodriz._run_verify_alignment(
+        *args, tmpdir='aposteriori', num_cores=1
+    )
+    (focus_dicts, _), apriori_products = wait()
+    assert err is None
+    assert focus_dicts[0]['pid'] != result[0][0]['pid'] == os.getpid()
+    assert apriori_products == products == ['j8c0d1aaq_flt.fits']
+    # nothing gets saved in the parent directory until asked to
+    assert not os.path.exists('j8c0d1aaq_flt.fits')
+
+    runastrodriz._save_alignment_products('apriori', apriori_products,
+                                          args[-1])
+    runastrodriz._save_alignment_products('aposteriori', products, args[-1])
+    with open(args[-1]) as f:
+        assert f.read() == 'start\napriori 2\naposteriori 1\n'
+    with open('j8c0d1aaq_flt.fits') as f:
+        assert f.read() == 'aposteriori'
+
+    wait = runastrodriz._start_verify_alignment(*args, tmpdir='failed',
+                                                num_cores=1, fail=True)
+    with pytest.raises(RuntimeError, match='alignment failed'):
+        wait()
+
+
+@pytest.mark.parametrize('num_cores, cpu_count, expected', [
+    (None, 8, [4, 4]), (5, 8, [3, 2]), (None, 1, None), (1, 8, None)
+])
+def test_split_num_cores(monkeypatch, num_cores, cpu_count, expected):
+    monkeypatch.setattr(util, 'can_parallel', cpu_count > 1)
+    monkeypatch.setattr(util, '_cpu_count', cpu_count)
+    assert runastrodriz._split_num_cores(num_cores) == expected
+
+
+def test_clone_file(tmp_path):
+    filename = tmp_path / 'j8c0d1aaq_flt.fits'
+    filename.write_bytes(b'original')
+    (tmp_path / 'apriori').mkdir()
+    newname = runastrodriz._clone_file(str(filename), str(tmp_path / 'apriori'))
+    assert newname == str(tmp_path / 'apriori' / 'j8c0d1aaq_flt.fits')
+    with open(newname, 'r+b') as f:
+        assert f.read() == b'original'
+        f.seek(0)
+        f.write(b'modified')
+    assert filename.read_bytes() == b'original'
+
+
+@pytest.mark.parametrize('overlap', [True, False])
+def test_verification_pars(tmp_path, overlap):
+    filenames = make_exposures(tmp_path, 3, shape=(256, 512), nstars=20)
+    pipeline_pars = dict(runastrodriz.PIPELINE_PARS, final_wcs=True,
+                         final_rot=0.0, final_scale=PSCALE)
+    pars = runastrodriz.verification_pars(filenames, pipeline_pars,
+                                          block=2, overlap=overlap)
+    assert runastrodriz.PIPELINE_PARS['mdriztab']
+    assert not (pars['mdriztab'] or pars['median'] or pars['driz_cr'])
+
+    for prefix in ['driz_sep_', 'final_']:
+        assert pars[prefix + 'wcs'] and pars[prefix + 'rot'] is None
+        assert pars[prefix + 'scale'] == pytest.approx(2 * PSCALE, rel=1e-3)
+        if overlap:
+            # the three dithers are 2.5 pixels apart along X only
+            assert pars[prefix + 'outnx'] == pytest.approx(507 / 2, abs=1)
+            assert pars[prefix + 'outny'] == pytest.approx(
+                (2 * 256 + 50) / 2, abs=1
+            )
+        else:
+            assert pars[prefix + 'outnx'] is None
@@ -0,0 +1,210 @@
+""" Generator of synthetic HST-like exposures for the tests and benchmarks.
+
+The exposures mimic calibrated ACS/WFC ``_flt.fits`` files: a primary header
+with the instrument keywords used by AstroDrizzle, followed by ``SCI``,
+``ERR`` and ``DQ`` extensions for each chip, with a TAN-SIP WCS. They see
+the same field of stars (with a Gaussian PSF), dithered from one exposure to
+the next, on top of a flat sky with noise, cosmic rays and bad columns
+flagged in the DQ arrays. No reference file is needed to process them with
+``updatewcs=False``.
+
+"""
+import numpy as np
+from astropy import wcs
+from astropy.io import fits
+
+__all__ = ['make_wcs', 'make_exposure', 'make_exposures']
+
+PSCALE = 0.05  # arcsec / pixel
+CRVAL = (150.1, 2.2)
+CHIP_GAP = 50  # pixels
+
+
+def make_wcs(shape, chip=1, nchips=2, offset=(0.0, 0.0), sip=True):
+    """ Return the WCS of ``chip`` (chips are stacked along Y, chip 1 on
+    top) of an exposure dithered by ``offset`` pixels. """
+    ny, nx = shape
+    w = wcs.WCS(naxis=2)
+    w.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    w.wcs.crval = CRVAL
+    # reference pixel at the center of the full detector
+    ystart = (nchips - chip) * (ny + CHIP_GAP)
+    w.wcs.crpix = [nx / 2.0 - offset[0],
+                   (nchips * ny + (nchips - 1) * CHIP_GAP) / 2.0 - ystart -
+                   offset[1]]
+    w.wcs.cd = np.array([[-PSCALE, 0.0], [0.0, PSCALE]]) / 3600.0
+    if sip:
+        a = np.zeros((3, 3))
+        b = np.zeros((3, 3))
+        a[2, 0] = 2e-6
+        a[1, 1] = -1e-6
+        b[0, 2] = 1.5e-6
+        b[1, 1] = 1e-6
+        w.wcs.ctype = ['RA---TAN-SIP', 'DEC--TAN-SIP']
+        w.sip = wcs.Sip(a, b, None, None, w.wcs.crpix)
+    w.wcs.set()
+    return w
+
+
+def _stars(nstars, rng):
+    """ Sky positions (RA, Dec) and fluxes of the stars in the field. """
+    half = 1.1 * 4096 * PSCALE / 3600.0 / 2.0
+    ra = CRVAL[0] + rng.uniform(-half, half, nstars) / np.cos(
+        np.deg2rad(CRVAL[1]))
+    dec = CRVAL[1] + rng.uniform(-half, half, nstars)
+    flux = 10**rng.uniform(3, 5.5, nstars)
+    return ra, dec, flux
+
+
+def _render(shape, x, y, flux, sigma=1.2, radius=6):
+    image = np.zeros(shape, dtype=np.float32)
+    ny, nx = shape
+    for xc, yc, f in zip(x, y, flux):
+        x1, x2 = int(xc) - radius, int(xc) + radius + 1
+        y1, y2 = int(yc) - radius, int(yc) + radius + 1
+        if x2 <= 0 or y2 <= 0 or x1 >= nx or y1 >= ny:
+            continue
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, nx), min(y2, ny)
+        yy, xx = np.mgrid[y1:y2, x1:x2]
+        r2 = (xx - xc)**2 + (yy - yc)**2
+        image[y1:y2, x1:x2] += (f / (2 * np.pi * sigma**2) *
+                                np.exp(-r2 / (2 * sigma**2)))
+    return image
+
+
+def _cosmic_rays(shape, ncr, rng):
+    image = np.zeros(shape, dtype=np.float32)
+    ny, nx = shape
+    for k in range(ncr):
+        x, y = rng.integers(0, nx), rng.integers(0, ny)
+        length = rng.integers(1, 6)
+        dx, dy = rng.choice([-1, 0, 1], 2)
+        for i in range(length):
+            xi, yi = x + i * dx, y + i * dy
+            if 0 <= xi < nx and 0 <= yi < ny:
+                image[yi, xi] += rng.uniform(500, 5000)
+    return image
+
+
+def make_exposure(filename, shape=(512, 1024), nchips=2, offset=(0.0, 0.0),
+                  exptime=500.0, sky=80.0, nstars=200, crfrac=0.002,
+                  seed=0, sip=True):
+    """ Write a synthetic exposure to ``filename``.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the output file, which should end with ``_flt.fits``.
+
+    shape : tuple of int
+        Shape (ny, nx) of each chip.
+
+    nchips : int
+        Number of chips (``SCI``, ``ERR`` and ``DQ`` extensions for each).
+
+    offset : tuple of float
+        Dither offset (in pixels) of the exposure.
+
+    exptime : float
+        Exposure time (in s).
+
+    sky : float
+        Sky level (in electrons).
+
+    nstars : int
+        Number of stars in the whole field (the same for all exposures).
+
+    crfrac : float
+        Fraction of the pixels hit by cosmic rays.
+
+    seed : int
+        Seed for the noise and the cosmic rays of this exposure.
+
+    sip : bool
+        Include a SIP distortion in the WCS.
+
+    """
+    rng = np.random.default_rng(seed)
+    star_ra, star_dec, star_flux = _stars(nstars, np.random.default_rng(0))
+    rootname = filename.split('/')[-1].split('_')[0]
+    rdnoise = 4.0
+
+    phdr = fits.Header()
+    phdr['ROOTNAME'] = rootname
+    phdr['TELESCOP'] = 'HST'
+    phdr['INSTRUME'] = 'ACS'
+    phdr['DETECTOR'] = 'WFC'
+    phdr['FILTER1'] = 'F606W'
+    phdr['FILTER2'] = 'CLEAR2L'
+    phdr['EXPTIME'] = exptime
+    phdr['EXPSTART'] = 58000.0 + seed * 0.01
+    phdr['EXPEND'] = phdr['EXPSTART'] + exptime / 86400.0
+    phdr['DATE-OBS'] = '2017-09-04'
+    phdr['TIME-OBS'] = '00:00:00'
+    phdr['CCDGAIN'] = 2.0
+    phdr['CCDAMP'] = 'ABCD'
+    phdr['FLASHDUR'] = 0.0
+    phdr['FLASHSTA'] = 'NOT PERFORMED'
+    for amp in 'ABCD':
+        phdr['ATODGN' + amp] = 2.0
+        phdr['READNSE' + amp] = rdnoise
+    phdr['NEXTEND'] = 3 * nchips
+    for key in ['PFLTFILE', 'IDCTAB', 'NPOLFILE', 'D2IMFILE', 'DGEOFILE',
+                'MDRIZTAB']:
+        phdr[key] = 'N/A'
+
+    hdus = [fits.PrimaryHDU(header=phdr)]
+    for chip in range(1, nchips + 1):
+        w = make_wcs(shape, chip, nchips, offset, sip)
+        x, y = w.all_world2pix(star_ra, star_dec, 0)
+        signal = _render(shape, x, y, star_flux * exptime / 500.0)
+        signal += sky
+        sci = (rng.poisson(signal).astype(np.float32) +
+               rng.normal(0, rdnoise, shape).astype(np.float32))
+        sci += _cosmic_rays(shape, int(crfrac * sci.size), rng)
+        err = np.sqrt(np.abs(sci) + rdnoise**2).astype(np.float32)
+        dq = np.zeros(shape, dtype=np.int16)
+        dq[:, rng.integers(0, shape[1], 3)] = 4  # bad columns
+        dq[rng.random(shape) < 1e-4] = 16  # hot pixels
+
+        hdr = w.to_header(relax=True)
+        # HST headers use a CD matrix instead of PC and CDELT
+        for i in (1, 2):
+            del hdr['CDELT{:d}'.format(i)]
+            for j in (1, 2):
+                hdr.remove('PC{:d}_{:d}'.format(i, j), ignore_missing=True)
+                hdr['CD{:d}_{:d}'.format(i, j)] = w.wcs.cd[i - 1, j - 1]
+        hdr['EXPNAME'] = rootname
+        hdr['BUNIT'] = 'ELECTRONS'
+        hdr['CCDCHIP'] = 3 - chip if nchips == 2 else chip
+        hdr['LTV1'] = 0.0
+        hdr['LTV2'] = 0.0
+        hdr['LTM1_1'] = 1.0
+        hdr['LTM2_2'] = 1.0
+        hdr['MEANDARK'] = 1.0
+        hdr['ORIENTAT'] = 0.0
+        hdr['VAFACTOR'] = 1.0
+        hdr['IDCSCALE'] = PSCALE
+        hdr['WCSNAME'] = 'SYNTHETIC'
+        hdr['NGOODPIX'] = int((dq == 0).sum())
+        hdus.append(fits.ImageHDU(sci, header=hdr, name='SCI', ver=chip))
+        hdus.append(fits.ImageHDU(err, header=hdr, name='ERR', ver=chip))
+        hdus.append(fits.ImageHDU(dq, header=hdr, name='DQ', ver=chip))
+
+    fits.HDUList(hdus).writeto(filename, overwrite=True)
+    return filename
+
+
+def make_exposures(path, nexp, **kwargs):
+    """ Write ``nexp`` dithered synthetic exposures in directory ``path`` and
+    return their file names. """
+    filenames = []
+    for k in range(nexp):
+        # dither pattern of up to 4 x 4 positions, with sub-pixel steps
+        offset = (2.5 * (k % 4) + 0.25 * (k // 16),
+                  2.5 * ((k // 4) % 4) + 0.5 * (k // 16))
+        filename = '{:s}/jbench{:03d}q_flt.fits'.format(str(path), k)
+        filenames.append(make_exposure(filename, offset=offset, seed=k + 1,
+                                       **kwargs))
+    return filenames
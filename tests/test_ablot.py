@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from drizzlepac import ablot, util
+
+
+def _images(path, nimages=3, nchips=2):
+    median = str(path / 'median.fits')
+    fits.writeto(median, np.arange(200, dtype=np.float32).reshape(10, 20))
+    images = []
+    for k in range(nimages):
+        chips = [SimpleNamespace(outputNames={},
+                                 sciname=f'img{k:d}_flt.fits[SCI,{i + 1:d}]')
+                 for i in range(nchips)]
+        img = SimpleNamespace(
+            inmemory=False, scienceExt='SCI',
+            outputNames={'outMedian': median},
+            returnAllChips=lambda extname, chips=chips: chips,
+        )
+        img.getOutputName = lambda name, img=img: img.outputNames[name]
+        images.append(img)
+    return images
+
+
+@pytest.mark.parametrize('parallel_backend', ['process', 'thread'])
+def test_shared_median(monkeypatch, tmp_path, parallel_backend):
+    """The median image gets read once and shared by all chips."""
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 4)
+
+    loads = []
+    load_median = ablot._load_median
+
+    def _load_median(img):
+        loads.append(img)
+        return load_median(img)
+
+    blotted = []
+
+    def _run_blot_chip(img, chip, median, *args):
+        blotted.append((chip, median))
+
+    monkeypatch.setattr(ablot, '_load_median', _load_median)
+    monkeypatch.setattr(ablot, '_run_blot_chip', _run_blot_chip)
+
+    images = _images(tmp_path)
+    num_cores = 4 if parallel_backend == 'thread' else 1
+    ablot.run_blot(images, None, {'num_cores': num_cores,
+                                  'parallel_backend': parallel_backend})
+
+    assert len(loads) == 1
+    assert len(blotted) == 6
+    assert all(median is blotted[0][1] for chip, median in blotted)
+    assert np.array_equal(blotted[0][1],
+                          fits.getdata(images[0].outputNames['outMedian']))
+    assert all(chip.outputNames['driz_version'] for chip, median in blotted)
+
+
+def test_parallel_processes(monkeypatch, tmp_path):
+    """Chips get blotted by forked workers sharing the median image."""
+    import multiprocessing
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 4)
+    monkeypatch.setattr(ablot, 'multiprocessing', multiprocessing,
+                        raising=False)
+
+    def _run_blot_chip(img, chip, median, *args):
+        # workers write out their products themselves:
+        np.save(tmp_path / f'{id(chip)}.npy', median)
+
+    monkeypatch.setattr(ablot, '_run_blot_chip', _run_blot_chip)
+
+    images = _images(tmp_path)
+    worker_times = util.WorkerTimes()
+    ablot.run_blot(images, None, {'num_cores': 3,
+                                  'parallel_backend': 'process'},
+                   worker_times=worker_times)
+    assert (worker_times.workers, worker_times.backend) == (3, 'process')
+    records = worker_times.records()
+    assert sorted(r[0] for r in records) == sorted(
+        chip.sciname for img in images for chip in img.returnAllChips('SCI')
+    )
+    assert all(elapsed >= 0 and cpu >= 0 for _, _, elapsed, cpu in records)
+
+    median = fits.getdata(images[0].outputNames['outMedian'])
+    for img in images:
+        for chip in img.returnAllChips('SCI'):
+            assert np.array_equal(np.load(tmp_path / f'{id(chip)}.npy'),
+                                  median)
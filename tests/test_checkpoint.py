@@ -0,0 +1,145 @@
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+from astropy.io import fits
+
+from drizzlepac import checkpoint, util
+
+
+def _image(path, k):
+    """ Minimal stand-in for an imageObject with one chip. """
+    fname = str(path / f'img{k}_flt.fits')
+    data = np.arange(100, dtype=np.float32).reshape(10, 10) + k
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.ImageHDU(data, name='SCI', ver=1)]).writeto(fname)
+
+    chip = SimpleNamespace(
+        sciname=f'{fname}[SCI,1]', wcs=None, subtractedSky=0.0,
+        computedSky=None,
+        outputNames={'outSingle': str(path / f'img{k}_single_sci.fits'),
+                     'outFinal': str(path / 'final_drz.fits'),
+                     'staticMask': None}
+    )
+    return SimpleNamespace(_filename=fname, scienceExt='SCI',
+                           returnAllChips=lambda extname: [chip])
+
+
+def _reopen(image):
+    """ New stand-in for the same input file, as in a new run. """
+    chip = SimpleNamespace(**vars(image.returnAllChips('SCI')[0]))
+    chip.subtractedSky, chip.computedSky = 0.0, None
+    chip.outputNames = dict(chip.outputNames, staticMask=None)
+    return SimpleNamespace(_filename=image._filename, scienceExt='SCI',
+                           returnAllChips=lambda extname: [chip])
+
+
+def _configobj():
+    return {
+        'input': '*flt.fits', 'num_cores': 1, 'resume': True,
+        'STATE OF INPUT FILES': {'clean': False},
+        'STEP 1: STATIC MASK': {'static': True},
+        'STEP 2: SKY SUBTRACTION': {'skysub': True},
+        'STEP 3: DRIZZLE SEPARATE IMAGES': {'driz_separate': True},
+        'STEP 7: DRIZZLE FINAL COMBINED IMAGE': {'final_pixfrac': 1.0},
+    }
+
+
+class _Steps:
+    """ Processing steps writing their outputs and recording their calls. """
+    def __init__(self, images):
+        self.images = images
+        self.calls = []
+
+    def __call__(self, step):
+        self.calls.append(step)
+        for img in self.images:
+            chip = img.returnAllChips('SCI')[0]
+            if step == 'Static Mask':
+                chip.outputNames['staticMask'] = 'mask.fits'
+            elif step == 'Subtract Sky':
+                chip.subtractedSky = chip.computedSky = np.float32(1.5)
+            elif step == 'Separate Drizzle':
+                fits.writeto(chip.outputNames['outSingle'], np.zeros((2, 2)),
+                             overwrite=True)
+            elif step == 'Final Drizzle':
+                fits.writeto(chip.outputNames['outFinal'], np.zeros((2, 2)),
+                             overwrite=True)
+
+    def run(self, ckpt):
+        for step, _ in checkpoint.STEPS:
+            ckpt.run(step, self, step)
+
+
+def test_resume(tmp_path):
+    manifest = str(tmp_path / 'final_drz_checkpoint.json')
+    images = [_image(tmp_path, k) for k in range(2)]
+    steps = _Steps(images)
+    steps.run(checkpoint.Checkpoint(manifest, images, _configobj(),
+                                    resume=True))
+    assert len(steps.calls) == 7
+    with open(manifest) as f:
+        assert set(json.load(f)['steps']) == {s for s, _ in checkpoint.STEPS}
+
+    # nothing changed: all steps are reused and their values restored
+    fresh = [_reopen(img) for img in images]
+    chips = [img.returnAllChips('SCI')[0] for img in fresh]
+    procSteps = util.ProcSteps()
+    resumed = _Steps(fresh)
+    resumed.run(checkpoint.Checkpoint(manifest, fresh, _configobj(),
+                                      resume=True, procSteps=procSteps))
+    assert resumed.calls == []
+    assert all(procSteps.steps[s]['reused'] for s, _ in checkpoint.STEPS)
+    for chip in chips:
+        assert chip.subtractedSky == chip.computedSky == 1.5
+        assert chip.outputNames['staticMask'] == 'mask.fits'
+
+    # only the final drizzle step is run again when its parameters change
+    configobj = _configobj()
+    configobj['STEP 7: DRIZZLE FINAL COMBINED IMAGE']['final_pixfrac'] = 0.8
+    resumed = _Steps(fresh)
+    resumed.run(checkpoint.Checkpoint(manifest, fresh, configobj,
+                                      resume=True))
+    assert resumed.calls == ['Final Drizzle']
+
+    # a modified output is computed again, along with all following steps
+    fits.writeto(chips[1].outputNames['outSingle'], np.ones((30, 30)),
+                 overwrite=True)
+    resumed = _Steps(fresh)
+    resumed.run(checkpoint.Checkpoint(manifest, fresh, configobj,
+                                      resume=True))
+    assert resumed.calls == [s for s, _ in checkpoint.STEPS][2:]
+
+    # without resume, all steps are run and nothing gets hashed or recorded
+    os.remove(manifest)
+    resumed = _Steps(fresh)
+    ckpt = checkpoint.Checkpoint(manifest, fresh, configobj, resume=False)
+    resumed.run(ckpt)
+    assert len(resumed.calls) == 7
+    assert ckpt.hashes == {} and not os.path.exists(manifest)
+
+
+def test_step_hashes(tmp_path):
+    images = [_image(tmp_path, k) for k in range(2)]
+    hashes = checkpoint.Checkpoint('x', images, _configobj(),
+                                   resume=True).hashes
+
+    configobj = _configobj()
+    configobj['num_cores'] = 4
+    configobj['STATE OF INPUT FILES']['clean'] = True
+    assert checkpoint.Checkpoint('x', images, configobj,
+                                 resume=True).hashes == hashes
+
+    configobj['STEP 2: SKY SUBTRACTION']['skysub'] = False
+    changed = checkpoint.Checkpoint('x', images, configobj,
+                                   resume=True).hashes
+    assert [changed[s] == hashes[s] for s, _ in checkpoint.STEPS] == \
+        [True] + [False] * 6
+
+    # the data of the input files is part of all hashes
+    with fits.open(images[1]._filename, mode='update') as hdulist:
+        hdulist['SCI'].data[0, 0] += 1
+    changed = checkpoint.Checkpoint('x', images, _configobj(),
+                                   resume=True).hashes
+    assert all(changed[s] != hashes[s] for s, _ in checkpoint.STEPS)
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from stsci.imagestats import ImageStats
+
+from drizzlepac import chipstats, staticMask, util
+
+
+def _sky(shape=(1024, 2048), seed=1):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 10, shape).astype(np.float32)
+    # cosmic rays, and a few columns and pixels that were over-subtracted
+    data[rng.random(shape) < 0.02] += 500
+    data[:, 100:102] -= 300
+    data[rng.random(shape) < 0.001] -= 300
+    return data
+
+
+def test_all_pixels():
+    data = _sky()
+    expected = ImageStats(data, fields='mode', nclip=3)
+    stats = chipstats.sampled_stats(data, fields='mode', nclip=3)
+    assert stats.mode == expected.mode and stats.stddev == expected.stddev
+    assert np.array_equal(stats.histogram, expected.histogram)
+    assert stats.nsample == data.size and stats.error == 0
+    assert str(stats) == 'from all {:d} pixels'.format(data.size)
+
+    # unreachable accuracy
+    stats = chipstats.sampled_stats(data, fields='mode', tolerance=1e-6,
+                                    nclip=3)
+    assert stats.mode == expected.mode and stats.nsample == data.size
+
+
+@pytest.mark.parametrize('sampling', ['strided', 'random'])
+@pytest.mark.parametrize('fields, tolerance', [('mode', 0.1),
+                                               ('median', 0.01),
+                                               ('mean', 0.01)])
+def test_sampled(sampling, fields, tolerance):
+    data = _sky()
+    stats = chipstats.sampled_stats(data, fields=fields, tolerance=tolerance,
+                                    sampling=sampling, nclip=3)
+    assert stats.field == fields
+    assert stats.nsample < data.size / 2
+    assert stats.error <= tolerance * stats.stddev
+    assert stats.stddev == pytest.approx(10, rel=0.02)
+    assert getattr(stats, fields) == pytest.approx(100, abs=5 * stats.error)
+    assert str(stats).startswith('from {:d} of'.format(stats.nsample))
+
+    again = chipstats.sampled_stats(data, fields=fields, tolerance=tolerance,
+                                    sampling=sampling, nclip=3)
+    assert getattr(again, fields) == getattr(stats, fields)
+
+    with pytest.raises(ValueError):
+        chipstats.sampled_stats(data, tolerance=0.1, sampling='grid')
+
+
+class _Chip:
+    def __init__(self, data, signature):
+        self.data = data
+        self.signature = signature
+        self.outputNames = {}
+
+
+class _Image:
+    scienceExt = 'SCI'
+    group = None
+
+    def __init__(self, filename, seed):
+        self._filename = filename
+        self._chips = {'SCI,{:d}'.format(k): _Chip(
+            _sky(shape=(256, 512), seed=seed + k), ('WFC', (256, 512), k)
+        ) for k in (1, 2)}
+
+    def getExtensions(self):
+        return [1, 2]
+
+    def getData(self, chipid):
+        return self._chips[chipid].data
+
+    def __getitem__(self, chipid):
+        return self._chips[chipid]
+
+
+@pytest.mark.parametrize('tolerance', [None, 0.1])
+def test_static_mask_workers(monkeypatch, tolerance):
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 4)
+    config = {'STEP 1: STATIC MASK': {'static_sig': 4.0,
+                                      'static_tolerance': tolerance}}
+    images = [_Image('j8c0d1{:d}q_flt.fits'.format(k), 10 * k)
+              for k in range(4)]
+
+    serial = staticMask.staticMask(config)
+    for image in images:
+        serial.addMember(image)
+    parallel = staticMask.staticMask(config)
+    parallel.addMembers(images, num_cores=4)
+
+    assert len(parallel.masklist) == 2
+    for signature, mask in serial.masklist.items():
+        assert np.array_equal(parallel.masklist[signature], mask)
+        assert np.all(mask[:, 100:102] == 0)
+        assert 0.99 < mask.mean() < 1
+    assert images[0]['SCI,2'].outputNames['staticMask'] == \
+        staticMask.constructFilename(('WFC', (256, 512), 2))
@@ -0,0 +1,120 @@
+import multiprocessing
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from drizzlepac import createMedian, util
+
+
+def _single_images(n=5, shape=(300, 200), path=None):
+    """ Minimal stand-ins for imageObjects with single drizzle products, as
+    used by createMedian._median(). The products are kept in memory unless
+    a ``path`` is given to write them to. """
+    rng = np.random.default_rng(1)
+    images = []
+    for k in range(n):
+        sci = rng.normal(10, 2, shape).astype(np.float32)
+        sci[rng.random(shape) < 0.01] += 500
+        wht = np.full(shape, 100.0, dtype=np.float32)
+        wht[:, :10 * k] = 0
+        wht[:50 * k] = 0  # footprints covering fewer rows
+        sci[wht == 0] = 0
+
+        chip = SimpleNamespace(subtractedSky=1.0, _conversionFactor=1.0,
+                               _rdnoise=3.0, _exptime=100.0)
+        names = {'outSingle': f'sci{k}.fits', 'outSWeight': f'wht{k}.fits',
+                 'outMedian': 'median.fits'}
+        virtual = {}
+        if path is None:
+            virtual = {names['outSingle']: fits.HDUList([fits.PrimaryHDU(sci)]),
+                       names['outSWeight']: fits.HDUList([fits.PrimaryHDU(wht)])}
+        else:
+            names = {k: str(path / v) for k, v in names.items()}
+            fits.writeto(names['outSingle'], sci)
+            fits.writeto(names['outSWeight'], wht)
+
+        img = SimpleNamespace(
+            inmemory=path is None, native_units='ELECTRONS',
+            _filename=f'img{k}', scienceExt='SCI', _image={('sci', 1): chip},
+            outputNames=names, virtualOutputs=virtual,
+            getGain=lambda extver: 1.0,
+            returnAllChips=lambda extname, chip=chip: [chip],
+        )
+        img.getOutputName = lambda name, img=img: img.virtualOutputs.get(
+            img.outputNames[name], img.outputNames[name])
+        img.saveVirtualOutputs = lambda d, img=img: img.virtualOutputs.update(d)
+        images.append(img)
+    return images
+
+
+def _median(combine_type, num_cores=None, parallel_backend='process',
+            path=None):
+    images = _single_images(path=path)
+    paramDict = {
+        'median_newmasks': True, 'combine_type': combine_type,
+        'combine_nlow': 0, 'combine_nhigh': 1, 'combine_grow': 1,
+        'combine_maskpt': 0.3, 'proc_unit': 'native', 'compress': False,
+        'combine_bufsize': 0.05, 'combine_nsigma': '4 3',
+        'combine_lthresh': None, 'combine_hthresh': None,
+        'num_cores': num_cores, 'parallel_backend': parallel_backend,
+    }
+    createMedian._median(images, paramDict)
+    if path is not None:
+        return fits.getdata(images[0].outputNames['outMedian'])
+    return images[0].virtualOutputs['median.fits'][0].data
+
+
+@pytest.mark.parametrize('combine_type', ['minmed', 'median'])
+@pytest.mark.parametrize('parallel_backend', ['process', 'thread'])
+def test_parallel_sections(monkeypatch, combine_type, parallel_backend):
+    """Combining sections in parallel workers must give the same median
+    image as combining them one after another."""
+    serial = _median(combine_type, num_cores=1)
+
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 4)
+    monkeypatch.setattr(createMedian, 'multiprocessing', multiprocessing,
+                        raising=False)
+    parallel = _median(combine_type, num_cores=3,
+                       parallel_backend=parallel_backend)
+
+    assert np.array_equal(serial, parallel)
+
+
+@pytest.mark.parametrize('combine_type', ['minmed', 'median'])
+def test_memory_mapped_singles(tmp_path, combine_type):
+    """Single drizzle products read from (memory-mapped) files and from
+    memory must give the same median image."""
+    (tmp_path / 'files').mkdir()
+    from_files = _median(combine_type, path=tmp_path / 'files')
+    in_memory = _median(combine_type)
+    assert np.array_equal(from_files, in_memory)
+
+
+@pytest.mark.parametrize('combine_type', ['minmed', 'median', 'imedian'])
+def test_sparse_sections(monkeypatch, combine_type):
+    """Combining each section only from the inputs overlapping it must give
+    the same median image as combining all inputs everywhere."""
+    sparse = _median(combine_type)
+
+    def all_inputs(footprints, e1, e2, min_inputs):
+        return np.arange(len(footprints))
+
+    monkeypatch.setattr(createMedian, '_section_inputs', all_inputs)
+    dense = _median(combine_type)
+
+    assert np.array_equal(sparse, dense)
+
+
+def test_section_inputs():
+    rows = np.zeros(100, dtype=bool)
+    footprints = [rows.copy() for k in range(5)]
+    footprints[3][40:60] = True
+    footprints[4][50:] = True
+    assert list(createMedian._section_inputs(footprints, 0, 30, 1)) == [0]
+    assert list(createMedian._section_inputs(footprints, 55, 70, 1)) == [0, 3, 4]
+    assert list(createMedian._section_inputs(footprints, 60, 70, 3)) == [0, 1, 4]
+    footprints[1] = None
+    assert list(createMedian._section_inputs(footprints, 0, 30, 1)) == [0, 1]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from drizzlepac import drizCR, quickDeriv
+
+
+def _cr_mask_convolve(input_image, blot_data, blot_deriv, gain, rn, backg,
+                      snr, scale, grow, ctegrow, cte_dir):
+    """ The original computation of the cosmic ray mask in drizCR._driz_cr,
+    from convolutions of the masks. """
+    snr1, snr2 = snr
+    mult1, mult2 = scale
+    t1 = np.absolute(input_image - blot_data)
+    ta = np.sqrt(gain * np.abs(blot_data + backg) + rn**2)
+    t2 = (mult1 * blot_deriv + snr1 * ta / gain)
+    tmp1 = t1 <= t2
+    kernel = np.ones((3, 3), dtype=np.uint16)
+    tmp2 = signal.convolve2d(tmp1, kernel, boundary='symm', mode='same')
+    t2 = (mult2 * blot_deriv + snr2 * ta / gain)
+    cr_mask = (t1 <= t2) | (tmp2 >= 9)
+
+    cr_grow_kernel = np.ones((grow, grow), dtype=np.uint16)
+    cr_grow_kernel_conv = signal.convolve2d(
+        cr_mask, cr_grow_kernel, boundary='symm', mode='same'
+    )
+    cr_ctegrow_kernel = np.zeros((2 * ctegrow + 1, 2 * ctegrow + 1))
+    if cte_dir == 1:
+        cr_ctegrow_kernel[0:ctegrow, ctegrow] = 1
+    elif cte_dir == -1:
+        cr_ctegrow_kernel[ctegrow+1:2*ctegrow+1, ctegrow] = 1
+    cr_ctegrow_kernel_conv = signal.convolve2d(
+        cr_mask, cr_ctegrow_kernel, boundary='symm', mode='same'
+    )
+    cr_grow_mask = cr_grow_kernel_conv >= grow**2
+    cr_ctegrow_mask = cr_ctegrow_kernel_conv >= ctegrow
+    return cr_grow_mask & cr_ctegrow_mask
+
+
+@pytest.mark.parametrize('grow', [1, 2, 3, 4])
+@pytest.mark.parametrize('ctegrow', [0, 1, 2, 5])
+@pytest.mark.parametrize('cte_dir', [1, -1, 0])
+def test_cr_mask(grow, ctegrow, cte_dir):
+    rng = np.random.default_rng(grow + 10 * ctegrow)
+    blot = rng.normal(100, 20, (47, 38)).astype(np.float32)
+    blot[20:25, 10:14] += 2000
+    sci = blot + rng.normal(0, 12, blot.shape).astype(np.float32)
+    sci[rng.random(blot.shape) < 0.03] += 500
+    sci[0, :] += 500
+    sci[:, -1] += 500
+    deriv = quickDeriv.qderiv(blot)
+    args = (sci, blot, deriv, 1.5, 4.0, np.float64(20.0), (4.0, 3.0),
+            (0.5, 0.4), grow, ctegrow, cte_dir)
+
+    expected = _cr_mask_convolve(*args)
+    result = drizCR._cr_mask(*args)
+    assert result.dtype == np.bool_
+    assert np.array_equal(result, expected)
+    assert 0 < np.sum(~expected) < expected.size or ctegrow and cte_dir == 0
@@ -32,3 +32,87 @@ class TestimageObject():
         assert(image._naxis1 > 0)
         assert(image._naxis2 > 0)
         assert(image._instrument != '')
+
+
+def test_mask_cache():
+    import numpy as np
+
+    cache = imageObject.MaskCache(max_size=1)
+    assert cache.get(1, 4096) is None
+
+    mask = (np.arange(1001 * 3) % 3 == 0).astype(np.uint8).reshape(1001, 3)
+    cache.put(1, 4096, mask)
+    cached = cache.get(1, 4096)
+    assert cached.dtype == np.uint8
+    np.testing.assert_array_equal(cached, mask)
+    # a new copy is returned each time
+    cached[0, 0] = 0
+    np.testing.assert_array_equal(cache.get(1, 4096), mask)
+    assert cache.nbytes == (mask.size + 7) // 8
+
+    # bits given as strings or numbers are kept apart
+    assert cache.get(1, '4096') is None
+    assert cache.get(2, 4096) is None
+    assert cache.stats() == {'hits': 2, 'misses': 3, 'nmasks': 1,
+                             'nbytes': cache.nbytes}
+
+    # least recently used masks get evicted
+    big = np.ones((1024, 1024 * 4), dtype=np.uint8)
+    cache.put(2, 0, big)
+    cache.put(3, 0, big)
+    assert len(cache) == 2
+    assert cache.get(1, 4096) is None
+    assert cache.get(3, 0) is not None
+
+    cache.invalidate(3)
+    assert cache.get(3, 0) is None
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_constant_array():
+    import numpy as np
+
+    shape = (5, 7)
+    rn = imageObject.constant_image(shape, np.float32, 4.5)
+    dark = imageObject.constant_image(shape, np.float32, 0.01)
+    sky = imageObject.constant_image(shape, np.float32, 31.2)
+    assert rn.shape == shape and rn.dtype == np.float32 and rn.value == 4.5
+
+    # operations between constants do not allocate full arrays
+    noise = dark + sky * 2.0 + rn**2
+    assert isinstance(noise, imageObject.ConstantArray)
+    assert noise.shape == shape
+
+    # same results as with full arrays
+    full = [np.ones(shape, dtype=np.float32) * v for v in (4.5, 0.01, 31.2)]
+    flat = np.linspace(0.9, 1.1, 35, dtype=np.float32).reshape(shape)
+    dq = (np.arange(35) % 4 != 0).astype(np.uint8).reshape(shape)
+    expected = flat**2 / (full[1] + full[2] * flat + full[0]**2) * dq
+
+    noise = sky * flat
+    noise = imageObject._combine(np.add, noise, dark, tmp=noise)
+    noise = imageObject._combine(np.add, noise, rn**2, tmp=noise)
+    ivm = flat**2
+    ivm = imageObject._combine(np.divide, ivm, noise, tmp=ivm)
+    ivm = imageObject._combine(np.multiply, ivm, dq, tmp=ivm)
+    assert ivm.dtype == expected.dtype
+    np.testing.assert_array_equal(ivm, expected)
+
+    # temporary arrays of a different type are not reused
+    tmp = np.ones(shape, dtype=np.float32)
+    res = imageObject._combine(np.multiply, tmp, 2.0 * np.ones(shape), tmp=tmp)
+    assert res is not tmp and res.dtype == np.float64
+
+    np.testing.assert_array_equal(np.asarray(1.0 / rn), 1.0 / full[0])
+    assert rn.astype(np.float64).dtype == np.float64
+
+    # augmented assignments rebind the name to the result instead of
+    # writing into the constant
+    scaled = rn
+    scaled *= 2.0
+    assert isinstance(scaled, imageObject.ConstantArray)
+    assert scaled.value == 9.0 and rn.value == 4.5
+    scaled += flat
+    assert isinstance(scaled, np.ndarray)
+    np.testing.assert_array_equal(scaled, 9.0 + flat)
@@ -0,0 +1,56 @@
+""" Import regression tests: importing the package, or one of its
+lightweight modules, must not import all the task modules and their heavy
+dependencies, which get imported when first accessed instead. """
+import json
+import subprocess
+import sys
+
+import pytest
+
+import drizzlepac
+
+# Modules which are only needed by some of the tasks
+HEAVY_MODULES = ['matplotlib', 'scipy.signal', 'photutils', 'skypac',
+                 'fitsblender', 'stsci.tools.teal', 'tkinter']
+
+# Task modules which must only be imported when accessed
+LAZY_MODULES = ['adrizzle', 'ablot', 'astrodrizzle', 'createMedian', 'drizCR',
+                'haputils', 'align', 'tweakreg']
+
+
+def _import(statement):
+    """ Run ``statement`` in a new interpreter and return the names of the
+    imported modules. """
+    code = statement + '; import sys, json; print(json.dumps(sorted(sys.modules)))'
+    proc = subprocess.run([sys.executable, '-c', code],
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def test_import_package():
+    modules = _import('import drizzlepac')
+    assert [m for m in modules if m.startswith('drizzlepac.')] == []
+    for name in HEAVY_MODULES:
+        assert name not in modules
+
+
+def test_lazy_import():
+    modules = _import('import drizzlepac; drizzlepac.adrizzle')
+    assert 'drizzlepac.adrizzle' in modules
+    for name in LAZY_MODULES[1:]:
+        assert 'drizzlepac.' + name not in modules
+
+
+@pytest.mark.parametrize('module', ['util', 'wcs_functions', 'refcache'])
+def test_import_module(module):
+    modules = _import('from drizzlepac import {:s}'.format(module))
+    assert 'drizzlepac.' + module in modules
+    for name in HEAVY_MODULES:
+        assert name not in modules
+
+
+def test_lazy_attributes():
+    assert 'astrodrizzle' in dir(drizzlepac)
+    assert 'tweakreg' in drizzlepac.__all__
+    with pytest.raises(AttributeError):
+        drizzlepac.no_such_module
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from drizzlepac import minmed
+
+
+def minmed_stack(nimages, shape=(60, 50), seed=0):
+    """ A section of single drizzle science and weight images with cosmic
+    rays, partial footprints and masks as built by the median step, together
+    with the other arguments of `minmed.min_med`. """
+    rng = np.random.default_rng(seed)
+    sci = rng.normal(10, 2, (nimages, ) + shape).astype(np.float32)
+    sci[rng.random(sci.shape) < 0.02] += 300
+    wht = rng.uniform(50, 150, (nimages, ) + shape).astype(np.float32)
+    wht[rng.random(sci.shape) < 0.2] = 0
+    wht[:, :, :5] = 0  # no coverage at all
+    sci[wht == 0] = 0
+    masks = wht < 60
+    args = (sci, wht, list(rng.uniform(3, 5, nimages)),
+            list(rng.uniform(100, 500, nimages)),
+            list(rng.uniform(0, 20, nimages)))
+    return args, masks
+
+
+@pytest.mark.parametrize('nimages', [2, 3, 7, 30, 100])
+@pytest.mark.parametrize('combine_grow', [0, 1, 2])
+@pytest.mark.parametrize('fillval', [False, True])
+@pytest.mark.parametrize('use_masks', [True, False])
+def test_fused_min_med(nimages, combine_grow, fillval, use_masks):
+    args, masks = minmed_stack(nimages)
+    kwargs = dict(weight_masks=masks if use_masks else None,
+                  combine_grow=combine_grow, fillval=fillval)
+    expected = minmed.min_med(*args, **kwargs)
+    result = minmed.fused_min_med(*args, **kwargs)
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_fused_min_med_nan():
+    args, masks = minmed_stack(5)
+    args[0][0, 10:20] = np.nan
+    args[0][1:, 15] = np.nan
+    expected = minmed.min_med(*args, weight_masks=masks)
+    result = minmed.fused_min_med(*args, weight_masks=masks)
+    assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_fused_min_med_grow_too_large():
+    args, masks = minmed_stack(3, shape=(4, 50))
+    with pytest.raises(ValueError):
+        minmed.fused_min_med(*args, weight_masks=masks, combine_grow=3)
@@ -0,0 +1,164 @@
+import multiprocessing
+import shutil
+
+import pytest
+from astropy.io import fits
+from stwcs.wcsutil import altwcs, wcscorr
+
+from drizzlepac import processInput, util
+
+from .synthetic import make_exposures
+
+
+class _Chip:
+    shape = (2048, 4096)
+
+
+class _Image:
+    _numchips = 2
+    _nmembers = 2
+
+    def __getitem__(self, chip):
+        return _Chip()
+
+
+class _WCS:
+    pixel_shape = (8000, 8000)
+
+
+def _config(num_cores='auto', bufsize='auto'):
+    return {'num_cores': num_cores, 'in_memory': False,
+            'STEP 4: CREATE MEDIAN IMAGE': {'combine_bufsize': bufsize}}
+
+
+@pytest.fixture
+def cores(monkeypatch):
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 16)
+
+
+def test_auto_tune(monkeypatch, cores):
+    images = [_Image() for _ in range(10)]
+    outwcs = _WCS()
+    mb = 1048576
+
+    # plenty of memory: one worker per CPU core
+    monkeypatch.setattr(util, 'get_available_memory', lambda: 10**6 * mb)
+    config = _config()
+    messages = processInput.autoTuneResources(images, outwcs, config)
+    assert config['num_cores'] == 16
+    # buffers are not larger than the median image
+    bufsize = config['STEP 4: CREATE MEDIAN IMAGE']['combine_bufsize']
+    assert bufsize == 245
+    assert len(messages) == 3 and messages[1].startswith('num_cores = 16')
+
+    # limited memory: fewer workers and smaller buffers
+    monkeypatch.setattr(util, 'get_available_memory', lambda: 8000 * mb)
+    config = _config()
+    processInput.autoTuneResources(images, outwcs, config)
+    num_cores = config['num_cores']
+    assert 1 < num_cores < 16
+    assert processInput.estimateMemoryUsage(
+        images, outwcs, num_cores)[0] <= 0.8 * 8000 * mb
+    assert processInput.estimateMemoryUsage(
+        images, outwcs, num_cores + 1)[0] > 0.8 * 8000 * mb
+    bufsize = config['STEP 4: CREATE MEDIAN IMAGE']['combine_bufsize']
+    assert 1 <= bufsize < 245
+    assert bufsize * mb * 2.25 * len(images) * num_cores <= \
+        0.8 * 8000 * mb - 8000 * 8000 * 4
+
+
+def test_auto_tune_explicit(monkeypatch, cores):
+    monkeypatch.setattr(util, 'get_available_memory', lambda: None)
+    config = _config(num_cores=4, bufsize=None)
+    assert processInput.autoTuneResources([_Image()], _WCS(), config) == []
+    assert config == _config(num_cores=4, bufsize=None)
+
+    # unknown available memory: defaults
+    config = _config()
+    processInput.autoTuneResources([_Image()], _WCS(), config)
+    assert config['num_cores'] == 2
+    assert config['STEP 4: CREATE MEDIAN IMAGE']['combine_bufsize'] is None
+
+
+def _alternate_wcs_exposures(path, nexp):
+    """ Exposures whose primary WCS is offset from the alternate WCS 'A'
+    (named 'TEST'), along with copies updated with the `stwcs` functions
+    that work on whole files. """
+    filenames = make_exposures(path, nexp, shape=(64, 128), nstars=5)
+    extlist = [('SCI', 1), ('SCI', 2)]
+    expected = []
+    for filename in filenames:
+        altwcs.archive_wcs(filename, extlist, wcskey='O', wcsname='OPUS')
+        altwcs.archive_wcs(filename, extlist, wcskey='A', wcsname='TEST')
+        with fits.open(filename, mode='update') as hdulist:
+            for extn in extlist:
+                hdulist[extn].header['CRVAL1'] += 0.01
+        expected.append(filename.replace('.fits', '_expected.fits'))
+        shutil.copy(filename, expected[-1])
+        altwcs.restoreWCS(expected[-1], extlist, wcskey='A')
+        wcscorr.init_wcscorr(expected[-1])
+    return filenames, expected
+
+
+def test_update_wcs_headers(tmp_path):
+    (filename, ), (expected, ) = _alternate_wcs_exposures(tmp_path, 1)
+    with fits.open(filename) as hdulist:
+        data = [hdu.data.copy() for hdu in hdulist[1:]]
+        header_space = [hdulist.fileinfo(k)['datLoc'] -
+                        hdulist.fileinfo(k)['hdrLoc']
+                        for k in range(len(hdulist))]
+
+    assert processInput._update_wcs_headers(filename, wcskey='A',
+                                            wcsname=' ')
+    assert fits.FITSDiff(filename, expected).identical
+    with fits.open(filename) as hdulist:
+        assert hdulist[-1].name == 'WCSCORR'
+        for k, hdu in enumerate(hdulist[:-1]):
+            info = hdulist.fileinfo(k)
+            assert info['datLoc'] - info['hdrLoc'] == header_space[k]
+            if k > 0:
+                assert (hdu.data == data[k - 1]).all()
+
+    # headers that outgrow their space in the file are left untouched
+    with fits.open(filename, mode='update') as hdulist:
+        header = hdulist['SCI', 1].header
+        del header['WCSNAME']
+        while (len(header) + 1) % 36:
+            header['COMMENT'] = 'fills the last header block'
+    shutil.copy(filename, expected)
+    assert not processInput._update_wcs_headers(filename, wcskey='A',
+                                                wcsname=' ')
+    assert fits.FITSDiff(filename, expected).identical
+
+
+@pytest.mark.parametrize('num_cores', [1, 2])
+def test_process_input_wcs(tmp_path, monkeypatch, num_cores):
+    monkeypatch.setattr(util, 'can_parallel', True)
+    monkeypatch.setattr(util, '_cpu_count', 2)
+    monkeypatch.setattr(processInput, 'multiprocessing', multiprocessing,
+                        raising=False)
+    filenames, expected = _alternate_wcs_exposures(tmp_path, 3)
+    assert processInput._process_input_wcs(
+        filenames, 'TEST', False, num_cores=num_cores
+    ) == filenames
+    for filename, expected_filename in zip(filenames, expected):
+        assert fits.FITSDiff(filename, expected_filename).identical
+
+
+def test_resource_pars():
+    # values read from .cfg files are strings
+    config = _config(num_cores='4', bufsize=' auto')
+    processInput.interpretResourcePars(config)
+    assert config == _config(num_cores=4, bufsize='auto')
+
+    config = _config(num_cores='None', bufsize='2.5')
+    processInput.interpretResourcePars(config)
+    assert config == _config(num_cores=None, bufsize=2.5)
+
+    config = _config(num_cores=3, bufsize=None)
+    processInput.interpretResourcePars(config)
+    assert config == _config(num_cores=3, bufsize=None)
+
+    with pytest.raises(ValueError):
+        processInput.interpretResourcePars(_config(num_cores='many'))
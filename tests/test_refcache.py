@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from drizzlepac import refcache
+
+
+def _write_flat(filename, value=1.0):
+    hdulist = fits.HDUList([fits.PrimaryHDU(header=fits.Header({
+        'DETECTOR': 'WFC', 'FILTER1': 'F606W'}))])
+    for chip in (1, 2):
+        hdulist.append(fits.ImageHDU(
+            data=np.full((20, 30), value * chip, dtype=np.float32),
+            name='SCI', ver=chip))
+    hdulist.writeto(filename, overwrite=True)
+
+
+def test_reference_cache(tmp_path):
+    filename = str(tmp_path / 'flat_pfl.fits')
+    _write_flat(filename)
+    cache = refcache.ReferenceCache()
+
+    data = cache.getdata(filename, ('sci', 2))
+    assert data.shape == (20, 30) and np.all(data == 2)
+    with pytest.raises(ValueError):
+        data[0, 0] = 0
+
+    # the same array is returned for equivalent extensions
+    assert cache.getdata(filename, 'SCI,2') is data
+    assert cache.getdata(filename, 'sci,1') is not data
+    assert cache.getval(filename, 'detector') == 'WFC'
+    assert cache.getval(filename, 'filter2', default='N/A') == 'N/A'
+    with pytest.raises(KeyError):
+        cache.getval(filename, 'filter2')
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 3
+    assert len(cache) == 3 and cache.nbytes == 2 * data.nbytes
+
+    # modified files get read again
+    _write_flat(filename, value=3.0)
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert np.all(cache.getdata(filename, ('sci', 2)) == 6)
+    assert len(cache) == 3
+
+    with pytest.raises(FileNotFoundError):
+        cache.getdata(str(tmp_path / 'missing_pfl.fits'), ('sci', 1))
+
+
+def test_reference_cache_size(tmp_path):
+    filename = str(tmp_path / 'flat_pfl.fits')
+    _write_flat(filename)
+    nbytes = 20 * 30 * 4
+    cache = refcache.ReferenceCache(max_size=1.5 * nbytes / 1048576)
+
+    cache.getdata(filename, ('sci', 1))
+    cache.getdata(filename, ('sci', 2))
+    assert len(cache) == 1 and cache.nbytes == nbytes
+    cache.getdata(filename, ('sci', 2))
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'nentries': 1,
+                             'nbytes': nbytes}
+
+    cache.clear()
+    assert len(cache) == 0
+    cache.max_size = 0
+    cache.getdata(filename, ('sci', 1))
+    assert len(cache) == 0
@@ -0,0 +1,76 @@
+import multiprocessing
+import pickle
+from multiprocessing import resource_tracker
+
+import numpy as np
+from astropy.io import fits
+
+from drizzlepac import shared_outputs
+
+
+def _product():
+    sci = shared_outputs.shared_zeros((100, 200), np.float32)
+    sci[...] = np.arange(20000).reshape(100, 200)
+    ctx = shared_outputs.shared_zeros((1, 100, 200), np.int32)
+    ctx[0, 2, 3] = 5
+    hdulist = fits.HDUList([
+        fits.PrimaryHDU(data=sci, header=fits.Header({'FILETYPE': 'SCI'})),
+        fits.ImageHDU(data=ctx[0], name='CTX'),
+        fits.ImageHDU(data=np.ones((3, 4), dtype=np.int16), name='DQ'),
+        fits.BinTableHDU.from_columns([fits.Column('A', 'J', array=[1, 2])]),
+    ])
+    return hdulist, (sci, ctx)
+
+
+def test_roundtrip():
+    hdulist, (sci, ctx) = _product()
+    desc = pickle.loads(pickle.dumps(shared_outputs.SharedHDUList(hdulist)))
+    # arrays are not pickled, except those of tables
+    assert len(pickle.dumps(desc)) < sci.nbytes
+
+    shared = desc.to_hdulist(unlink=True)
+    assert isinstance(shared, fits.HDUList) and len(shared) == 4
+    assert shared[0].header['FILETYPE'] == 'SCI'
+    assert shared[1].name == 'CTX'
+    for hdu, ref in zip(shared, hdulist):
+        np.testing.assert_array_equal(hdu.data, ref.data)
+
+    # same memory for arrays which already were in shared memory
+    sci[0, 0] = -1
+    ctx[0, 99, 199] = 7
+    assert shared[0].data[0, 0] == -1
+    assert shared[1].data[99, 199] == 7
+
+    shared_outputs.unlink(sci)
+    shared_outputs.unlink(ctx)
+
+
+def test_single_hdu():
+    mask = fits.PrimaryHDU(data=np.arange(6, dtype=np.float32).reshape(2, 3))
+    hdu = shared_outputs.SharedHDUList(mask).to_hdulist(unlink=True)
+    assert isinstance(hdu, fits.PrimaryHDU)
+    np.testing.assert_array_equal(hdu.data, mask.data)
+
+
+def _worker(products):
+    hdulist, _ = _product()
+    hdulist[0].data *= 2
+    products['single'] = shared_outputs.SharedHDUList(hdulist)
+
+
+def test_from_process():
+    # as in adrizzle.run_driz, where blocks are allocated before forking,
+    # workers must share the resource tracker of this process
+    resource_tracker.ensure_running()
+    mp_ctx = multiprocessing.get_context('fork')
+    with mp_ctx.Manager() as manager:
+        products = manager.dict()
+        p = mp_ctx.Process(target=_worker, args=(products,))
+        p.start()
+        p.join()
+        assert p.exitcode == 0
+        hdulist = products['single'].to_hdulist(unlink=True)
+
+    np.testing.assert_array_equal(hdulist[0].data,
+                                  2 * np.arange(20000).reshape(100, 200))
+    assert hdulist[1].data[2, 3] == 5
@@ -0,0 +1,116 @@
+""" Tests of the cache of the sky values computed by ``skymatch``. """
+import json
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from stsci.tools import teal
+
+from drizzlepac import astrodrizzle, processInput, sky, skycache, util
+
+from .synthetic import make_exposures
+
+
+def test_digests():
+    data = np.arange(12, dtype=np.float32).reshape(3, 4)
+    assert skycache.array_digest(data) == skycache.array_digest(data.copy())
+    assert skycache.array_digest(data) != \
+        skycache.array_digest(data.reshape(4, 3))
+    assert skycache.array_digest(data) != \
+        skycache.array_digest(data.astype('>f4'))
+    assert skycache.array_digest(None) is None
+
+    header = fits.Header([('CRVAL1', 150.1), ('CRVAL2', 2.2)])
+    digest = skycache.header_digest(header)
+    header['MDRIZSKY'] = 1.5
+    header.add_history('sky subtracted')
+    assert skycache.header_digest(header) == digest
+    header['CRVAL1'] = 150.2
+    assert skycache.header_digest(header) != digest
+
+
+def test_cache_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'sky.json')
+    cache = skycache.SkyMatchCache(filename)
+    assert len(cache) == 0 and not os.path.exists(filename)
+
+    chips = [{'header': 'a', 'data': 'b', 'mask': None},
+             {'header': 'c', 'data': 'd', 'mask': 'e'}]
+    key = cache.key({'skymethod': 'match'}, chips)
+    assert key != cache.key({'skymethod': 'localmin'}, chips)
+    assert cache.get(key) is None and cache.changed_chips(chips) is None
+    cache.put(key, chips, [1.5, np.float32(2.5)], names=['a[1]', 'a[2]'])
+
+    cache = skycache.SkyMatchCache(filename)
+    assert cache.get(key) == [1.5, 2.5]
+    assert cache.changed_chips(chips) == 0
+    assert cache.changed_chips([chips[0], dict(chips[1], mask='f')]) == 1
+    assert os.listdir(str(tmp_path)) == ['sky.json']
+
+    monkeypatch.setattr(skycache, 'MAX_ENTRIES', 3)
+    for k in range(5):
+        cache.put(str(k), chips, [k, k])
+    assert len(skycache.SkyMatchCache(filename)) == 3
+    assert cache.get(key) is None and cache.get('4') == [4, 4]
+
+    with open(filename, 'w') as f:
+        f.write('{"version": 1, "entries": ')
+    assert len(skycache.SkyMatchCache(filename)) == 0
+    with open(filename, 'w') as f:
+        json.dump({'version': 0, 'entries': {key: {}}}, f)
+    assert len(skycache.SkyMatchCache(filename)) == 0
+
+
+def _sky_values(filenames, **pars):
+    configobj = teal.load(astrodrizzle.__taskname__, defaults=True)
+    configobj['updatewcs'] = False
+    pars['input'] = ','.join(filenames)
+    configobj = util.getDefaultConfigObj(astrodrizzle.__taskname__, configobj,
+                                         pars, loadOnly=True)
+    images, _ = processInput.setCommonInput(configobj, createOutwcs=False)
+    sky.subtractSky(images, configobj)
+    return [image['SCI', k].computedSky for image in images for k in (1, 2)]
+
+
+@pytest.mark.parametrize('num_cores', [1, 4])
+def test_sky_cache(tmp_path, monkeypatch, num_cores):
+    monkeypatch.setattr(util, 'can_parallel', num_cores > 1)
+    monkeypatch.setattr(util, '_cpu_count', num_cores)
+    monkeypatch.chdir(tmp_path)
+    filenames = make_exposures(tmp_path, 2, shape=(256, 512), nstars=20)
+    pars = dict(output='sky', skysub=True, skymethod='localmin',
+                use_static=False, sky_cache='sky.json', num_cores=num_cores,
+                in_memory=num_cores > 1)
+
+    computed = _sky_values(filenames, **pars)
+    assert all(computed)
+    assert len(skycache.SkyMatchCache('sky.json')) == 1
+
+    def no_skymatch(*args, **kwargs):
+        raise AssertionError('skymatch should not run')
+
+    with monkeypatch.context() as m:
+        m.setattr(sky, '_runSkymatch', no_skymatch)
+        assert _sky_values(filenames, **pars) == computed
+
+    # any change to the data, the masks or the parameters needs new values
+    with fits.open(filenames[1], mode='update') as hdulist:
+        for k in (1, 2):
+            hdulist['SCI', k].data += 10
+    assert _sky_values(filenames, **pars)[2:] == \
+        pytest.approx([s + 10 for s in computed[2:]], abs=0.5)
+    _sky_values(filenames, **dict(pars, sky_bits='~0'))
+    _sky_values(filenames, **dict(pars, skystat='mode'))
+    assert len(skycache.SkyMatchCache('sky.json')) == 4
+
+
+def test_sky_cache_unwritable(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filenames = make_exposures(tmp_path, 2, shape=(256, 512), nstars=20)
+    cache_file = str(tmp_path / 'missing' / 'sky.json')
+    computed = _sky_values(filenames, output='sky', skysub=True,
+                           skymethod='localmin', use_static=False,
+                           sky_cache=cache_file, num_cores=1)
+    assert all(computed)
+    assert not os.path.exists(cache_file)
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from drizzlepac import util
+
+
+def _run_steps():
+    procSteps = util.ProcSteps()
+    procSteps.addStep('Static Mask')
+    procSteps.endStep('Static Mask')
+    procSteps.addStep('Driz_CR')
+    for chip in ['a_flt.fits', 'b_flt.fits']:
+        procSteps.addStep('Driz_CR', chip=chip)
+        sum(range(10000))
+        procSteps.endStep('Driz_CR', chip=chip)
+    procSteps.endStep('Driz_CR')
+    procSteps.setStepInfo('Driz_CR', nchips=2, npix=200, workers=1)
+    procSteps.reuseStep('Final Drizzle')
+    return procSteps
+
+
+def test_telemetry_jsonl(tmp_path):
+    procSteps = _run_steps()
+    filename = util.telemetry_filename(str(tmp_path / 'j8bt06010.tra'))
+    assert filename.endswith('j8bt06010_telemetry.jsonl')
+    procSteps.writeTelemetry(filename)
+
+    with open(filename) as f:
+        records = [json.loads(line) for line in f]
+
+    assert [(r['step'], r['chip']) for r in records] == [
+        ('Static Mask', None), ('Driz_CR', None), ('Driz_CR', 'a_flt.fits'),
+        ('Driz_CR', 'b_flt.fits'), ('Final Drizzle', None)
+    ]
+    for r in records[:4]:
+        assert r['wall_time'] >= 0 and r['cpu_time'] >= 0
+        assert not r['reused']
+    assert records[1]['nchips'] == 2 and records[1]['npix'] == 200
+    assert records[-1]['reused'] and records[-1]['wall_time'] == 0
+
+
+def test_telemetry_chrome(tmp_path):
+    procSteps = _run_steps()
+    filename = util.telemetry_filename(str(tmp_path / 'j8bt06010.tra'),
+                                       format='chrome')
+    procSteps.writeTelemetry(filename, format='chrome')
+
+    with open(filename) as f:
+        events = json.load(f)['traceEvents']
+    assert [e['name'] for e in events] == [
+        'Static Mask', 'Driz_CR', 'a_flt.fits', 'b_flt.fits', 'Final Drizzle'
+    ]
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+    assert events[2]['cat'] == 'Driz_CR'
+
+    with pytest.raises(ValueError):
+        procSteps.writeTelemetry(filename, format='csv')
+
+
+def test_available_memory(monkeypatch):
+    available = util.get_available_memory()
+    if available is None:
+        pytest.skip('available memory is not known on this platform')
+    assert available > 0
+
+    # cgroup limit
+    values = {'/sys/fs/cgroup/memory.max': 100 * 1048576,
+              '/sys/fs/cgroup/memory.current': 40 * 1048576}
+    monkeypatch.setattr(util, '_read_memory_value', values.get)
+    assert util.get_available_memory() == min(available, 60 * 1048576)
+
+    # no limit
+    values['/sys/fs/cgroup/memory.max'] = None
+    values['/sys/fs/cgroup/memory/memory.limit_in_bytes'] = 2**63 - 4096
+    assert abs(util.get_available_memory() - available) < 64 * 1048576
+
+
+@pytest.mark.parametrize('process', [False, True])
+def test_worker_times(tmp_path, process):
+    worker_times = util.WorkerTimes()
+    worker_times.workers = 2
+    worker_times.backend = 'process' if process else 'thread'
+    tasks = [worker_times.wrap(chip, sum, process=process)
+             for chip in ['a_flt.fits', 'b_flt.fits', 'c_flt.fits']]
+    for task in tasks[1:]:
+        task(range(10000))
+
+    procSteps = util.ProcSteps()
+    procSteps.addStep('Blot')
+    procSteps.endStep('Blot')
+    procSteps.addWorkerTimes('Blot', worker_times)
+    procSteps.addWorkerTimes('Driz_CR', worker_times)
+    filename = str(tmp_path / 'telemetry.jsonl')
+    procSteps.writeTelemetry(filename)
+
+    with open(filename) as f:
+        records = [json.loads(line) for line in f]
+    # tasks that were never run leave no record
+    assert [(r['step'], r['chip']) for r in records] == [
+        ('Blot', None), ('Blot', 'b_flt.fits'), ('Blot', 'c_flt.fits')
+    ]
+    assert records[0]['workers'] == 2
+    assert records[0]['backend'] == worker_times.backend
+    for r in records[1:]:
+        assert r['wall_time'] >= 0 and r['cpu_time'] >= 0